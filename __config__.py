@@ -27,6 +27,79 @@ else:
     FILE_DEBUG_LEVEL = logging.WARNING
     CONSOLE_DEBUG_LEVEL = logging.INFO
 
+# Sensor readings are written to the database in batches, whichever limit is reached first.
+DB_BATCH_ROWS = 500
+DB_BATCH_INTERVAL_MS = 2000
+# "insert" for multi-row INSERTs or "copy" for COPY FROM STDIN (PostgreSQL only, other
+# databases fall back to executemany). COPY_FORMAT is "text" or "binary".
+DB_INGEST_MODE = "copy"
+DB_COPY_FORMAT = "binary"
+# Connection pool settings, sizing and timeout are not used by SQLite.
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 2
+DB_POOL_TIMEOUT = 30  # seconds to wait for a connection before giving up
+DB_POOL_RECYCLE = 3600  # seconds before a connection is replaced
+DB_POOL_PRE_PING = True
+# On PostgreSQL a new Sensor Readings table is partitioned by month, partitions are
+# created MONTHS_AHEAD months in advance by the maintenance thread every INTERVAL seconds.
+DB_PARTITION_READINGS = True
+DB_PARTITION_MONTHS_AHEAD = 2
+DB_MAINTENANCE_INTERVAL = 3600
+# Threads used to rebuild the hourly and daily rollups, keep within the pool size.
+DB_ROLLUP_WORKERS = 4
+# Days to keep raw readings and the hourly and daily rollups, None keeps them forever.
+# Raw readings are downsampled into the rollups before they are removed. Rows are
+# deleted RETENTION_BATCH_ROWS at a time.
+DB_RETENTION_DAYS = {"raw": 90, "hourly": 730, "daily": None}
+DB_RETENTION_BATCH_ROWS = 5000
+# Rows fetched from the server per NumPy array yielded by database.read_readings.
+DB_READ_CHUNK_ROWS = 100000
+# Seconds before the cached Nodes and Sensors tables are reloaded from the database.
+DB_METADATA_CACHE_TTL = 300
+# Readings that cannot be written to the database are kept in this SQLite file and
+# replayed DRAIN_ROWS at a time once it is back, retrying every RETRY_SECONDS.
+SPOOL_PATH = os.path.join(os.path.expanduser("~"), "datarecorder_spool.sqlite3")
+SPOOL_DRAIN_ROWS = 5000
+SPOOL_RETRY_SECONDS = 10
+# Every raw radio packet is appended to this binary log, flushed every FLUSH_SECONDS.
+# The log is rotated at MAX_BYTES keeping BACKUPS older files.
+PACKET_LOG_PATH = os.path.join(os.path.expanduser("~"), "datarecorder_packets.bin")
+PACKET_LOG_MAX_BYTES = 16 * 1024 * 1024
+PACKET_LOG_BACKUPS = 20
+PACKET_LOG_FLUSH_SECONDS = 5
+# Where the recorder gets its packets: "rfm69" for the radio, "udp" or "unix" for
+# datagrams on a socket, "replay" for packet log files or "synthetic" for generated
+# packets. The options are passed to the source, see datarecorder/_packetsources.py.
+PACKET_SOURCE = "rfm69"
+PACKET_SOURCE_OPTIONS = {
+    "rfm69": {"irq_pin": RFM69_INTERRUPT_PIN},
+    "udp": {"address": ("127.0.0.1", 5005)},
+    "unix": {"address": "/tmp/datarecorder.sock"},
+    "replay": {"paths": None, "speed": None},
+    "synthetic": {"nodes": 4, "rate": 100.0},
+}
+
+# Packets are stamped with the monotonic clock when received and converted to UTC
+# when written, the wall clock is read again when the last reading is this old.
+CLOCK_ANCHOR_SECONDS = 60
+# Seconds before an event action triggered on "level" fires again for the same
+# bit, unless the action sets its own "repeat".
+EVENT_REPEAT_SECONDS = 60
+# Event webhooks are sent in order by one thread per host, keeping its connection
+# open. A request that times out or fails is tried WEBHOOK_RETRIES more times,
+# waiting WEBHOOK_BACKOFF seconds and doubling the wait each time, before the
+# requests behind it are sent.
+WEBHOOK_TIMEOUT = 5.0
+WEBHOOK_RETRIES = 3
+WEBHOOK_BACKOFF = 0.5
+# A jump in a node's packet serial number of up to MAX_PACKET_GAP is counted as
+# missing packets, a larger jump as the node restarting its serial numbers.
+MAX_PACKET_GAP = 1000
+# Metrics are served in the Prometheus text format at http://ADDRESS:PORT/metrics,
+# a PORT of None turns the endpoint off.
+METRICS_ADDRESS = "127.0.0.1"
+METRICS_PORT = 9108
+
 DISPLAY_WIDTH = 128
 DISPLAY_HEIGHT = 64
 
@@ -0,0 +1 @@
+"""Throughput and latency benchmarks, run from the repository root with python -m."""
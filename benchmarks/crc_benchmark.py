@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Packets per second checked by each CRC backend in helpers.radiohelper.
+
+usage: python -m benchmarks.crc_benchmark [--packets N]
+"""
+import argparse
+import os
+import time
+from helpers import radiohelper
+
+PACKET_SIZE = radiohelper.PACKET_LENGTH + 2
+
+
+def _reference_crc16(bytes_data):
+    """The original bit-at-a-time CRC, kept as the baseline."""
+    crc = 0xFFFF
+    for byte in bytes_data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if (crc & 0x8000) > 0:
+                crc = (crc << 1) ^ 0x1021
+            else:
+                crc = crc << 1
+    return crc & 0xFFFF
+
+
+def _make_packets(count):
+    """Random payloads with a valid CRC appended."""
+    return [
+        radiohelper.append_crc(os.urandom(radiohelper.PACKET_LENGTH))
+        for _ in range(count)
+    ]
+
+
+def _time_per_packet(crc_func, packets):
+    start = time.perf_counter()
+    for packet in packets:
+        crc_func(packet)
+    return time.perf_counter() - start
+
+
+def run(packet_count):
+    """Time every backend and print packets per second."""
+    packets = _make_packets(packet_count)
+    results = {"bitwise (original)": _time_per_packet(_reference_crc16, packets)}
+    for name, crc_func in radiohelper.CRC_BACKENDS.items():
+        results[name] = _time_per_packet(crc_func, packets)
+    if radiohelper.numpy is not None:
+        packed = radiohelper.numpy.frombuffer(b"".join(packets), dtype="u1")
+        packed = packed.reshape(packet_count, PACKET_SIZE)
+        start = time.perf_counter()
+        assert radiohelper.check_crc_batch(packed).all()
+        results["numpy batch"] = time.perf_counter() - start
+    print(f"{packet_count} packets of {PACKET_SIZE} bytes")
+    for name, elapsed in results.items():
+        print(f"{name:<20} {packet_count / elapsed:>14,.0f} packets/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=20000)
+    run(parser.parse_args().packets)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Load test the recorder with a fleet of virtual nodes.
+
+Each virtual node packs its readings with node.Radio._prepare_data, the code the
+real nodes run, and sends every packet --sends times, as a real node does, as
+datagrams to a SocketSource feeding the processing and database writer threads
+in this process. A transmission can be lost (--loss) or have a byte corrupted
+(--corrupt), and serial numbers start at --first-serial so the wrap at 0xffff
+can be exercised.
+
+Reports the sustained ingest rate, the depths of radio_q and the database
+writer's write_q and the latency from a packet's first send to its database
+commit. If the rate falls short of the offered rate or a queue keeps growing,
+the recorder cannot keep up. Readings are
+written to the database, point --db-url at a scratch database.
+
+usage: python -m benchmarks.fleet_simulator [--db-url URL] [--nodes 20]
+           [--period 1.0] [--sensors 10] [--seconds 30] [--sends 2] [--loss 0.0]
+           [--corrupt 0.0] [--first-serial 0] [--transport {udp,unix}]
+"""
+import argparse
+import heapq
+import logging
+import os
+import random
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from database import database
+from datarecorder import _dataprocessing, _dbwriter, _packetsources
+from helpers import radiohelper
+from remote_nodes.node_helper import node
+
+SAMPLE_INTERVAL = 0.1  # seconds between queue depth samples
+
+
+class VirtualNode:
+    """The packet state of a node.Radio without its radio."""
+
+    # The packing and serial number code of the real nodes.
+    _prepare_data = node.Radio._prepare_data
+    _increment_counter_with_wrap = node.Radio._increment_counter_with_wrap
+
+    def __init__(self, node_id, sensors, first_serial):
+        self._node_id = node_id
+        self._packet_id = first_serial
+        self._register = 0x0000
+        first_sensor = node_id * radiohelper.SENSOR_COUNT
+        self._sensor_ids = [
+            (first_sensor + slot) % radiohelper.PADDING_SENSOR_ID
+            for slot in range(sensors)
+        ]
+
+    def next_packet(self, rng):
+        """Return ((node_id, serial), packet) for the next packet the node sends."""
+        packet = self._prepare_data(
+            [{"id": x, "value": rng.uniform(-50.0, 50.0)} for x in self._sensor_ids]
+        )
+        key = (self._node_id, self._packet_id)
+        self._increment_counter_with_wrap()
+        return key, packet
+
+
+def _corrupt(packet, rng):
+    index = rng.randrange(len(packet))
+    return packet[:index] + bytes([packet[index] ^ 0xFF]) + packet[index + 1 :]
+
+
+def _percentile(quantiles, percent):
+    return quantiles[percent - 1] if quantiles else float("nan")
+
+
+class FleetSimulator:
+    """Sends packets from virtual nodes to the recorder and measures the result."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.sent_at = {}
+        self.latencies = []
+        self.depths = {"radio_q": [], "write_q": []}
+        self.counts = dict.fromkeys(
+            ["packets", "transmissions", "lost", "corrupted", "committed", "rows"], 0
+        )
+        self.last_commit = None
+        self._lock = threading.Lock()
+        self._sampling = threading.Event()
+
+    def on_commit(self, packets):
+        """Commit listener, runs in the database writer thread."""
+        now = time.monotonic()
+        with self._lock:
+            for packet in packets:
+                sent_at = self.sent_at.pop((packet.node_id, packet.pkt_serial), None)
+                if sent_at is not None:
+                    self.latencies.append(now - sent_at)
+                self.counts["committed"] += 1
+                self.counts["rows"] += len(packet)
+            self.last_commit = now
+
+    def sample_depths(self):
+        """Record the depth of radio_q and write_q every SAMPLE_INTERVAL until stopped."""
+        while not self._sampling.wait(SAMPLE_INTERVAL):
+            self.depths["radio_q"].append(_dataprocessing.radio_q.qsize())
+            self.depths["write_q"].append(_dbwriter.write_q.qsize())
+
+    def send(self, sender, address):
+        """Send packets from every node at its period for the configured time."""
+        args = self.args
+        start = time.monotonic()
+        end = start + args.seconds
+        schedule = [
+            (start + self.rng.uniform(0, args.period), node_id)
+            for node_id in range(1, args.nodes + 1)
+        ]
+        nodes = {
+            node_id: VirtualNode(node_id, args.sensors, args.first_serial)
+            for _, node_id in schedule
+        }
+        heapq.heapify(schedule)
+        while schedule[0][0] < end:
+            due, node_id = heapq.heappop(schedule)
+            time.sleep(max(due - time.monotonic(), 0))
+            key, packet = nodes[node_id].next_packet(self.rng)
+            with self._lock:
+                self.sent_at[key] = time.monotonic()
+            self.counts["packets"] += 1
+            for _ in range(args.sends):
+                self.counts["transmissions"] += 1
+                if self.rng.random() < args.loss:
+                    self.counts["lost"] += 1
+                    continue
+                if self.rng.random() < args.corrupt:
+                    self.counts["corrupted"] += 1
+                    sender.sendto(_corrupt(packet, self.rng), address)
+                else:
+                    sender.sendto(packet, address)
+            heapq.heappush(schedule, (due + args.period, node_id))
+        return time.monotonic() - start
+
+    def run(self):
+        """Run the fleet against the recorder threads and return a report dict."""
+        args = self.args
+        if args.transport == "unix":
+            address = os.path.join(tempfile.mkdtemp(), "fleet.sock")
+            family = socket.AF_UNIX
+        else:
+            address = ("127.0.0.1", 0)
+            family = socket.AF_INET
+        source = _packetsources.SocketSource(address)
+        _dbwriter.commit_listeners.append(self.on_commit)
+        _dataprocessing.init_data_processing_thread()
+        _dbwriter.init_db_writer_thread()
+        source.start(_dataprocessing.enqueue_packet)
+        sampler = threading.Thread(target=self.sample_depths, daemon=True)
+        sampler.start()
+        start = time.monotonic()
+        with socket.socket(family, socket.SOCK_DGRAM) as sender:
+            send_seconds = self.send(sender, source.bound_address)
+        time.sleep(0.5)  # Let the last datagrams arrive before waiting on the queues
+        _dataprocessing.radio_q.join()
+        _dbwriter.write_q.join()
+        _dbwriter.flush_buffer()
+        self._sampling.set()
+        source.stop()
+        _dbwriter.commit_listeners.remove(self.on_commit)
+        ingest_seconds = (self.last_commit or time.monotonic()) - start
+        quantiles = (
+            statistics.quantiles(self.latencies, n=100)
+            if len(self.latencies) > 1
+            else []
+        )
+        return {
+            **self.counts,
+            "missing": len(self.sent_at),
+            "offered_packets_per_second": self.counts["packets"] / send_seconds,
+            "packets_per_second": self.counts["committed"] / ingest_seconds,
+            "rows_per_second": self.counts["rows"] / ingest_seconds,
+            "drain_seconds": ingest_seconds - send_seconds,
+            **{
+                f"{name}_{stat.__name__}_depth": stat(depths) if depths else 0
+                for name, depths in self.depths.items()
+                for stat in (max, statistics.fmean)
+            },
+            "latency_p50_ms": _percentile(quantiles, 50) * 1000,
+            "latency_p90_ms": _percentile(quantiles, 90) * 1000,
+            "latency_p99_ms": _percentile(quantiles, 99) * 1000,
+            "latency_max_ms": max(self.latencies, default=float("nan")) * 1000,
+            "stages": _dataprocessing.get_latency_metrics(),
+        }
+
+
+def print_report(report):
+    """Print a simulator report."""
+    print(
+        f"{report['packets']} packets sent as {report['transmissions']} "
+        f"transmissions, {report['lost']} lost, {report['corrupted']} corrupted\n"
+        f"{report['committed']} packets ({report['rows']} rows) committed, "
+        f"{report['missing']} never arrived\n"
+        f"offered {report['offered_packets_per_second']:,.0f} packets/s, "
+        f"sustained {report['packets_per_second']:,.0f} packets/s "
+        f"({report['rows_per_second']:,.0f} rows/s), "
+        f"{report['drain_seconds']:.1f} s to drain\n"
+        f"radio_q depth max {report['radio_q_max_depth']}, "
+        f"mean {report['radio_q_fmean_depth']:.1f}, "
+        f"write_q depth max {report['write_q_max_depth']}, "
+        f"mean {report['write_q_fmean_depth']:.1f}\n"
+        f"latency ms p50 {report['latency_p50_ms']:.1f}, "
+        f"p90 {report['latency_p90_ms']:.1f}, p99 {report['latency_p99_ms']:.1f}, "
+        f"max {report['latency_max_ms']:.1f}"
+    )
+    for stage, summary in report["stages"].items():
+        if summary["count"]:
+            print(
+                f"  {stage:<16} p50 {summary['p50'] * 1000:8.2f} ms  "
+                f"p95 {summary['p95'] * 1000:8.2f} ms  "
+                f"p99 {summary['p99'] * 1000:8.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db-url",
+        default=None,
+        help="database to write to, default a new SQLite file in a temporary directory",
+    )
+    parser.add_argument("--nodes", type=int, default=20)
+    parser.add_argument(
+        "--period", type=float, default=1.0, help="seconds between packets per node"
+    )
+    parser.add_argument(
+        "--sensors", type=int, default=radiohelper.SENSOR_COUNT, help="per node"
+    )
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--sends", type=int, default=2, help="copies of each packet")
+    parser.add_argument("--loss", type=float, default=0.0, help="per transmission")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="per transmission")
+    parser.add_argument("--first-serial", type=lambda x: int(x, 0), default=0)
+    parser.add_argument("--transport", choices=["udp", "unix"], default="udp")
+    parser.add_argument("--seed", type=int, default=None)
+    parsed_args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    database.initialize_database(
+        parsed_args.db_url
+        or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "fleet.sqlite3")
+    )
+    print_report(FleetSimulator(parsed_args).run())
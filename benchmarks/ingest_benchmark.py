@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Rows per second written to Sensor Readings by the ORM, Core executemany and COPY.
+
+The Sensor Readings table is emptied before every run, point --db-url at a
+scratch database. COPY is only timed on PostgreSQL.
+
+usage: python -m benchmarks.ingest_benchmark [--db-url URL] [--rows 1000 10000 100000]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from database import database
+
+
+def _make_rows(row_count):
+    start = datetime(2021, 1, 1)
+    return [
+        (start + timedelta(seconds=index), index % 200, index * 0.001)
+        for index in range(row_count)
+    ]
+
+
+def _write_orm(connection, rows):
+    db_session = database.session(bind=connection)
+    db_session.add_all(
+        database.SensorData(Timestamp_UTC=row[0], Sensor_ID=row[1], Reading=row[2])
+        for row in rows
+    )
+    db_session.flush()
+
+
+def _write_executemany(connection, rows):
+    connection.execute(
+        database.SensorData.__table__.insert(),
+        [dict(zip(database.READING_COLUMNS, row)) for row in rows],
+    )
+
+
+def _write_multirow_insert(connection, rows):
+    step = database.MAX_ROWS_PER_INSERT
+    for index in range(0, len(rows), step):
+        connection.execute(
+            database.SensorData.__table__.insert().values(
+                [
+                    dict(zip(database.READING_COLUMNS, row))
+                    for row in rows[index : index + step]
+                ]
+            )
+        )
+
+
+def _write_copy(copy_format):
+    def write(connection, rows):
+        database._copy_readings(  # pylint: disable=protected-access
+            connection, rows, copy_format
+        )
+
+    return write
+
+
+def _time_write(write, rows):
+    database.engine.execute(database.SensorData.__table__.delete())
+    start = time.perf_counter()
+    with database.engine.begin() as connection:
+        write(connection, rows)
+    return time.perf_counter() - start
+
+
+def run(db_url, row_counts):
+    """Time each write method for each row count and print rows per second."""
+    database.initialize_database(db_url)
+    methods = {
+        "ORM add_all": _write_orm,
+        "Core executemany": _write_executemany,
+        "multi-row INSERT": _write_multirow_insert,
+    }
+    if database.engine.dialect.name == "postgresql":
+        methods["COPY text"] = _write_copy("text")
+        methods["COPY binary"] = _write_copy("binary")
+    print(f"{'rows':>8}  " + "".join(f"{name:>18}" for name in methods))
+    for row_count in row_counts:
+        rows = _make_rows(row_count)
+        rates = [row_count / _time_write(write, rows) for write in methods.values()]
+        print(f"{row_count:>8}  " + "".join(f"{rate:>18,.0f}" for rate in rates))
+    database.engine.execute(database.SensorData.__table__.delete())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", default="sqlite://")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parsed_args = parser.parse_args()
+    run(parsed_args.db_url, parsed_args.rows)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Bytes allocated per packet by the old nested dict decoding and by DecodedPacket.
+
+usage: python -m benchmarks.packet_alloc_benchmark [--packets N]
+"""
+import argparse
+import struct
+import tracemalloc
+from datetime import datetime
+from helpers import radiohelper
+
+RX_PACKET = (
+    b"\n\n\n\n\xf0\xf0\xaa\xbb\x00=\xfc\xb9$\x01?\x9e\x04\x19\x02@\x16"
+    b"\x1eO\x03@]:\x93\x04@\x92+k\x05\xc0\xb5\xb9\x8c\x06\x00\x00\x00"
+    b"\x00\x07E\xf6\x98\x00\x08\xc4y\xc0\x00\xff\x00\x00\x00\x00\x94\x1b"
+)
+
+
+def _decode_to_dicts(rx_packet, timestamp):
+    """The decoding used before DecodedPacket, reproduced for comparison."""
+    readings = struct.unpack(
+        radiohelper.RADIO_DATA_FORMAT, radiohelper.confirm_and_strip_crc(rx_packet)
+    )
+    munged_data = {
+        "node": {
+            "node_id": readings[0],
+            "pkt_serial": readings[2],
+            "status_register": readings[3],
+            "unused_1": readings[4],
+            "unused_2": readings[5],
+        },
+        "sensors": {"timestamp": timestamp},
+    }
+    zipped_sensor_readings = list(
+        zip(
+            readings[radiohelper.SENSOR_OFFSET :: 2],
+            readings[radiohelper.SENSOR_OFFSET + 1 :: 2],
+        )
+    )
+    munged_data["sensors"]["sensor_readings"] = [
+        x for x in zipped_sensor_readings if x[0] != 0xFF
+    ]
+    return munged_data
+
+
+def _measure(decode, packet_count):
+    """Return (bytes retained, peak bytes) per packet while decoding packet_count packets."""
+    timestamp = datetime.utcnow()
+    rx_packets = [bytes(RX_PACKET) for _ in range(packet_count)]
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    decoded = [decode(x, timestamp) for x in rx_packets]
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del decoded
+    return (after - before) / packet_count, (peak - before) / packet_count
+
+
+def run(packet_count):
+    """Print the bytes allocated per packet for each representation."""
+    codec = radiohelper.PacketCodec()
+    results = {
+        "nested dicts": _measure(_decode_to_dicts, packet_count),
+        "DecodedPacket": _measure(codec.decode, packet_count),
+    }
+    print(f"{packet_count} packets, 9 sensor readings each")
+    print(f"{'':<16}{'retained B/pkt':>16}{'peak B/pkt':>14}")
+    for name, (retained, peak) in results.items():
+        print(f"{name:<16}{retained:>16,.0f}{peak:>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=10000)
+    run(parser.parse_args().packets)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Range query latency on Sensor Readings without and with its indexes.
+
+Fills Sensor Readings with synthetic minute-level readings from --sensors sensors,
+then times one sensor over one day and all sensors over one hour, first with the
+indexes dropped and then with them rebuilt. PostgreSQL only, the table is emptied
+first so point --db-url at a scratch database.
+
+usage: python -m benchmarks.range_query_benchmark --db-url URL [--rows 50000000]
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from database import database
+
+START = datetime(2015, 1, 1)
+FILL_SQL = """
+    INSERT INTO "Sensor Readings" ("Timestamp_UTC", "Sensor_ID", "Reading")
+    SELECT :start + (n / :sensors) * interval '1 minute', n % :sensors, random() * 100
+    FROM generate_series(:first, :last) AS n
+"""
+QUERIES = {
+    "one sensor, one day": (
+        'SELECT count(*), avg("Reading") FROM "Sensor Readings" '
+        'WHERE "Sensor_ID" = :sensor_id '
+        'AND "Timestamp_UTC" >= :start AND "Timestamp_UTC" < :start + interval \'1 day\''
+    ),
+    "all sensors, one hour": (
+        'SELECT count(*), avg("Reading") FROM "Sensor Readings" '
+        'WHERE "Timestamp_UTC" >= :start '
+        "AND \"Timestamp_UTC\" < :start + interval '1 hour'"
+    ),
+}
+
+
+def _fill_table(connection, row_count, sensor_count, chunk=1000000):
+    connection.execute(text('TRUNCATE "Sensor Readings"'))
+    for first in range(0, row_count, chunk):
+        last = min(first + chunk, row_count) - 1
+        connection.execute(
+            text(FILL_SQL), start=START, sensors=sensor_count, first=first, last=last
+        )
+        print(f"\r{last + 1:,} rows written", end="", flush=True)
+    print()
+
+
+def _drop_indexes(connection):
+    for index in database.SensorData.__table__.indexes:
+        connection.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+    connection.execute(text(f'DROP INDEX IF EXISTS "{database.READINGS_BRIN_INDEX}"'))
+
+
+def _time_queries(connection, row_count, sensor_count, repeats):
+    minutes = row_count // sensor_count
+    results = {}
+    for name, query in QUERIES.items():
+        latencies = []
+        for repeat in range(repeats):
+            start = START + timedelta(minutes=(minutes * repeat // repeats))
+            before = time.perf_counter()
+            connection.execute(
+                text(query), sensor_id=repeat % sensor_count, start=start
+            ).fetchall()
+            latencies.append((time.perf_counter() - before) * 1000)
+        results[name] = statistics.median(latencies)
+    return results
+
+
+def run(db_url, row_count, sensor_count, repeats):
+    """Fill the table, then print median query latencies without and with indexes."""
+    database.initialize_database(db_url)
+    if database.engine.dialect.name != "postgresql":
+        raise SystemExit("The range query benchmark needs a PostgreSQL database")
+    connection = database.engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    )
+    _fill_table(connection, row_count, sensor_count)
+    _drop_indexes(connection)
+    connection.execute(text('ANALYZE "Sensor Readings"'))
+    without_indexes = _time_queries(connection, row_count, sensor_count, repeats)
+    before = time.perf_counter()
+    database.ensure_indexes()
+    print(f"Indexes built in {time.perf_counter() - before:.1f} s")
+    connection.execute(text('ANALYZE "Sensor Readings"'))
+    with_indexes = _time_queries(connection, row_count, sensor_count, repeats)
+    print(f"{'median latency (ms)':<24}{'no indexes':>14}{'indexes':>14}")
+    for name in QUERIES:
+        print(f"{name:<24}{without_indexes[name]:>14.1f}{with_indexes[name]:>14.1f}")
+    for index in database.get_index_report():
+        print(f"{index['name']:<46}{index['size_bytes'] / 1048576:>10.1f} MB")
+    connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", required=True)
+    parser.add_argument("--rows", type=int, default=50000000)
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=11)
+    parsed_args = parser.parse_args()
+    run(parsed_args.db_url, parsed_args.rows, parsed_args.sensors, parsed_args.repeats)
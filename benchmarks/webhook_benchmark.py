@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Webhook dispatch latency against a local stand-in server.
+
+Sends --requests webhooks one after another with urllib.request.urlopen, a new
+connection each, then submits the same number to a WebhookDispatcher and reports
+the time from submit to response and the connections the server saw. --delay
+makes the server slow, like a busy NAS.
+
+usage: python -m benchmarks.webhook_benchmark [--requests 200] [--delay 0.0]
+"""
+import argparse
+import statistics
+import threading
+import time
+import urllib.request
+from tests.standin_server import StandinServer
+from helpers.webhooks import WebhookDispatcher
+
+
+def _report(name, latencies, seconds, connections):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:<10} {len(latencies) / seconds:8,.0f} requests/s  "
+        f"p50 {quantiles[49] * 1000:7.2f} ms  p99 {quantiles[98] * 1000:7.2f} ms  "
+        f"{connections} connections"
+    )
+
+
+def bench_urlopen(server, requests):
+    """One blocking request at a time, as the event thread used to."""
+    latencies = []
+    start = time.perf_counter()
+    for index in range(requests):
+        sent = time.perf_counter()
+        with urllib.request.urlopen(f"{server.url}/hook?n={index}") as response:
+            response.read()
+        latencies.append(time.perf_counter() - sent)
+    return latencies, time.perf_counter() - start
+
+
+def bench_dispatcher(server, requests):
+    """Submit every request at once and wait for the callbacks."""
+    dispatcher = WebhookDispatcher()
+    dispatcher.start()
+    latencies = []
+    finished = threading.Semaphore(0)
+
+    def callback(sent):
+        def done(_):
+            latencies.append(time.perf_counter() - sent)
+            finished.release()
+
+        return done
+
+    start = time.perf_counter()
+    for index in range(requests):
+        dispatcher.submit(f"{server.url}/hook?n={index}", callback(time.perf_counter()))
+    for _ in range(requests):
+        finished.acquire()
+    seconds = time.perf_counter() - start
+    dispatcher.shutdown()
+    return latencies, seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.0, help="server seconds")
+    parsed_args = parser.parse_args()
+    for name, bench in [
+        ("urlopen", lambda x: bench_urlopen(x, parsed_args.requests)),
+        ("dispatcher", lambda x: bench_dispatcher(x, parsed_args.requests)),
+    ]:
+        standin = StandinServer(delay=parsed_args.delay)
+        _report(name, *bench(standin), standin.connections)
+        standin.stop()
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""Command line tools to add nodes and sensors to the database."""
+"""Command line tools to add nodes and sensors to the database and maintain it."""
 
 from .commandlinetools import *
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""Provide a set of command-line tools to add nodes and sensors to the database."""
+"""Provide a set of command-line tools to add nodes and sensors to the database and
+to maintain the database."""
 import argparse
+import sys
+from datetime import datetime
 from sqlalchemy.orm.exc import NoResultFound
 from database import database
+from datarecorder import _dataprocessing, _packetlog
+from __config__ import DB_ROLLUP_WORKERS, PACKET_LOG_PATH, SI_UNITS
 
 
 def _layout_existing_things(thing_name=None, existing_things=None):
@@ -37,6 +42,79 @@ def _layout_thing_details(thing_name=None, thing_id=None, thing_data=None):
     return "".join(print_items)
 
 
+def _layout_latest_readings(latest_readings=None):
+    """Lay out each sensor's latest reading, with its name and unit where known,
+    ready for printing."""
+    if not latest_readings:
+        return "No sensor readings in database\n"
+    print_items = [f"{'Sensor':<8}{'Name':<24}{'Reading':>16}  {'Time (UTC)'}\n"]
+    for latest in latest_readings:
+        reading = f"{latest['Reading']:.6g} {latest.get('Symbol', '')}"
+        print_items.append(
+            f"0x{latest['Sensor_ID']:02x}    {latest.get('Name', 'unknown'):<24}"
+            f"{reading:>16}  {latest['Timestamp_UTC']:%Y-%m-%d %H:%M:%S}\n"
+        )
+    return "".join(print_items)
+
+
+def _format_bytes(size):
+    """Format a size in bytes for printing, leave None unchanged."""
+    if size is None:
+        return "n/a"
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def _layout_index_report(index_report=None):
+    """Lay out the name, size and usage of each index ready for printing."""
+    if not index_report:
+        return "No indexes in database\n"
+    print_items = [f"{'Index':<46}{'Size':>10}{'Scans':>12}{'Tuples read':>14}\n"]
+    for index in index_report:
+        scans = "n/a" if index["scans"] is None else index["scans"]
+        tuples_read = "n/a" if index["tuples_read"] is None else index["tuples_read"]
+        print_items.append(
+            f"{index['name']:<46}{_format_bytes(index['size_bytes']):>10}"
+            f"{scans:>12}{tuples_read:>14}\n"
+        )
+    return "".join(print_items)
+
+
+def _layout_partition_report(partition_report=None):
+    """Lay out the name, size and estimated row count of each partition ready for
+    printing."""
+    if not partition_report:
+        return "Sensor Readings is not partitioned\n"
+    print_items = [f"{'Partition':<36}{'Size':>10}{'Rows (est.)':>14}\n"]
+    for partition in partition_report:
+        rows = partition["estimated_rows"]
+        rows = "n/a" if rows is None else rows
+        print_items.append(
+            f"{partition['name']:<36}{_format_bytes(partition['size_bytes']):>10}"
+            f"{rows:>14}\n"
+        )
+    return "".join(print_items)
+
+
+def _layout_retention_report(retention_report=None):
+    """Lay out the rows and bytes removed by each retention policy ready for
+    printing."""
+    if not retention_report:
+        return "No retention policies configured\n"
+    print_items = [
+        f"{'Policy':<8}{'Older than':<12}{'Rows':>12}{'Size':>10}{'Partitions':>12}\n"
+    ]
+    for result in retention_report:
+        print_items.append(
+            f"{result['policy']:<8}{result['cutoff']:%Y-%m-%d}  {result['rows']:>12}"
+            f"{_format_bytes(result['bytes']):>10}{result['partitions_dropped']:>12}\n"
+        )
+    return "".join(print_items)
+
+
 def list_nodes(_):
     """Print all the node IDs from the database."""
     nodes_to_list = database.get_all_node_ids()
@@ -79,6 +157,19 @@ def show_sensor_details(parsed_args=None):
     print(text_to_print)
 
 
+def show_latest_readings(_):
+    """Print the latest reading of every sensor."""
+    latest_readings = database.get_latest_readings()
+    for latest in latest_readings:
+        try:
+            sensor = database.get_sensor_data(latest["Sensor_ID"])
+        except NoResultFound:
+            continue
+        latest["Name"] = sensor["Name"]
+        latest["Symbol"] = SI_UNITS.get(sensor["Quantity"], {}).get("symbol", "")
+    print(_layout_latest_readings(latest_readings=latest_readings))
+
+
 def add_node_to_database(parsed_args):
     """Add a node to the database."""
     try:
@@ -108,6 +199,60 @@ def add_sensor_to_database(parsed_args):
         print(f"Unable to create sensor ID 0x{parsed_args.id:02x} -- {error.args[0]}\n")
 
 
+def show_index_report(_):
+    """Print the size and usage of the Sensor Readings indexes."""
+    print(_layout_index_report(index_report=database.get_index_report()))
+
+
+def create_missing_indexes(_):
+    """Create any Sensor Readings indexes missing from the database."""
+    database.ensure_indexes()
+    print("Sensor Readings indexes are up to date\n")
+
+
+def show_partition_report(_):
+    """Print the size and estimated row count of the Sensor Readings partitions."""
+    print(_layout_partition_report(partition_report=database.get_partition_report()))
+
+
+def migrate_to_partitions(parsed_args):
+    """Move an unpartitioned Sensor Readings table into monthly partitions."""
+    rows_moved = database.migrate_readings_to_partitions(
+        chunk_size=parsed_args.chunk_size
+    )
+    print(f"{rows_moved} rows moved to the partitioned Sensor Readings table\n")
+
+
+def backfill_rollups(parsed_args):
+    """Rebuild the hourly and daily rollups for a range of days."""
+    chunks = database.backfill_rollups(
+        parsed_args.start, parsed_args.end, workers=parsed_args.workers
+    )
+    print(f"Rebuilt rollups for {chunks} days\n")
+
+
+def apply_retention(_):
+    """Remove the readings and rollups older than their retention period."""
+    print(_layout_retention_report(retention_report=database.apply_retention()))
+
+
+def replay_packet_log(parsed_args):
+    """Write the packets in packet log files that are not already stored to the
+    database and report the rate. Exits with the error if a database write fails."""
+    paths = parsed_args.paths or _packetlog.packet_log_files(PACKET_LOG_PATH)
+    try:
+        report = _dataprocessing.replay_packet_log(paths)
+    except ConnectionError as error:
+        sys.exit(str(error))
+    rate = report["packets"] / report["seconds"] if report["seconds"] else 0.0
+    print(
+        f"Replayed {report['packets']} packets from {len(paths)} files, "
+        f"{report['skipped']} already stored, "
+        f"{report['rows']} rows written in {report['seconds']:.1f} s "
+        f"({rate:.0f} packets/s)\n"
+    )
+
+
 def setup_node_argparse():
     """Create command line arguments for nodes."""
     parser = argparse.ArgumentParser()
@@ -158,4 +303,72 @@ def setup_sensor_argparse():
     )
     parser_add.add_argument("name", help="name for the sensor to add")
     parser_add.add_argument("quantity", help="quantity for the sensor to add")
+    parser_latest = subparsers.add_parser(
+        "latest", help="display the latest reading of every sensor"
+    )
+    parser_latest.set_defaults(func=show_latest_readings)
+    return parser
+
+
+def setup_database_argparse():
+    """Create command line arguments for database maintenance."""
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(help="commands to maintain the database")
+    parser_indexes = subparsers.add_parser(
+        "indexes", help="show the size and usage of the Sensor Readings indexes"
+    )
+    parser_indexes.set_defaults(func=show_index_report)
+    parser_create_indexes = subparsers.add_parser(
+        "create-indexes", help="create any missing Sensor Readings indexes"
+    )
+    parser_create_indexes.set_defaults(func=create_missing_indexes)
+    parser_partitions = subparsers.add_parser(
+        "partitions", help="show the size of the Sensor Readings partitions"
+    )
+    parser_partitions.set_defaults(func=show_partition_report)
+    parser_migrate = subparsers.add_parser(
+        "partition-migrate",
+        help="move an unpartitioned Sensor Readings table into monthly partitions",
+    )
+    parser_migrate.add_argument(
+        "--chunk-size",
+        type=int,
+        default=50000,
+        help="number of rows copied per transaction, default 50000",
+    )
+    parser_migrate.set_defaults(func=migrate_to_partitions)
+    parser_backfill = subparsers.add_parser(
+        "rollup-backfill",
+        help="rebuild the hourly and daily rollups from the sensor readings",
+    )
+    parser_backfill.add_argument(
+        "start", type=datetime.fromisoformat, help="first day to rebuild, YYYY-MM-DD"
+    )
+    parser_backfill.add_argument(
+        "end", type=datetime.fromisoformat, help="day after the last day, YYYY-MM-DD"
+    )
+    parser_backfill.add_argument(
+        "--workers",
+        type=int,
+        default=DB_ROLLUP_WORKERS,
+        help=f"number of days rebuilt in parallel, default {DB_ROLLUP_WORKERS}",
+    )
+    parser_backfill.set_defaults(func=backfill_rollups)
+    parser_retention = subparsers.add_parser(
+        "retention",
+        help="remove readings and rollups older than their retention period",
+    )
+    parser_retention.set_defaults(func=apply_retention)
+    parser_replay = subparsers.add_parser(
+        "replay",
+        help="decode the packets in packet log files and write those not already "
+        "stored to the database, stops at the first failed write and can be run again",
+    )
+    parser_replay.add_argument(
+        "paths",
+        nargs="*",
+        help=f"packet log files, oldest first, default {PACKET_LOG_PATH} "
+        "and its rotated files",
+    )
+    parser_replay.set_defaults(func=replay_packet_log)
     return parser
@@ -5,15 +5,47 @@ Created on Sat Nov 30 07:17:01 2019
 
 @author: martinstephens
 """
+import io
 import logging
-from sqlalchemy import create_engine
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, create_engine, event, func, inspect, select, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
+from sqlalchemy import BigInteger, cast
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, relationship, backref
 from sqlalchemy.orm.exc import NoResultFound
+from . import partitions, retention, rollups
+from .metadatacache import MetadataCache, NodeRecord, SensorRecord
+from __config__ import (
+    FILE_DEBUG_LEVEL,
+    SI_UNITS,
+    DB_INGEST_MODE,
+    DB_COPY_FORMAT,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_PARTITION_READINGS,
+    DB_PARTITION_MONTHS_AHEAD,
+    DB_ROLLUP_WORKERS,
+    DB_RETENTION_DAYS,
+    DB_RETENTION_BATCH_ROWS,
+    DB_READ_CHUNK_ROWS,
+    DB_METADATA_CACHE_TTL,
+)
 
-from __config__ import FILE_DEBUG_LEVEL, SI_UNITS
+try:
+    import numpy
+except ImportError:  # NumPy is optional, only read_readings needs it.
+    numpy = None
 
 logger = logging.getLogger(__name__)
 logger.setLevel(FILE_DEBUG_LEVEL)
@@ -21,6 +53,20 @@ logger.setLevel(FILE_DEBUG_LEVEL)
 Base = declarative_base()
 engine = None
 session = None
+ingest_options = {"mode": DB_INGEST_MODE, "copy_format": DB_COPY_FORMAT}
+# Sensor ID: (timestamp, reading) of the last reading written by this process.
+latest_readings = {}
+_latest_readings_lock = threading.Lock()
+_unknown_sensors = set()  # Sensor IDs already warned about.
+_pool_stats_lock = threading.Lock()
+_pool_stats = {
+    "connects": 0,
+    "checkouts": 0,
+    "checkins": 0,
+    "waits": 0,
+    "wait_seconds": 0.0,
+    "max_wait_seconds": 0.0,
+}
 
 # Classes defined for database ORM and thus have no public methods.
 class SensorData(Base):
@@ -28,6 +74,11 @@ class SensorData(Base):
     """ORM for the database Sensor Readings table."""
 
     __tablename__ = "Sensor Readings"
+    __table_args__ = (
+        Index(
+            "ix_sensor_readings_sensor_id_timestamp_utc", "Sensor_ID", "Timestamp_UTC"
+        ),
+    )
 
     ID = Column(Integer, primary_key=True)
     Timestamp_UTC = Column(DateTime)
@@ -35,11 +86,54 @@ class SensorData(Base):
     Reading = Column(Float)
 
 
+class HourlyReadings(Base):
+    # pylint: disable=too-few-public-methods
+    """ORM for the database Sensor Readings Hourly rollup table."""
+
+    __tablename__ = rollups.ROLLUP_TABLES["hourly"]
+
+    Sensor_ID = Column(Integer, primary_key=True)
+    Period_Start = Column(DateTime, primary_key=True)
+    Count = Column(Integer)
+    Sum = Column(Float)
+    Min = Column(Float)
+    Max = Column(Float)
+
+
+class DailyReadings(Base):
+    # pylint: disable=too-few-public-methods
+    """ORM for the database Sensor Readings Daily rollup table."""
+
+    __tablename__ = rollups.ROLLUP_TABLES["daily"]
+
+    Sensor_ID = Column(Integer, primary_key=True)
+    Period_Start = Column(DateTime, primary_key=True)
+    Count = Column(Integer)
+    Sum = Column(Float)
+    Min = Column(Float)
+    Max = Column(Float)
+
+
+class LatestReadings(Base):
+    # pylint: disable=too-few-public-methods
+    """ORM for the database Latest Readings table, the last reading of each
+    sensor."""
+
+    __tablename__ = "Latest Readings"
+
+    Sensor_ID = Column(Integer, primary_key=True)
+    Timestamp_UTC = Column(DateTime)
+    Reading = Column(Float)
+
+
 class NodeEvents(Base):
     # pylint: disable=too-few-public-methods
     """ORM for the database Events table."""
 
     __tablename__ = "Events"
+    __table_args__ = (
+        Index("ix_events_node_id_timestamp_utc", "Node_ID", "Timestamp_UTC"),
+    )
 
     ID = Column(Integer, primary_key=True)
     Timestamp_UTC = Column(DateTime)
@@ -71,15 +165,144 @@ class Sensors(Base):
     node = relationship(Nodes, backref=backref("node_sensors", uselist=True))
 
 
-def initialize_database(db_url):
-    """Initialize the database connection."""
+def _load_metadata():
+    """Return all the node and sensor records, read in one transaction."""
+    with session_scope() as db_session:
+        nodes = [
+            NodeRecord(*x)
+            for x in db_session.query(Nodes.ID, Nodes.Name, Nodes.Location)
+        ]
+        sensors = [
+            SensorRecord(*x)
+            for x in db_session.query(
+                Sensors.ID, Sensors.Node_ID, Sensors.Name, Sensors.Quantity
+            )
+        ]
+    return nodes, sensors
+
+
+metadata_cache = MetadataCache(_load_metadata, DB_METADATA_CACHE_TTL)
+
+
+def _pool_options(url):
+    """Return the connection pool arguments for create_engine."""
+    pool_options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if url.get_backend_name() != "sqlite":
+        pool_options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return pool_options
+
+
+def _count_pool_event(stat):
+    def count(*_):
+        with _pool_stats_lock:
+            _pool_stats[stat] += 1
+
+    return count
+
+
+def _listen_for_pool_events(db_engine):
+    """Count new connections, checkouts and checkins on the engine's pool."""
+    for event_name, stat in (
+        ("connect", "connects"),
+        ("checkout", "checkouts"),
+        ("checkin", "checkins"),
+    ):
+        event.listen(db_engine, event_name, _count_pool_event(stat))
+
+
+def _record_pool_wait(wait_seconds):
+    with _pool_stats_lock:
+        _pool_stats["waits"] += 1
+        _pool_stats["wait_seconds"] += wait_seconds
+        _pool_stats["max_wait_seconds"] = max(
+            _pool_stats["max_wait_seconds"], wait_seconds
+        )
+
+
+def get_pool_metrics():
+    """Return a dict of connection pool counters.
+
+    Wait time is the time taken to check a connection out of the pool.
+    """
+    with _pool_stats_lock:
+        pool_metrics = dict(_pool_stats)
+    pool_metrics["in_use"] = pool_metrics["checkouts"] - pool_metrics["checkins"]
+    pool_metrics["mean_wait_seconds"] = (
+        pool_metrics["wait_seconds"] / pool_metrics["waits"]
+        if pool_metrics["waits"]
+        else 0.0
+    )
+    return pool_metrics
+
+
+@contextmanager
+def session_scope():
+    """Provide a session that is committed if the block succeeds, rolled back if it
+    raises and closed, returning its connection to the pool, either way."""
+    db_session = session()
+    try:
+        start = time.perf_counter()
+        db_session.connection()
+        _record_pool_wait(time.perf_counter() - start)
+        yield db_session
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+
+@contextmanager
+def connection_scope():
+    """Provide a Core connection inside a transaction, committed if the block
+    succeeds and rolled back if it raises."""
+    start = time.perf_counter()
+    connection = engine.connect()
+    _record_pool_wait(time.perf_counter() - start)
+    try:
+        with connection.begin():
+            yield connection
+    finally:
+        connection.close()
+
+
+def initialize_database(db_url, ingest_mode=DB_INGEST_MODE, copy_format=DB_COPY_FORMAT):
+    """Initialize the database connection.
+
+    Arguments:
+        db_url -- SQLAlchemy database URL
+
+    Keyword Arguments:
+        ingest_mode -- "insert" or "copy", how sensor readings are written
+        copy_format -- "text" or "binary", the COPY format used in "copy" mode
+    """
     logger.debug("initialize_database called")
     global Base, engine, session
+    if ingest_mode not in ("insert", "copy") or copy_format not in ("text", "binary"):
+        raise ValueError(
+            "ingest_mode must be insert or copy, copy_format text or binary"
+        )
+    ingest_options["mode"] = ingest_mode
+    ingest_options["copy_format"] = copy_format
     try:
-        engine = create_engine(db_url)
-        session = sessionmaker()
+        engine = create_engine(db_url, **_pool_options(make_url(db_url)))
+        _listen_for_pool_events(engine)
+        # Sessions are closed after each use, so keep loaded values readable.
+        session = sessionmaker(expire_on_commit=False)
         session.configure(bind=engine)
+        if engine.dialect.name == "postgresql" and DB_PARTITION_READINGS:
+            _create_partitioned_readings_table()
         Base.metadata.create_all(engine)
+        ensure_indexes()
+        ensure_partitions()
+        metadata_cache.load()
+        _load_latest_readings()
     except Exception as error:
         logger.critical("Database initialization failed: %s", error)
         raise error
@@ -87,52 +310,638 @@ def initialize_database(db_url):
         logger.info("Database initialized")
 
 
-def write_sensor_reading_to_db(data):
-    """Take a dict with timestamp and a list of tuples of sensor_readings and write
-    it out to the database."""
-    logger.debug("write_sensor_reading_to_db called")
-    try:
-        create_session = session()
-        # pylint: disable=expression-not-assigned
+def _create_partitioned_readings_table():
+    """Create Sensor Readings as a partitioned table if it does not exist yet."""
+    with connection_scope() as connection:
+        if not partitions.table_exists(connection):
+            logger.info("Creating partitioned Sensor Readings table")
+            partitions.create_partitioned_table(connection)
+            partitions.create_indexes(connection)
+        elif not partitions.is_partitioned(connection):
+            logger.warning(
+                "Sensor Readings is not partitioned, run manage_database.py "
+                "partition-migrate to partition it"
+            )
+
+
+def ensure_partitions(now=None):
+    """Create the Sensor Readings partitions for the current month and the
+    DB_PARTITION_MONTHS_AHEAD months after it. Returns the names created.
+
+    Does nothing unless the table is partitioned, which is PostgreSQL only.
+    """
+    logger.debug("ensure_partitions called")
+    if engine.dialect.name != "postgresql":
+        return []
+    with connection_scope() as connection:
+        return partitions.ensure_partitions(
+            connection, now or datetime.utcnow(), DB_PARTITION_MONTHS_AHEAD
+        )
+
+
+def get_partition_report():
+    """Return a list of dicts with the name, bounds, size in bytes and estimated
+    row count of each Sensor Readings partition, empty if it is not partitioned."""
+    if engine.dialect.name != "postgresql":
+        return []
+    with connection_scope() as connection:
+        return partitions.list_partitions(connection)
+
+
+def migrate_readings_to_partitions(chunk_size=50000):
+    """Move an unpartitioned Sensor Readings table into a partitioned one while
+    the recorder keeps writing, see partitions.migrate_to_partitioned_table.
+    Returns the number of rows moved."""
+    logger.debug("migrate_readings_to_partitions called")
+    return partitions.migrate_to_partitioned_table(
+        engine, datetime.utcnow(), DB_PARTITION_MONTHS_AHEAD, chunk_size
+    )
+
+
+# Readings are written in time order, so a BRIN index on the timestamp stays tiny and
+# lets PostgreSQL skip every block range outside a time window.
+READINGS_BRIN_INDEX = "ix_sensor_readings_timestamp_utc_brin"
+READINGS_BRIN_INDEX_SQL = (
+    f'CREATE INDEX IF NOT EXISTS "{READINGS_BRIN_INDEX}" '
+    'ON "Sensor Readings" USING brin ("Timestamp_UTC")'
+)
+# Partition indexes are summed into the partitioned table's index they belong to.
+INDEX_REPORT_SQL = """
+    SELECT coalesce(parent_index.relname, stats.indexrelname) AS name,
+        sum(pg_relation_size(stats.indexrelid))::bigint AS size_bytes,
+        sum(stats.idx_scan)::bigint AS scans,
+        sum(stats.idx_tup_read)::bigint AS tuples_read
+    FROM pg_stat_user_indexes stats
+    LEFT JOIN pg_inherits ON pg_inherits.inhrelid = stats.indexrelid
+    LEFT JOIN pg_class parent_index ON parent_index.oid = pg_inherits.inhparent
+    WHERE stats.relid = quote_ident(:table_name)::regclass
+        OR stats.relid IN (
+            SELECT inhrelid FROM pg_inherits
+            WHERE inhparent = quote_ident(:table_name)::regclass
+        )
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+
+def ensure_indexes():
+    """Create any Sensor Readings or Events index missing from the database.
+
+    create_all only creates indexes along with a new table, so this brings
+    tables created before the indexes existed up to date. The BRIN index is
+    PostgreSQL only.
+    """
+    logger.debug("ensure_indexes called")
+    for table in (SensorData.__table__, NodeEvents.__table__):
+        existing_indexes = {x["name"] for x in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logger.info("Creating index %s", index.name)
+                index.create(engine)
+    if engine.dialect.name == "postgresql":
+        with connection_scope() as connection:
+            connection.execute(text(READINGS_BRIN_INDEX_SQL))
+
+
+def get_index_report():
+    """Return a list of dicts with the name, size in bytes, number of scans and
+    tuples read for each Sensor Readings index.
+
+    Size and usage are only available from PostgreSQL, otherwise they are None.
+    """
+    table_name = SensorData.__table__.name
+    if engine.dialect.name == "postgresql":
+        with connection_scope() as connection:
+            return [
+                dict(row)
+                for row in connection.execute(
+                    text(INDEX_REPORT_SQL), table_name=table_name
+                )
+            ]
+    return [
+        {"name": x["name"], "size_bytes": None, "scans": None, "tuples_read": None}
+        for x in inspect(engine).get_indexes(table_name)
+    ]
+
+
+# Keeps multi-row inserts below SQLite's default limit of 999 bound parameters.
+MAX_ROWS_PER_INSERT = 300
+READING_COLUMNS = ("Timestamp_UTC", "Sensor_ID", "Reading")
+COPY_READINGS_SQL = (
+    'COPY "Sensor Readings" ("Timestamp_UTC", "Sensor_ID", "Reading") '
+    "FROM STDIN WITH (FORMAT {})"
+)
+# PostgreSQL binary COPY: signature, flags and header extension length.
+COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_BINARY_TRAILER = struct.pack(">h", -1)
+# Field count, then length + value for timestamp (int8), Sensor_ID (int4), Reading (float8)
+COPY_BINARY_ROW = struct.Struct(">hiqiiid")
+POSTGRES_EPOCH = datetime(2000, 1, 1)
+
+
+def _readings_to_rows(packets):
+    """Generate a (timestamp, sensor ID, reading) tuple per sensor reading in the
+    decoded packets."""
+    for packet in packets:
+        timestamp = packet.timestamp
+        for sensor_id, reading in packet.sensor_readings():
+            yield timestamp, sensor_id, reading
+
+
+def _events_to_rows(packets):
+    """Generate a (timestamp, node ID, event code) tuple per bit set in the status
+    registers of the decoded packets."""
+    for packet in packets:
+        register = packet.status_register
+        for code in range(16):
+            if register >> code & 0x0001:
+                yield packet.timestamp, packet.node_id, code
+
+
+def _events_of_known_nodes(event_rows):
+    """Return the event rows of nodes in the Nodes table. The others are dropped with
+    a warning, their foreign key would fail the whole transaction."""
+    unknown_nodes = {x[1] for x in event_rows if not _node_id_exists(x[1])}
+    if unknown_nodes:
+        logger.warning("Events from unknown nodes %s dropped", sorted(unknown_nodes))
+    return [x for x in event_rows if x[1] not in unknown_nodes]
+
+
+def _warn_of_unknown_sensors(rows):
+    """Log a warning the first time readings arrive from a sensor that is not in
+    the Sensors table. The readings are kept, the sensor may be added later."""
+    new_sensors = {x[1] for x in rows} - _unknown_sensors
+    unknown_sensors = {x for x in new_sensors if not _sensor_id_exists(x)}
+    if unknown_sensors:
+        logger.warning("Readings from unknown sensors %s", sorted(unknown_sensors))
+        _unknown_sensors.update(unknown_sensors)
+
+
+def _insert_events(connection, event_rows):
+    connection.execute(
+        NodeEvents.__table__.insert(),
         [
-            create_session.add(
-                SensorData(
-                    Timestamp_UTC=data["timestamp"],
-                    Sensor_ID=reading[0],
-                    Reading=reading[1],
+            {"Timestamp_UTC": timestamp, "Node_ID": node_id, "Event_Code": code}
+            for timestamp, node_id, code in event_rows
+        ],
+    )
+
+
+def _encode_copy_text(rows):
+    """Encode reading rows in PostgreSQL's COPY text format."""
+    return "".join(
+        f"{timestamp.isoformat(sep=' ')}\t{sensor_id}\t{reading!r}\n"
+        for timestamp, sensor_id, reading in rows
+    )
+
+
+def _encode_copy_binary(rows):
+    """Encode reading rows in PostgreSQL's COPY binary format."""
+    one_microsecond = timedelta(microseconds=1)
+    pack_row = COPY_BINARY_ROW.pack
+    return b"".join(
+        (
+            COPY_BINARY_HEADER,
+            *(
+                pack_row(
+                    3,
+                    8,
+                    (timestamp - POSTGRES_EPOCH) // one_microsecond,
+                    4,
+                    sensor_id,
+                    8,
+                    reading,
                 )
+                for timestamp, sensor_id, reading in rows
+            ),
+            COPY_BINARY_TRAILER,
+        )
+    )
+
+
+def _copy_readings(connection, rows, copy_format):
+    """Stream rows into the Sensor Readings table with COPY FROM STDIN, using the
+    psycopg2 connection underneath the SQLAlchemy connection."""
+    if copy_format == "binary":
+        stream = io.BytesIO(_encode_copy_binary(rows))
+    else:
+        stream = io.StringIO(_encode_copy_text(rows))
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(COPY_READINGS_SQL.format(copy_format), stream)
+    finally:
+        cursor.close()
+
+
+def _insert_readings(connection, rows):
+    """Write rows to the Sensor Readings table with the configured ingest mode."""
+    table = SensorData.__table__
+    if ingest_options["mode"] == "copy":
+        if connection.dialect.name == "postgresql":
+            _copy_readings(connection, rows, ingest_options["copy_format"])
+        else:
+            connection.execute(
+                table.insert(), [dict(zip(READING_COLUMNS, row)) for row in rows]
+            )
+        return
+    for index in range(0, len(rows), MAX_ROWS_PER_INSERT):
+        connection.execute(
+            table.insert().values(
+                [
+                    dict(zip(READING_COLUMNS, row))
+                    for row in rows[index : index + MAX_ROWS_PER_INSERT]
+                ]
             )
-            for reading in data["sensor_readings"]
+        )
+
+
+# A late batch, e.g. replayed readings, must not replace a newer reading.
+UPSERT_LATEST_READINGS_SQL = """
+    INSERT INTO "Latest Readings" ("Sensor_ID", "Timestamp_UTC", "Reading")
+    VALUES (:sensor_id, :timestamp, :reading)
+    ON CONFLICT ("Sensor_ID") DO UPDATE SET
+        "Timestamp_UTC" = excluded."Timestamp_UTC", "Reading" = excluded."Reading"
+    WHERE excluded."Timestamp_UTC" >= "Latest Readings"."Timestamp_UTC"
+"""
+SEED_LATEST_READINGS_SQL = """
+    INSERT INTO "Latest Readings" ("Sensor_ID", "Timestamp_UTC", "Reading")
+    SELECT readings."Sensor_ID", readings."Timestamp_UTC", max(readings."Reading")
+    FROM "Sensor Readings" readings
+    JOIN (
+        SELECT "Sensor_ID", max("Timestamp_UTC") AS "Timestamp_UTC"
+        FROM "Sensor Readings" WHERE "Sensor_ID" IS NOT NULL GROUP BY "Sensor_ID"
+    ) latest ON readings."Sensor_ID" = latest."Sensor_ID"
+        AND readings."Timestamp_UTC" = latest."Timestamp_UTC"
+    GROUP BY readings."Sensor_ID", readings."Timestamp_UTC"
+"""
+
+
+def _latest_of_rows(rows):
+    """Return a dict of sensor ID: (timestamp, reading) of the last of the rows
+    for each sensor."""
+    latest = {}
+    for timestamp, sensor_id, reading in rows:
+        if sensor_id not in latest or timestamp >= latest[sensor_id][0]:
+            latest[sensor_id] = (timestamp, reading)
+    return latest
+
+
+def _update_latest_readings(connection, latest):
+    """Upsert the Latest Readings table with a dict from _latest_of_rows."""
+    connection.execute(
+        text(UPSERT_LATEST_READINGS_SQL).bindparams(
+            bindparam("timestamp", type_=DateTime)
+        ),
+        [
+            {"sensor_id": sensor_id, "timestamp": timestamp, "reading": reading}
+            for sensor_id, (timestamp, reading) in latest.items()
+        ],
+    )
+
+
+def _load_latest_readings():
+    """Fill latest_readings from the Latest Readings table, first seeding the
+    table from Sensor Readings if it is empty, e.g. in a database that predates
+    it."""
+    table = LatestReadings.__table__
+    with connection_scope() as connection:
+        if connection.execute(select([table.c.Sensor_ID]).limit(1)).first() is None:
+            connection.execute(text(SEED_LATEST_READINGS_SQL))
+        rows = connection.execute(select([table])).fetchall()
+    with _latest_readings_lock:
+        latest_readings.clear()
+        for sensor_id, timestamp, reading in rows:
+            latest_readings[sensor_id] = (timestamp, reading)
+
+
+def get_latest_readings():
+    """Return a list of dicts with the Sensor_ID, Timestamp_UTC and Reading of
+    each sensor's last reading, read from the Latest Readings table."""
+    logger.debug("get_latest_readings called")
+    with session_scope() as db_session:
+        return [
+            {
+                "Sensor_ID": x.Sensor_ID,
+                "Timestamp_UTC": x.Timestamp_UTC,
+                "Reading": x.Reading,
+            }
+            for x in db_session.query(LatestReadings).order_by(LatestReadings.Sensor_ID)
         ]
-        # pylint: enable=expression-not-assigned
-        create_session.commit()
+
+
+def latest_reading(sensor_id):
+    """Return (timestamp, reading) of the last reading of a sensor from the
+    in-process cache, None if it has no readings."""
+    return latest_readings.get(sensor_id)
+
+
+def write_sensor_readings_to_db(packets, event_rows=()):
+    """Write the readings of a batch of decoded packets to the database in a single
+    transaction. Returns the number of rows written.
+
+    Uses COPY FROM STDIN or multi-row inserts depending on ingest_options. The
+    hourly and daily rollups and Latest Readings are updated in the same
+    transaction, as are the (timestamp, node ID, event code) event_rows, see
+    get_event_rows.
+    """
+    logger.debug("write_sensor_readings_to_db called")
+    return write_reading_rows_to_db(list(_readings_to_rows(packets)), event_rows)
+
+
+def get_event_rows(packets):
+    """Return a list of (timestamp, node ID, event code) rows for the events in
+    the status registers of decoded packets with timestamps."""
+    return list(_events_to_rows(packets))
+
+
+def write_reading_rows_to_db(rows, event_rows=()):
+    """Write a list of (timestamp, sensor ID, reading) rows, and any event rows, to
+    the database in a single transaction, as write_sensor_readings_to_db. Returns
+    the number of reading rows written."""
+    if event_rows:
+        event_rows = _events_of_known_nodes(event_rows)
+    if not rows and not event_rows:
+        return 0
+    _warn_of_unknown_sensors(rows)
+    latest = {}
+    try:
+        with connection_scope() as connection:
+            if rows:  # e.g. the gate node only sends its status register
+                _insert_readings(connection, rows)
+                rollups.update_rollups(connection, rows)
+                latest = _latest_of_rows(rows)
+                _update_latest_readings(connection, latest)
+            if event_rows:
+                _insert_events(connection, event_rows)
     except Exception as error:
         logger.critical("IOError writing to database")
         raise error
+    with _latest_readings_lock:
+        for sensor_id, (timestamp, reading) in latest.items():
+            current = latest_readings.get(sensor_id)
+            if current is None or timestamp >= current[0]:
+                latest_readings[sensor_id] = (timestamp, reading)
+    return len(rows)
+
+
+def write_sensor_reading_to_db(packet):
+    """Take a decoded packet with a timestamp and sensor readings and write the
+    readings out to the database."""
+    logger.debug("write_sensor_reading_to_db called")
+    write_sensor_readings_to_db([packet])
+
+
+def _rebuild_rollups_chunk(start, end):
+    with connection_scope() as connection:
+        rollups.rebuild_rollups(connection, start, end)
+    logger.info("Rebuilt rollups from %s to %s", start, end)
+
+
+def backfill_rollups(start, end, workers=DB_ROLLUP_WORKERS, chunk_days=1):
+    """Rebuild the hourly and daily rollups from the readings between start and
+    end, widened to whole days.
+
+    The range is rebuilt in chunks of chunk_days days, each in its own
+    transaction, by up to workers threads (one on SQLite). Readings written to
+    a chunk while it is being rebuilt may be missed, so backfill ranges that are
+    no longer being written to. Returns the number of chunks rebuilt.
+    """
+    logger.debug("backfill_rollups called")
+    start = rollups.period_start(start, "daily")
+    if rollups.period_start(end, "daily") != end:
+        end = rollups.period_start(end, "daily") + timedelta(days=1)
+    chunks = []
+    while start < end:
+        chunk_end = min(start + timedelta(days=chunk_days), end)
+        chunks.append((start, chunk_end))
+        start = chunk_end
+    # An in-memory SQLite database is only visible to the thread that created it.
+    if workers <= 1 or engine.dialect.name == "sqlite":
+        for chunk in chunks:
+            _rebuild_rollups_chunk(*chunk)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() re-raises the first exception from a chunk.
+            list(executor.map(lambda chunk: _rebuild_rollups_chunk(*chunk), chunks))
+    return len(chunks)
+
+
+def get_rollups(sensor_id, start, end, period="daily"):
+    """Return a list of dicts with the period start, count, mean, minimum and
+    maximum of a sensor's readings for each hourly or daily period between start
+    and end, in time order."""
+    logger.debug("get_rollups called")
+    tables = {"hourly": HourlyReadings, "daily": DailyReadings}
+    if period not in tables:
+        raise ValueError("period must be hourly or daily")
+    table = tables[period]
+    with session_scope() as a_session:
+        return [
+            {
+                "period_start": x.Period_Start,
+                "count": x.Count,
+                "mean": x.Sum / x.Count,
+                "min": x.Min,
+                "max": x.Max,
+            }
+            for x in a_session.query(table)
+            .filter(
+                table.Sensor_ID == sensor_id,
+                table.Period_Start >= start,
+                table.Period_Start < end,
+            )
+            .order_by(table.Period_Start)
+        ]
+
+
+# NumPy dtype of the arrays yielded by read_readings.
+READING_DTYPE = [
+    ("timestamp", "datetime64[us]"),
+    ("sensor_id", "u1"),
+    ("value", "float32"),
+]
+
+
+def read_readings(sensor_ids, start, end, chunk_size=DB_READ_CHUNK_ROWS):
+    """Generate the readings of the sensors from start up to end as NumPy
+    structured arrays of up to chunk_size rows with READING_DTYPE fields.
+
+    Rows are in Sensor_ID then timestamp order, the order of the sensor and
+    timestamp index. They are streamed through a server-side cursor on
+    PostgreSQL, so only one chunk is held in memory at a time. The connection is
+    held until the generator is exhausted or closed.
+    """
+    logger.debug("read_readings called")
+    if numpy is None:
+        raise ImportError("read_readings requires NumPy to be installed")
+    if isinstance(sensor_ids, int):
+        sensor_ids = [sensor_ids]
+    table = SensorData.__table__
+    timestamp = table.c.Timestamp_UTC
+    if engine.dialect.name == "postgresql":
+        # Integers convert to datetime64 far faster than datetime objects.
+        timestamp = cast(func.extract("epoch", timestamp) * 1000000, BigInteger)
+    query = (
+        select([timestamp, table.c.Sensor_ID, table.c.Reading])
+        .where(table.c.Sensor_ID.in_(list(sensor_ids)))
+        .where(table.c.Timestamp_UTC >= start)
+        .where(table.c.Timestamp_UTC < end)
+        .order_by(table.c.Sensor_ID, table.c.Timestamp_UTC)
+    )
+    with connection_scope() as connection:
+        result = connection.execution_options(stream_results=True).execute(query)
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            timestamps, ids, values = zip(*rows)
+            readings = numpy.empty(len(rows), dtype=READING_DTYPE)
+            readings["timestamp"] = numpy.array(timestamps).astype("datetime64[us]")
+            readings["sensor_id"] = ids
+            readings["value"] = values
+            yield readings
+
+
+def _downsample_expired_readings(cutoff):
+    """Add rollups for the readings older than the cutoff whose hours and days
+    have none, so nothing is lost but detail when the readings are removed.
+    Existing rollups are kept, their readings may already be gone."""
+    with connection_scope() as connection:
+        oldest = connection.execute(
+            select([func.min(SensorData.Timestamp_UTC)])
+        ).scalar()
+        if oldest is not None and oldest < cutoff:
+            rollups.add_missing_rollups(
+                connection, rollups.period_start(oldest, "daily"), cutoff
+            )
+
+
+def _apply_retention_policy(policy, cutoff, batch_size):
+    """Remove a policy's rows older than the cutoff, dropping whole partitions
+    where it can and deleting batch_size rows per transaction otherwise."""
+    table = retention.RETENTION_TABLES[policy][0]
+    result = {
+        "policy": policy,
+        "table": table,
+        "cutoff": cutoff,
+        "rows": 0,
+        "bytes": 0,
+        "partitions_dropped": 0,
+    }
+    with connection_scope() as connection:
+        expired_partitions = retention.expired_partitions(connection, cutoff, table)
+        row_size = retention.bytes_per_row(connection, table)
+    for name in expired_partitions:
+        with connection_scope() as connection:
+            rows, size_bytes = retention.drop_partition(connection, name)
+        result["rows"] += rows
+        result["bytes"] += size_bytes
+        result["partitions_dropped"] += 1
+    while True:
+        with connection_scope() as connection:
+            deleted = retention.delete_expired_batch(
+                connection, policy, cutoff, batch_size
+            )
+        result["rows"] += deleted
+        result["bytes"] += round(deleted * (row_size or 0))
+        if deleted < batch_size:
+            break
+    if engine.dialect.name != "postgresql":
+        result["bytes"] = None
+    return result
+
+
+def apply_retention(now=None, batch_size=DB_RETENTION_BATCH_ROWS):
+    """Remove the readings and rollups older than their DB_RETENTION_DAYS.
+
+    Expired raw readings are downsampled into the rollups first. Cutoffs are
+    midnights. Returns a list of dicts, one per policy applied, with the policy,
+    table, cutoff, rows removed, bytes reclaimed and partitions dropped. Bytes
+    are only known on PostgreSQL, for deleted rather than dropped rows they are
+    estimated from the table's average row size and the space is reused by
+    later writes once vacuumed.
+    """
+    logger.debug("apply_retention called")
+    now = now or datetime.utcnow()
+    report = []
+    for policy, days in DB_RETENTION_DAYS.items():
+        if days is None:
+            continue
+        cutoff = rollups.period_start(now - timedelta(days=days), "daily")
+        if policy == "raw":
+            _downsample_expired_readings(cutoff)
+        result = _apply_retention_policy(policy, cutoff, batch_size)
+        logger.info(
+            "Retention removed %d rows, %s bytes from %s older than %s",
+            result["rows"],
+            result["bytes"],
+            result["table"],
+            cutoff,
+        )
+        report.append(result)
+    return report
 
 
 def write_events_to_db(data):
     """Take a dict with timestamp, node and a list of event codes and write
     it to the database."""
     logger.debug("write_event_to_db called")
+    write_reading_rows_to_db(
+        [],
+        [(data["timestamp"], data["node_id"], code) for code in data["event_codes"]],
+    )
+
+
+def database_is_available():
+    """Return True if a connection can be made and queried."""
     try:
-        create_session = session()
-        # pylint: disable=expression-not-assigned
-        [
-            create_session.add(
-                NodeEvents(
-                    Timestamp_UTC=data["timestamp"],
-                    node_ID=data["node_id"],
-                    Event_Code=code,
-                )
-            )
-            for code in data["event_codes"]
-        ]
-        # pylint: enable=expression-not-assigned
-        create_session.commit()
-    except Exception as error:
-        logger.critical("IOError writing to database")
-        raise error
+        with connection_scope() as connection:
+            connection.execute(select([1]))
+    except Exception:  # pylint: disable=broad-except
+        return False
+    return True
+
+
+def get_events(node_id, start, end):
+    """Return a list of (timestamp, event code) of the events of a node from start
+    up to end, in time order, read with the node and timestamp index."""
+    logger.debug("get_events called")
+    table = NodeEvents.__table__
+    query = (
+        select([table.c.Timestamp_UTC, table.c.Event_Code])
+        .where(table.c.Node_ID == node_id)
+        .where(table.c.Timestamp_UTC >= start)
+        .where(table.c.Timestamp_UTC < end)
+        .order_by(table.c.Timestamp_UTC, table.c.ID)
+    )
+    with connection_scope() as connection:
+        return [tuple(x) for x in connection.execute(query)]
+
+
+def get_stored_timestamps(start, end):
+    """Return two dicts, of sensor ID to the sorted timestamps of its readings and
+    of node ID to the sorted timestamps of its events, from start to end
+    inclusive."""
+    logger.debug("get_stored_timestamps called")
+    readings = SensorData.__table__
+    events = NodeEvents.__table__
+    queries = [
+        select([readings.c.Sensor_ID, readings.c.Timestamp_UTC])
+        .where(readings.c.Timestamp_UTC.between(start, end))
+        .distinct(),
+        select([events.c.Node_ID, events.c.Timestamp_UTC])
+        .where(events.c.Timestamp_UTC.between(start, end))
+        .distinct(),
+    ]
+    stored = ({}, {})
+    with connection_scope() as connection:
+        for by_id, query in zip(stored, queries):
+            for record_id, timestamp in connection.execute(query):
+                by_id.setdefault(record_id, []).append(timestamp)
+    for by_id in stored:
+        for timestamps in by_id.values():
+            timestamps.sort()
+    return stored
 
 
 def _check_id_and_name_are_valid(
@@ -181,37 +990,29 @@ def add_node(node_id=None, name=None, location=None):
     assert _check_id_and_name_are_valid(
         id_to_check=node_id, name_to_check=name, record_type="node"
     )
-    create_session = session()
     try:
-        create_session.add(Nodes(ID=node_id, Name=name, Location=location))
-        create_session.commit()
+        with session_scope() as create_session:
+            create_session.add(Nodes(ID=node_id, Name=name, Location=location))
     except IntegrityError as error:
         raise ValueError(
             "Record not created, node ID and name must be unique"
         ) from error
+    metadata_cache.invalidate()
 
 
-# TODO: Refactor existence checks
 def _node_id_exists(node_id=None):
     """Check if the node id exists in the database."""
-    query_session = session()
-    query_table = Nodes
-    try:
-        query_session.query(query_table).filter(query_table.ID == node_id).one()
-    except NoResultFound:
-        return False
-    return True
+    return metadata_cache.node(node_id) is not None
 
 
 def _sensor_id_exists(sensor_id=None):
     """Check if the sensor id exists in the database."""
-    query_session = session()
-    query_table = Sensors
-    try:
-        query_session.query(query_table).filter(query_table.ID == sensor_id).one()
-    except NoResultFound:
-        return False
-    return True
+    return metadata_cache.sensor(sensor_id) is not None
+
+
+def get_metadata_cache_metrics():
+    """Return the metadata cache's hits, misses, loads and hit ratio."""
+    return metadata_cache.get_metrics()
 
 
 def add_sensor(sensor_id=None, node_id=None, name=None, quantity=None):
@@ -244,24 +1045,24 @@ def add_sensor(sensor_id=None, node_id=None, name=None, quantity=None):
         raise ValueError(
             "Sensor not created -- unknown sensor data quantity supplied"
         ) from error
-    create_session = session()
     try:
-        create_session.add(
-            Sensors(ID=sensor_id, Node_ID=node_id, Name=name, Quantity=quantity)
-        )
-        create_session.commit()
+        with session_scope() as create_session:
+            create_session.add(
+                Sensors(ID=sensor_id, Node_ID=node_id, Name=name, Quantity=quantity)
+            )
     except IntegrityError as error:
         raise ValueError(
             "Record not created, Sensor ID and name must be unique"
         ) from error
+    metadata_cache.invalidate()
 
 
 def _get_all_ids(table=None):
     """Get all IDs from the database for the given table."""
-    db_session = session()
-    table_to_query = {"node": Nodes, "sensor": Sensors}[table]
-    query = db_session.query(table_to_query).all()
-    return (result.ID for result in query)
+    ids = {"node": metadata_cache.node_ids, "sensor": metadata_cache.sensor_ids}[
+        table
+    ]()
+    return (x for x in ids)
 
 
 # TODO refactor to call with the table object
@@ -283,18 +1084,10 @@ def _get_node_or_sensor(search_term=None, table=None):
         raise TypeError(
             f"{table} must be an integer (not {type(search_term)})"
         ) from error
-    table_to_query = {"node": Nodes, "sensor": Sensors}[table]
-    db_session = session()
-    try:
-        query_result = (
-            db_session.query(table_to_query)
-            .filter(table_to_query.ID == search_term)
-            .one()
-        )
-    except NoResultFound as error:
-        raise NoResultFound(
-            f"node ID 0x{search_term:02x} not found in the database"
-        ) from error
+    lookup = {"node": metadata_cache.node, "sensor": metadata_cache.sensor}[table]
+    query_result = lookup(search_term)
+    if query_result is None:
+        raise NoResultFound(f"node ID 0x{search_term:02x} not found in the database")
     return query_result
 
 
@@ -308,14 +1101,10 @@ def get_all_sensor_ids_for_a_node(node=None):
         assert isinstance(node, int)
     except AssertionError as error:
         raise TypeError(f"node must be an integer (not {type(node)})") from error
-    db_session = session()
-    try:
-        query = db_session.query(Nodes).filter(Nodes.ID == node).one()
-    except NoResultFound as error:
-        raise NoResultFound(
-            f"node ID 0x{node:02x} not found in the database"
-        ) from error
-    return (result.ID for result in query.node_sensors)
+    sensor_ids = metadata_cache.sensor_ids_for_node(node)
+    if sensor_ids is None:
+        raise NoResultFound(f"node ID 0x{node:02x} not found in the database")
+    return (sensor_id for sensor_id in sensor_ids)
 
 
 def get_node_data(node=None):
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""A process-wide cache of the Nodes and Sensors tables.
+
+The tables are small and rarely change, so they are held in dicts keyed by ID
+and every lookup is a dict access. The cache is reloaded when it is older than
+its time to live or has been invalidated by a write to either table. Writes made
+by another process, e.g. manage_sensors.py while the recorder runs, are seen
+once the time to live has passed.
+"""
+import logging
+import threading
+import time
+from typing import NamedTuple
+from __config__ import FILE_DEBUG_LEVEL
+
+logger = logging.getLogger(__name__)
+logger.setLevel(FILE_DEBUG_LEVEL)
+
+
+class NodeRecord(NamedTuple):
+    """A row of the Nodes table."""
+
+    ID: int
+    Name: str
+    Location: str
+
+
+class SensorRecord(NamedTuple):
+    """A row of the Sensors table."""
+
+    ID: int
+    Node_ID: int
+    Name: str
+    Quantity: str
+
+
+class MetadataCache:
+    """Caches the node and sensor records returned by loader.
+
+    Arguments:
+        loader -- a function returning an iterable of NodeRecords and an iterable
+            of SensorRecords
+        ttl -- seconds before the cache is reloaded
+    """
+
+    def __init__(self, loader, ttl):
+        self._loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generation = 0
+        self._stats = {"hits": 0, "misses": 0, "loads": 0}
+
+    def _is_current(self, snapshot):
+        return (
+            snapshot is not None
+            and snapshot["generation"] == self._generation
+            and time.monotonic() - snapshot["loaded_at"] < self.ttl
+        )
+
+    def load(self):
+        """Load the records now, replacing any cached ones."""
+        generation = self._generation
+        nodes, sensors = self._loader()
+        nodes = {x.ID: x for x in nodes}
+        sensors = {x.ID: x for x in sensors}
+        sensors_by_node = {x: [] for x in nodes}
+        for sensor in sorted(sensors.values()):
+            sensors_by_node.setdefault(sensor.Node_ID, []).append(sensor.ID)
+        snapshot = {
+            "nodes": nodes,
+            "sensors": sensors,
+            "sensors_by_node": {x: tuple(y) for x, y in sensors_by_node.items()},
+            "loaded_at": time.monotonic(),
+            # An invalidation during the load leaves the snapshot stale.
+            "generation": generation,
+        }
+        self._snapshot = snapshot
+        self._stats["loads"] += 1
+        logger.debug("Loaded %d nodes and %d sensors", len(nodes), len(sensors))
+        return snapshot
+
+    def invalidate(self):
+        """Mark the cached records as stale, they are reloaded on next use."""
+        self._generation += 1
+
+    def _current(self):
+        snapshot = self._snapshot
+        if self._is_current(snapshot):
+            self._stats["hits"] += 1
+            return snapshot
+        with self._lock:
+            self._stats["misses"] += 1
+            snapshot = self._snapshot
+            if not self._is_current(snapshot):
+                snapshot = self.load()
+        return snapshot
+
+    def node(self, node_id):
+        """Return the NodeRecord for a node ID, None if there is no such node."""
+        return self._current()["nodes"].get(node_id)
+
+    def sensor(self, sensor_id):
+        """Return the SensorRecord for a sensor ID, None if there is no such
+        sensor."""
+        return self._current()["sensors"].get(sensor_id)
+
+    def node_ids(self):
+        """Return a sorted list of all the node IDs."""
+        return sorted(self._current()["nodes"])
+
+    def sensor_ids(self):
+        """Return a sorted list of all the sensor IDs."""
+        return sorted(self._current()["sensors"])
+
+    def sensor_ids_for_node(self, node_id):
+        """Return a sorted tuple of the IDs of a node's sensors, None if there is
+        no such node."""
+        snapshot = self._current()
+        if node_id not in snapshot["nodes"]:
+            return None
+        return snapshot["sensors_by_node"][node_id]
+
+    def get_metrics(self):
+        """Return the hits, misses, loads and hit ratio of the cache and the number
+        of nodes and sensors it holds."""
+        stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else None
+        snapshot = self._snapshot
+        stats["nodes"] = len(snapshot["nodes"]) if snapshot else 0
+        stats["sensors"] = len(snapshot["sensors"]) if snapshot else 0
+        return stats
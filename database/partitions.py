@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Monthly range partitioning of the Sensor Readings table on PostgreSQL.
+
+The table is partitioned on Timestamp_UTC with one partition per calendar month,
+named e.g. "Sensor Readings 2021_03", plus a default partition that catches any
+reading outside the existing months. Every function takes an open SQLAlchemy
+connection and does nothing on other databases.
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import text
+from __config__ import FILE_DEBUG_LEVEL
+
+logger = logging.getLogger(__name__)
+logger.setLevel(FILE_DEBUG_LEVEL)
+
+READINGS_TABLE = "Sensor Readings"
+# The primary key of a partitioned table must include the partition key.
+CREATE_PARTITIONED_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS "{table}" (
+        "ID" serial,
+        "Timestamp_UTC" timestamp without time zone NOT NULL,
+        "Sensor_ID" integer,
+        "Reading" double precision,
+        PRIMARY KEY ("ID", "Timestamp_UTC")
+    ) PARTITION BY RANGE ("Timestamp_UTC")
+"""
+CREATE_INDEXES_SQL = (
+    'CREATE INDEX IF NOT EXISTS "ix_sensor_readings_sensor_id_timestamp_utc" '
+    'ON "{table}" ("Sensor_ID", "Timestamp_UTC")',
+    'CREATE INDEX IF NOT EXISTS "ix_sensor_readings_timestamp_utc_brin" '
+    'ON "{table}" USING brin ("Timestamp_UTC")',
+)
+CREATE_PARTITION_SQL = (
+    'CREATE TABLE IF NOT EXISTS "{partition}" PARTITION OF "{table}" '
+    "FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+)
+CREATE_DEFAULT_PARTITION_SQL = (
+    'CREATE TABLE IF NOT EXISTS "{partition}" PARTITION OF "{table}" DEFAULT'
+)
+LIST_PARTITIONS_SQL = """
+    SELECT child.relname AS name,
+        pg_get_expr(child.relpartbound, child.oid) AS bounds,
+        pg_total_relation_size(child.oid) AS size_bytes,
+        CASE WHEN child.reltuples < 0 THEN NULL
+            ELSE child.reltuples::bigint END AS estimated_rows
+    FROM pg_inherits
+    JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+    JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+    WHERE parent.relname = :table
+    ORDER BY child.relname
+"""
+TABLE_KIND_SQL = "SELECT relkind FROM pg_class WHERE relname = :table"
+# The runs of IDs missing from a copied chunk, as exclusive (after, before) bounds.
+# A row still being written when its chunk was copied is committed into one of them.
+FIND_ID_GAPS_SQL = """
+    SELECT "ID", next_id FROM (
+        SELECT "ID", lead("ID", 1, :last_id + 1) OVER (ORDER BY "ID") AS next_id
+        FROM (
+            SELECT CAST("ID" AS bigint) AS "ID" FROM "{table}"
+            WHERE "ID" > :first_id AND "ID" <= :last_id
+            UNION ALL SELECT CAST(:first_id AS bigint)
+        ) AS ids
+    ) AS steps
+    WHERE next_id > "ID" + 1
+"""
+COPY_ID_GAPS_SQL = """
+    INSERT INTO "{destination}" ("ID", "Timestamp_UTC", "Sensor_ID", "Reading")
+    SELECT "ID", "Timestamp_UTC", "Sensor_ID", "Reading" FROM "{source}" AS source
+    JOIN unnest(CAST(:after AS bigint[]), CAST(:before AS bigint[]))
+        AS gaps (after_id, before_id)
+        ON source."ID" > gaps.after_id AND source."ID" < gaps.before_id
+    WHERE "Timestamp_UTC" IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM "{destination}" AS copied WHERE copied."ID" = source."ID"
+    )
+"""
+
+
+def month_start(timestamp):
+    """Return midnight on the first day of the timestamp's month."""
+    return datetime(timestamp.year, timestamp.month, 1)
+
+
+def next_month(timestamp):
+    """Return midnight on the first day of the month after the timestamp's month."""
+    if timestamp.month == 12:
+        return datetime(timestamp.year + 1, 1, 1)
+    return datetime(timestamp.year, timestamp.month + 1, 1)
+
+
+def partition_name(month, table=READINGS_TABLE):
+    """Return the name of the table's partition for a month."""
+    return f"{table} {month:%Y_%m}"
+
+
+def partition_month(name, table=READINGS_TABLE):
+    """Return the month a partition holds from its name, None for other tables."""
+    try:
+        return datetime.strptime(name, f"{table} %Y_%m")
+    except ValueError:
+        return None
+
+
+def _is_postgresql(connection):
+    return connection.dialect.name == "postgresql"
+
+
+def is_partitioned(connection, table=READINGS_TABLE):
+    """Return True if the table exists and is a partitioned PostgreSQL table."""
+    if not _is_postgresql(connection):
+        return False
+    kind = connection.execute(text(TABLE_KIND_SQL), table=table).scalar()
+    return kind == "p"
+
+
+def table_exists(connection, table=READINGS_TABLE):
+    """Return True if a PostgreSQL table (partitioned or not) exists."""
+    return connection.execute(text(TABLE_KIND_SQL), table=table).scalar() is not None
+
+
+def create_partitioned_table(connection, table=READINGS_TABLE, partition_prefix=None):
+    """Create the partitioned parent table, its indexes and default partition.
+
+    Arguments:
+        connection -- an open PostgreSQL connection
+        table -- the name of the parent table
+        partition_prefix -- the table name used to name the partitions, the
+            parent's name if None
+    """
+    partition_prefix = partition_prefix or table
+    connection.execute(text(CREATE_PARTITIONED_TABLE_SQL.format(table=table)))
+    connection.execute(
+        text(
+            CREATE_DEFAULT_PARTITION_SQL.format(
+                partition=f"{partition_prefix} default", table=table
+            )
+        )
+    )
+
+
+def create_indexes(connection, table=READINGS_TABLE):
+    """Create the Sensor Readings indexes on a partitioned table, PostgreSQL creates
+    them on every partition."""
+    for create_index_sql in CREATE_INDEXES_SQL:
+        connection.execute(text(create_index_sql.format(table=table)))
+
+
+def create_partition(connection, month, table=READINGS_TABLE, partition_prefix=None):
+    """Create the partition for a month if it does not exist, return its name."""
+    name = partition_name(month, partition_prefix or table)
+    connection.execute(
+        text(
+            CREATE_PARTITION_SQL.format(
+                partition=name, table=table, start=month, end=next_month(month)
+            )
+        )
+    )
+    return name
+
+
+def ensure_partitions(connection, now, months_ahead, table=READINGS_TABLE):
+    """Create the partitions for the current month and the months_ahead months after
+    it, so that they exist before they are needed. Returns the names created."""
+    if not is_partitioned(connection, table):
+        return []
+    existing = {x["name"] for x in list_partitions(connection, table)}
+    created = []
+    month = month_start(now)
+    for _ in range(months_ahead + 1):
+        name = partition_name(month, table)
+        if name not in existing:
+            create_partition(connection, month, table)
+            logger.info("Created partition %s", name)
+            created.append(name)
+        month = next_month(month)
+    return created
+
+
+def list_partitions(connection, table=READINGS_TABLE):
+    """Return a list of dicts with the name, bounds, size in bytes and estimated row
+    count (None until analyzed) of each partition of the table, an empty list if it is not partitioned."""
+    if not _is_postgresql(connection):
+        return []
+    return [
+        dict(row) for row in connection.execute(text(LIST_PARTITIONS_SQL), table=table)
+    ]
+
+
+def _copy_id_range(connection, source, destination, first_id, last_id=None):
+    """Copy the rows with first_id < ID <= last_id from source to destination."""
+    id_filter = '"ID" > :first_id'
+    if last_id is not None:
+        id_filter += ' AND "ID" <= :last_id'
+    return connection.execute(
+        text(
+            f'INSERT INTO "{destination}" '
+            '("ID", "Timestamp_UTC", "Sensor_ID", "Reading") '
+            f'SELECT "ID", "Timestamp_UTC", "Sensor_ID", "Reading" FROM "{source}" '
+            f'WHERE {id_filter} AND "Timestamp_UTC" IS NOT NULL'
+        ),
+        first_id=first_id,
+        last_id=last_id,
+    ).rowcount
+
+
+def _find_id_gaps(connection, table, first_id, last_id):
+    """Return a list of (after, before) bounds of the runs of IDs missing from
+    table with first_id < ID <= last_id."""
+    return [
+        tuple(x)
+        for x in connection.execute(
+            text(FIND_ID_GAPS_SQL.format(table=table)),
+            first_id=first_id,
+            last_id=last_id,
+        )
+    ]
+
+
+def _copy_id_gaps(connection, source, destination, gaps):
+    """Copy the rows of source in the (after, before) ID gaps that destination
+    does not have yet, found by index lookups on the IDs in the gaps only."""
+    if not gaps:
+        return 0
+    after, before = zip(*gaps)
+    return connection.execute(
+        text(COPY_ID_GAPS_SQL.format(source=source, destination=destination)),
+        after=list(after),
+        before=list(before),
+    ).rowcount
+
+
+def migrate_to_partitioned_table(
+    db_engine, now, months_ahead, chunk_size=50000, table=READINGS_TABLE
+):
+    """Move an existing, unpartitioned table's rows into a new partitioned table.
+
+    The rows are copied in chunks of chunk_size IDs, each in its own transaction,
+    while the recorder keeps writing to the old table. The final chunk is copied
+    with the old table locked against writes and the tables are then swapped,
+    the old table is kept as "<table> unpartitioned". A row committed after the
+    chunk holding its ID was copied, e.g. by a second writer holding a lower ID,
+    lands in a gap in that chunk's IDs. The gaps are noted as each chunk is
+    copied and copied again before the lock is taken, then once more under it
+    for rows committed in between, which only looks up the IDs in the gaps. Rows
+    without a timestamp cannot be partitioned and are left in the old table.
+
+    Returns the number of rows copied, 0 if there was nothing to migrate.
+    """
+    new_table = f"{table} partitioned"
+    old_table = f"{table} unpartitioned"
+    with db_engine.begin() as connection:
+        if (
+            not _is_postgresql(connection)
+            or not table_exists(connection, table)
+            or is_partitioned(connection, table)
+        ):
+            return 0
+        # Free the index names for the new table.
+        for (index_name,) in connection.execute(
+            text(
+                "SELECT indexname FROM pg_indexes WHERE tablename = :table "
+                "AND indexname NOT LIKE '%pkey'"
+            ),
+            table=table,
+        ).fetchall():
+            connection.execute(
+                text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_old"')
+            )
+        create_partitioned_table(connection, new_table, partition_prefix=table)
+        create_indexes(connection, new_table)
+        first_timestamp = connection.execute(
+            text(f'SELECT min("Timestamp_UTC") FROM "{table}"')
+        ).scalar()
+        month = month_start(first_timestamp or now)
+        last_month = month_start(now)
+        for _ in range(months_ahead):
+            last_month = next_month(last_month)
+        while month <= last_month:
+            create_partition(connection, month, new_table, partition_prefix=table)
+            month = next_month(month)
+    rows_copied = 0
+    copied_to_id = 0
+    gaps = []
+    while True:
+        with db_engine.begin() as connection:
+            max_id = connection.execute(
+                text(f'SELECT max("ID") FROM "{table}"')
+            ).scalar()
+            if max_id is None or copied_to_id + chunk_size >= max_id:
+                break
+            rows_copied += _copy_id_range(
+                connection, table, new_table, copied_to_id, copied_to_id + chunk_size
+            )
+            gaps += _find_id_gaps(
+                connection, new_table, copied_to_id, copied_to_id + chunk_size
+            )
+        copied_to_id += chunk_size
+        logger.info("Copied %d rows to %s", rows_copied, new_table)
+    with db_engine.begin() as connection:
+        late_rows = _copy_id_gaps(connection, table, new_table, gaps)
+    with db_engine.begin() as connection:
+        connection.execute(text(f'LOCK TABLE "{table}" IN EXCLUSIVE MODE'))
+        rows_copied += _copy_id_range(connection, table, new_table, copied_to_id)
+        late_rows += _copy_id_gaps(connection, table, new_table, gaps)
+        if late_rows:
+            logger.info("Copied %d rows committed after their chunk", late_rows)
+        rows_copied += late_rows
+        connection.execute(text(f'ALTER TABLE "{table}" RENAME TO "{old_table}"'))
+        connection.execute(text(f'ALTER TABLE "{new_table}" RENAME TO "{table}"'))
+        connection.execute(
+            text(
+                "SELECT setval(pg_get_serial_sequence(:quoted_table, 'ID'), "
+                f'(SELECT coalesce(max("ID"), 0) + 1 FROM "{table}"), false)'
+            ),
+            quoted_table=f'"{table}"',
+        )
+    logger.info("Migrated %d rows to the partitioned %s table", rows_copied, table)
+    return rows_copied
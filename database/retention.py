@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Removes sensor readings and rollups that are older than their retention period.
+
+Whole monthly partitions of Sensor Readings are dropped where the table is
+partitioned, everything else is deleted in batches of a bounded size, each batch
+in its own short transaction so the recorder's writes are never held up for long.
+"""
+import logging
+from sqlalchemy import bindparam, text, DateTime
+from __config__ import FILE_DEBUG_LEVEL
+from . import partitions, rollups
+
+logger = logging.getLogger(__name__)
+logger.setLevel(FILE_DEBUG_LEVEL)
+
+# Table name, timestamp column and the columns that identify a row for each policy.
+RETENTION_TABLES = {
+    "raw": (partitions.READINGS_TABLE, "Timestamp_UTC", ("ID",)),
+    "hourly": (
+        rollups.ROLLUP_TABLES["hourly"],
+        "Period_Start",
+        ("Sensor_ID", "Period_Start"),
+    ),
+    "daily": (
+        rollups.ROLLUP_TABLES["daily"],
+        "Period_Start",
+        ("Sensor_ID", "Period_Start"),
+    ),
+}
+DELETE_BATCH_SQL = """
+    DELETE FROM "{table}" WHERE ({key}) IN (
+        SELECT {key} FROM "{table}" WHERE "{column}" < :cutoff LIMIT :batch_size
+    )
+"""
+# Averages over the partitions too, a partitioned parent has no storage of its own.
+BYTES_PER_ROW_SQL = """
+    SELECT sum(pg_total_relation_size(oid))::float
+        / nullif(sum(greatest(reltuples, 0)), 0)
+    FROM pg_class
+    WHERE oid = quote_ident(:table)::regclass
+        OR oid IN (
+            SELECT inhrelid FROM pg_inherits
+            WHERE inhparent = quote_ident(:table)::regclass
+        )
+"""
+# Fail rather than queue behind a long query, a queued lock would block the writer.
+LOCK_TIMEOUT_SQL = "SET LOCAL lock_timeout = '5s'"
+
+
+def expired_partitions(connection, cutoff, table=partitions.READINGS_TABLE):
+    """Return the names of the monthly partitions that only hold times before the
+    cutoff."""
+    expired = []
+    for partition in partitions.list_partitions(connection, table):
+        month = partitions.partition_month(partition["name"], table)
+        if month is not None and partitions.next_month(month) <= cutoff:
+            expired.append(partition["name"])
+    return expired
+
+
+def drop_partition(connection, name):
+    """Drop a partition, returning the number of rows and bytes it held."""
+    connection.execute(text(LOCK_TIMEOUT_SQL))
+    rows = connection.execute(text(f'SELECT count(*) FROM "{name}"')).scalar()
+    size_bytes = connection.execute(
+        text("SELECT pg_total_relation_size(quote_ident(:name)::regclass)"), name=name
+    ).scalar()
+    connection.execute(text(f'DROP TABLE "{name}"'))
+    logger.info("Dropped partition %s, %d rows", name, rows)
+    return rows, size_bytes
+
+
+def bytes_per_row(connection, table):
+    """Return the average bytes per row of a PostgreSQL table, None elsewhere or
+    if the table has not been analyzed."""
+    if connection.dialect.name != "postgresql":
+        return None
+    return connection.execute(text(BYTES_PER_ROW_SQL), table=table).scalar()
+
+
+def delete_expired_batch(connection, policy, cutoff, batch_size):
+    """Delete up to batch_size rows older than the cutoff from a policy's table,
+    returning the number deleted."""
+    table, column, key_columns = RETENTION_TABLES[policy]
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(LOCK_TIMEOUT_SQL))
+    key = ", ".join(f'"{x}"' for x in key_columns)
+    return connection.execute(
+        text(DELETE_BATCH_SQL.format(table=table, column=column, key=key)).bindparams(
+            bindparam("cutoff", type_=DateTime)
+        ),
+        cutoff=cutoff,
+        batch_size=batch_size,
+    ).rowcount
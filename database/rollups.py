@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Hourly and daily rollups of the Sensor Readings table.
+
+Each rollup row holds the count, sum, minimum and maximum of one sensor's
+readings over one hour or day, so the mean is Sum / Count. The rollups are
+updated in the same transaction as the readings they summarise, and can be
+rebuilt from the readings for a time range, or only added where they are missing.
+"""
+import logging
+from collections import defaultdict
+from sqlalchemy import bindparam, text, DateTime
+from __config__ import FILE_DEBUG_LEVEL
+
+logger = logging.getLogger(__name__)
+logger.setLevel(FILE_DEBUG_LEVEL)
+
+ROLLUP_TABLES = {"hourly": "Sensor Readings Hourly", "daily": "Sensor Readings Daily"}
+# Truncates Timestamp_UTC to the start of its period, the SQLite form matches the way
+# SQLAlchemy stores a DateTime as text.
+PERIOD_START_SQL = {
+    "postgresql": {
+        "hourly": "date_trunc('hour', \"Timestamp_UTC\")",
+        "daily": "date_trunc('day', \"Timestamp_UTC\")",
+    },
+    "sqlite": {
+        "hourly": "strftime('%Y-%m-%d %H:00:00.000000', \"Timestamp_UTC\")",
+        "daily": "strftime('%Y-%m-%d 00:00:00.000000', \"Timestamp_UTC\")",
+    },
+}
+UPSERT_ROLLUP_SQL = """
+    INSERT INTO "{table}" ("Sensor_ID", "Period_Start", "Count", "Sum", "Min", "Max")
+    VALUES (:sensor_id, :period_start, :count, :sum, :min, :max)
+    ON CONFLICT ("Sensor_ID", "Period_Start") DO UPDATE SET
+        "Count" = "{table}"."Count" + excluded."Count",
+        "Sum" = "{table}"."Sum" + excluded."Sum",
+        "Min" = CASE WHEN excluded."Min" < "{table}"."Min"
+            THEN excluded."Min" ELSE "{table}"."Min" END,
+        "Max" = CASE WHEN excluded."Max" > "{table}"."Max"
+            THEN excluded."Max" ELSE "{table}"."Max" END
+"""
+DELETE_ROLLUPS_SQL = (
+    'DELETE FROM "{table}" WHERE "Period_Start" >= :start AND "Period_Start" < :end'
+)
+REBUILD_ROLLUPS_SQL = """
+    INSERT INTO "{table}" ("Sensor_ID", "Period_Start", "Count", "Sum", "Min", "Max")
+    SELECT "Sensor_ID", {period_start}, count(*), sum("Reading"), min("Reading"),
+        max("Reading")
+    FROM "Sensor Readings"
+    WHERE "Timestamp_UTC" >= :start AND "Timestamp_UTC" < :end
+        AND "Sensor_ID" IS NOT NULL AND "Reading" IS NOT NULL
+    GROUP BY 1, 2
+"""
+# Adds rollups computed from the readings only for the sensors and periods that have
+# none, e.g. readings stored before the rollups existed, leaving the rest untouched.
+ADD_MISSING_ROLLUPS_SQL = """
+    INSERT INTO "{table}" ("Sensor_ID", "Period_Start", "Count", "Sum", "Min", "Max")
+    SELECT * FROM (
+        SELECT "Sensor_ID", {period_start} AS "Period_Start", count(*) AS "Count",
+            sum("Reading") AS "Sum", min("Reading") AS "Min", max("Reading") AS "Max"
+        FROM "Sensor Readings"
+        WHERE "Timestamp_UTC" >= :start AND "Timestamp_UTC" < :end
+            AND "Sensor_ID" IS NOT NULL AND "Reading" IS NOT NULL
+        GROUP BY 1, 2
+    ) AS readings
+    WHERE NOT EXISTS (
+        SELECT 1 FROM "{table}" AS rollups
+        WHERE rollups."Sensor_ID" = readings."Sensor_ID"
+            AND rollups."Period_Start" = readings."Period_Start"
+    )
+"""
+
+
+def period_start(timestamp, period):
+    """Return the start of the hourly or daily period holding the timestamp."""
+    if period == "hourly":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def aggregate_rows(rows, period):
+    """Summarise (timestamp, sensor ID, reading) rows into a dict of
+    [count, sum, min, max] keyed by (sensor ID, period start)."""
+    aggregates = defaultdict(lambda: [0, 0.0, float("inf"), float("-inf")])
+    for timestamp, sensor_id, reading in rows:
+        aggregate = aggregates[sensor_id, period_start(timestamp, period)]
+        aggregate[0] += 1
+        aggregate[1] += reading
+        if reading < aggregate[2]:
+            aggregate[2] = reading
+        if reading > aggregate[3]:
+            aggregate[3] = reading
+    return aggregates
+
+
+def update_rollups(connection, rows):
+    """Add reading rows to the hourly and daily rollups."""
+    for period, table in ROLLUP_TABLES.items():
+        connection.execute(
+            text(UPSERT_ROLLUP_SQL.format(table=table)).bindparams(
+                bindparam("period_start", type_=DateTime)
+            ),
+            [
+                {
+                    "sensor_id": sensor_id,
+                    "period_start": start,
+                    "count": count,
+                    "sum": total,
+                    "min": minimum,
+                    "max": maximum,
+                }
+                for (sensor_id, start), (count, total, minimum, maximum) in (
+                    aggregate_rows(rows, period).items()
+                )
+            ],
+        )
+
+
+def _period_sql(connection):
+    try:
+        return PERIOD_START_SQL[connection.dialect.name]
+    except KeyError as error:
+        raise ValueError(
+            f"Rollups are not supported on {connection.dialect.name}"
+        ) from error
+
+
+def _execute_for_range(connection, sql, start, end):
+    connection.execute(
+        text(sql).bindparams(
+            bindparam("start", type_=DateTime), bindparam("end", type_=DateTime)
+        ),
+        {"start": start, "end": end},
+    )
+
+
+def rebuild_rollups(connection, start, end):
+    """Replace the hourly and daily rollups from start up to end with ones
+    computed from the readings. start and end should be midnights so that no
+    day is only partly rebuilt."""
+    period_sql = _period_sql(connection)
+    for period, table in ROLLUP_TABLES.items():
+        for sql in (
+            DELETE_ROLLUPS_SQL.format(table=table),
+            REBUILD_ROLLUPS_SQL.format(table=table, period_start=period_sql[period]),
+        ):
+            _execute_for_range(connection, sql, start, end)
+
+
+def add_missing_rollups(connection, start, end):
+    """Add hourly and daily rollups computed from the readings from start up to
+    end for the periods of each sensor that have none. Periods that already have
+    a rollup were summarised as their readings were written and are kept."""
+    period_sql = _period_sql(connection)
+    for period, table in ROLLUP_TABLES.items():
+        _execute_for_range(
+            connection,
+            ADD_MISSING_ROLLUPS_SQL.format(
+                table=table, period_start=period_sql[period]
+            ),
+            start,
+            end,
+        )
@@ -5,64 +5,82 @@ Created on Tue Dec  3 10:39:49 2019
 
 @author: martinstephens
 """
+import bisect
+import itertools
 import threading
 import logging
 import queue
-from datetime import datetime
-import struct
+import time
+from datetime import datetime, timedelta
 from database import database
-from helpers import radiohelper
+from helpers import clock, metrics, radiohelper
 from helpers.display import oled_message
-from __config__ import FILE_DEBUG_LEVEL
-from . import _handleevents
+from __config__ import FILE_DEBUG_LEVEL, MAX_PACKET_GAP
+from . import _dbwriter, _handleevents, _packetlog
 
 radio_q = queue.Queue()
+codec = radiohelper.PacketCodec()
 
 logger = logging.getLogger(__name__)
 logger.setLevel(FILE_DEBUG_LEVEL)
 
 last_packet_info = {}  # Stores the latest packet serial number and time from each node.
 
+# Packets a replay looks up stored readings for at a time, and how far apart a logged
+# timestamp and a stored one may be and still be the same packet.
+REPLAY_CHUNK_PACKETS = 1000
+REPLAY_MATCH_TOLERANCE = timedelta(milliseconds=1)
 
-def unpack_data_packet(format_string, data_packet):
-    """Unpacks data using the supplied format string and returns it in a dict with the timestamp."""
-    logger.debug("unpack_data_packet called")
-    crc_checked_data = radiohelper.confirm_and_strip_crc(data_packet["radio_data"])
-    data_packet["radio_data"] = struct.unpack(format_string, crc_checked_data)
-    return data_packet
-
-
-def expand_radio_data_into_dict(data):
-    """Takes a tuple of unpacked radio data and splits it out into dictionaries."""
-    logger.debug("expand_radio_data_into_dict called")
-    readings = data["radio_data"]
-    munged_data = {
-        "node": {
-            "node_id": readings[0],
-            "pkt_serial": readings[2],
-            "status_register": readings[3],
-            "unused_1": readings[4],
-            "unused_2": readings[5],
-        },
-        "sensors": {"timestamp": data["timestamp"]},
-    }
-    zipped_sensor_readings = list(
-        zip(
-            readings[radiohelper.SENSOR_OFFSET :: 2],
-            readings[radiohelper.SENSOR_OFFSET + 1 :: 2],
-        )
-    )
-    munged_data["sensors"]["sensor_readings"] = [
-        x for x in zipped_sensor_readings if x[0] != 0xFF
-    ]
-    return munged_data
+# Seconds each packet spends in each stage of the receive pipeline, from the monotonic
+# stamps taken at receive, dequeue, decode, duplicate check, event enqueue and commit.
+LATENCY_STAGES = (
+    "queue_wait",
+    "decode",
+    "duplicate_check",
+    "event_enqueue",
+    "db_commit",
+    "end_to_end",
+)
+stage_latency_summary = metrics.REGISTRY.summary(
+    "datarecorder_stage_latency_seconds",
+    "Seconds packets spend in each stage of the receive pipeline",
+    ("stage",),
+)
+stage_latency = {x: stage_latency_summary.histogram(x) for x in LATENCY_STAGES}
+
+packets_received = metrics.REGISTRY.counter(
+    "datarecorder_packets_total", "Packets decoded, by node", ("node",)
+)
+duplicate_packets = metrics.REGISTRY.counter(
+    "datarecorder_duplicate_packets_total",
+    "Repeated packets dropped, by node",
+    ("node",),
+)
+missing_packets = metrics.REGISTRY.counter(
+    "datarecorder_missing_packets_total",
+    "Packets missing from gaps in the serial numbers, by node",
+    ("node",),
+)
+serial_resets = metrics.REGISTRY.counter(
+    "datarecorder_serial_resets_total",
+    "Serial numbers too far from the last to be a gap, e.g. after a node restart",
+    ("node",),
+)
+crc_failures = metrics.REGISTRY.counter(
+    "datarecorder_crc_failures_total", "Packets that failed the CRC or length check"
+)
+metrics.REGISTRY.gauge(
+    "datarecorder_radio_queue_depth",
+    "Raw packets waiting to be decoded",
+    function=lambda: radio_q.qsize(),
+)
 
 
-def packet_missing_or_duplicate(node_data):
+def packet_missing_or_duplicate(packet):
     """Check whether the packet is a duplicate or a packet was skipped."""
     logger.debug("check_for_duplicate_packet called")
-    node_id = node_data["node_id"]
-    new_packet_serial_number = node_data["pkt_serial"]
+    node_id = packet.node_id
+    new_packet_serial_number = packet.pkt_serial
     try:
         old_packet_serial_number = last_packet_info.get(node_id)["pkt_serial"]
     except TypeError:
@@ -86,6 +104,11 @@ def packet_missing_or_duplicate(node_data):
             old_packet_serial_number
         ):
             logger.warning("Data packet missing from node 0x%2.2x", node_id)
+            gap = (new_packet_serial_number - old_packet_serial_number - 1) % 0x10000
+            if gap <= MAX_PACKET_GAP:
+                missing_packets.inc(f"0x{node_id:02x}", amount=gap)
+            else:  # The node restarted at serial 0 or a packet arrived late
+                serial_resets.inc(f"0x{node_id:02x}")
             oled_message(
                 f"*Data missing from node 0x{node_id:02x}*"
             )
@@ -105,29 +128,184 @@ def packet_missing_or_duplicate(node_data):
     return True
 
 
-def process_radio_data():
-    """Gets a data packet, checks that it is new, then writes it to the database."""
-    logger.debug("process_radio_data called")
-    global radio_q
-    received_data = {"timestamp": datetime.utcnow(), "radio_data": radio_q.get()}
+def enqueue_packet(rx_packet, received_ns=None, timestamp=None):
+    """Puts a raw packet on the radio queue with its time.monotonic_ns() receive
+    stamp, taken now if not given, and its UTC timestamp if it already has one,
+    e.g. from a packet log. Packet sources deliver packets here."""
+    radio_q.put((received_ns or time.monotonic_ns(), rx_packet, timestamp))
+
+
+def _record_stage(stage, start_ns, end_ns):
+    stage_latency[stage].record((end_ns - start_ns) / 1e9)
+
+
+def _record_commit_latency(packets):
+    """Commit listener recording the database and end to end stages."""
+    committed_ns = time.monotonic_ns()
+    for packet in packets:
+        if packet.stamps is not None:
+            _record_stage("db_commit", packet.stamps[3], committed_ns)
+            _record_stage("end_to_end", packet.stamps[0], committed_ns)
+
+
+_dbwriter.commit_listeners.append(_record_commit_latency)
+
+
+def process_packet(
+    rx_packet, timestamp, handle_events=True, stamps=None, stored=None
+):
+    """Decodes a raw packet and, unless it is a duplicate, queues it for the database writer.
+
+    stamps is (received_ns, dequeued_ns) for packets from the radio queue, the
+    latency of each stage is then recorded in stage_latency. The timestamp of a
+    packet with stamps may be None, the database writer converts received_ns.
+    stored, if given, is called with each packet that is not a duplicate and the
+    packet is not queued if it returns True.
+    Returns True if the packet was queued.
+    """
     try:
-        unpacked_data = unpack_data_packet(radiohelper.RADIO_DATA_FORMAT, received_data)
-        logger.debug("Data packet = %s", (unpacked_data))
-        expanded_data = expand_radio_data_into_dict(unpacked_data)
-        if not packet_missing_or_duplicate(expanded_data["node"]):
-            database.write_sensor_reading_to_db(expanded_data["sensors"])
-            if expanded_data["node"]["status_register"]:
-                events = {
-                    "node_id": expanded_data["node"]["node_id"],
-                    "status_register": expanded_data["node"]["status_register"],
-                }
-                _handleevents.write_event_to_queue(events)
+        packet = codec.decode(rx_packet, timestamp=timestamp)
+        decoded_ns = time.monotonic_ns()
+        logger.debug("Data packet = %s", packet)
+        is_duplicate = packet_missing_or_duplicate(packet)
+        node_label = f"0x{packet.node_id:02x}"
+        packets_received.inc(node_label)
+        if is_duplicate:
+            duplicate_packets.inc(node_label)
+        if stamps is not None:
+            checked_ns = time.monotonic_ns()
+            packet.stamps = (*stamps, decoded_ns, checked_ns)
+            _record_stage("queue_wait", stamps[0], stamps[1])
+            _record_stage("decode", stamps[1], decoded_ns)
+            _record_stage("duplicate_check", decoded_ns, checked_ns)
+        if not is_duplicate:
+            if stored is not None and stored(packet):
+                return False
+            _dbwriter.write_packet_to_queue(packet)
+            if handle_events and _handleevents.wants_packet(packet):
+                _handleevents.write_event_to_queue(packet)
+                if stamps is not None:
+                    _record_stage("event_enqueue", checked_ns, time.monotonic_ns())
+            return True
     except ValueError:
+        crc_failures.inc()
         logger.warning("Bad data packet detected")
         oled_message("*Bad data packet Rx*")
+    return False
+
+
+def process_radio_data():
+    """Gets a data packet, logs it, checks that it is new, then queues it for the database writer.
+
+    A logged packet is given the UTC time it is logged with, so a replay of the log
+    finds its stored readings. Other packets are left for the database writer to
+    convert their receive stamps in bulk. A packet that arrives with a timestamp,
+    e.g. replayed from a packet log, keeps it and is not logged again.
+    """
+    logger.debug("process_radio_data called")
+    global radio_q
+    received_ns, rx_packet, timestamp = radio_q.get()
+    dequeued_ns = time.monotonic_ns()
+    if timestamp is None and _packetlog.packet_log_is_open():
+        timestamp = clock.to_utc(received_ns)
+        _packetlog.log_packet(rx_packet, timestamp)
+    process_packet(rx_packet, timestamp, stamps=(received_ns, dequeued_ns))
     radio_q.task_done()
 
 
+def get_latency_metrics():
+    """Return a dict of the count, mean, max, p50, p95 and p99 in seconds per stage."""
+    return {stage: stage_latency[stage].summary() for stage in LATENCY_STAGES}
+
+
+def log_latency_metrics():
+    """Log the latency of each stage of the receive pipeline."""
+    for stage, summary in get_latency_metrics().items():
+        if summary["count"]:
+            logger.info(
+                "%-15s n=%d p50=%.2f ms p95=%.2f ms p99=%.2f ms max=%.2f ms",
+                stage,
+                summary["count"],
+                summary["p50"] * 1000,
+                summary["p95"] * 1000,
+                summary["p99"] * 1000,
+                summary["max"] * 1000,
+            )
+
+
+def _stored_packet_check(packets, report):
+    """Return a function that is True for a packet with a reading or event stored
+    within REPLAY_MATCH_TOLERANCE of its timestamp, counting it in report."""
+    window = REPLAY_MATCH_TOLERANCE
+    stored_readings, stored_events = database.get_stored_timestamps(
+        min(x[0] for x in packets) - window, max(x[0] for x in packets) + window
+    )
+
+    def stored_near(timestamps, timestamp):
+        return bisect.bisect_right(timestamps, timestamp + window) > bisect.bisect_left(
+            timestamps, timestamp - window
+        )
+
+    def is_stored(packet):
+        if any(
+            stored_near(stored_readings.get(x, ()), packet.timestamp)
+            for x in packet.sensor_ids
+        ) or stored_near(stored_events.get(packet.node_id, ()), packet.timestamp):
+            report["skipped"] += 1
+            return True
+        return False
+
+    return is_stored
+
+
+def _check_replay_writes(failed_commits):
+    if _dbwriter.get_writer_metrics()["failed_commits"] != failed_commits:
+        raise ConnectionError(
+            "Replay stopped, a database write failed. Run it again when the database "
+            "is back, the packets already written are skipped."
+        )
+
+
+def replay_packet_log(paths):
+    """Pushes the packets in packet log files through decoding, duplicate checks and
+    the database writer in the calling thread, as fast as the database takes them.
+
+    Packets whose node already has readings or events stored at their timestamp are
+    skipped, so a replay over rows already in the database does not write or roll
+    them up twice. Events are not raised again. Run it with the recorder stopped, it
+    clears the duplicate check state. Raises ConnectionError as soon as a database
+    write fails. Returns a dict with the packets read, packets queued, packets
+    skipped as already stored, rows written and seconds taken.
+    """
+    logger.debug("replay_packet_log called")
+    last_packet_info.clear()
+    report = {"packets": 0, "queued": 0, "skipped": 0, "rows": 0, "seconds": 0.0}
+    writer_metrics = _dbwriter.get_writer_metrics()
+    rows_before = writer_metrics["rows"]
+    failed_commits = writer_metrics["failed_commits"]
+    start = time.perf_counter()
+    for path in paths:
+        log_packets = _packetlog.read_packet_log(path)
+        while True:
+            packets = list(itertools.islice(log_packets, REPLAY_CHUNK_PACKETS))
+            if not packets:
+                break
+            is_stored = _stored_packet_check(packets, report)
+            for timestamp, rx_packet in packets:
+                report["packets"] += 1
+                report["queued"] += process_packet(
+                    rx_packet, timestamp, handle_events=False, stored=is_stored
+                )
+                while not _dbwriter.write_q.empty():
+                    _dbwriter.process_write_queue()
+                    _check_replay_writes(failed_commits)
+    _dbwriter.flush_buffer()
+    _check_replay_writes(failed_commits)
+    report["rows"] = _dbwriter.get_writer_metrics()["rows"] - rows_before
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
 def init_data_processing_thread():
     """Initializes dataprocessing thread."""
     logger.debug("init_data_processing_thread called")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Collects decoded packets in a buffer and writes them to the database in batches.
+
+The buffer is written out as one transaction when DB_BATCH_ROWS readings are
+waiting or DB_BATCH_INTERVAL_MS has passed since the first packet was buffered,
+whichever comes first. The events in the packets' status registers are written
+to the Events table in the same transaction. A batch the database will not take
+is spooled with its events, see _spool.
+"""
+import logging
+import queue
+import threading
+import time
+from database import database
+from helpers import clock, metrics
+from . import _spool
+from __config__ import FILE_DEBUG_LEVEL, DB_BATCH_ROWS, DB_BATCH_INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(FILE_DEBUG_LEVEL)
+
+write_q = queue.Queue()
+
+_buffer = []
+_buffer_lock = threading.Lock()
+_buffer_state = {"rows": 0, "flush_deadline": None}
+_writer_stats = {
+    "commits": 0,
+    "rows": 0,
+    "events": 0,
+    "failed_commits": 0,
+    "started": time.monotonic(),
+}
+# Callables run in the writer thread with the list of packets after each commit.
+commit_listeners = []
+
+commit_seconds = metrics.REGISTRY.summary(
+    "datarecorder_db_commit_seconds", "Seconds taken to write and commit a batch"
+)
+metrics.REGISTRY.counter(
+    "datarecorder_db_commits_total",
+    "Batches committed to the database",
+    function=lambda: _writer_stats["commits"],
+)
+metrics.REGISTRY.counter(
+    "datarecorder_db_rows_total",
+    "Sensor readings committed to the database",
+    function=lambda: _writer_stats["rows"],
+)
+metrics.REGISTRY.counter(
+    "datarecorder_db_events_total",
+    "Node events in batches committed to the database",
+    function=lambda: _writer_stats["events"],
+)
+metrics.REGISTRY.counter(
+    "datarecorder_db_failed_commits_total",
+    "Batches the database refused, sent to the spool instead",
+    function=lambda: _writer_stats["failed_commits"],
+)
+metrics.REGISTRY.gauge(
+    "datarecorder_write_queue_depth",
+    "Decoded packets waiting for the database writer",
+    function=lambda: write_q.qsize(),
+)
+metrics.REGISTRY.gauge(
+    "datarecorder_buffered_rows",
+    "Sensor readings buffered for the next commit",
+    function=lambda: _buffer_state["rows"],
+)
+
+
+def write_packet_to_queue(packet):
+    """Add a decoded packet with readings or events to the queue of packets waiting
+    to be written."""
+    logger.debug("write_packet_to_queue called")
+    if len(packet) or packet.status_register:
+        write_q.put(packet)
+
+
+def _flush_is_due():
+    deadline = _buffer_state["flush_deadline"]
+    return _buffer_state["rows"] >= DB_BATCH_ROWS or (
+        deadline is not None and time.monotonic() >= deadline
+    )
+
+
+def _spool_or_keep(packets, event_rows):
+    """Spool packets the database would not take with their event rows. If the
+    spool fails too, put the packets back at the front of the buffer to be retried
+    at the next flush."""
+    try:
+        _spool.spool_packets(packets, event_rows)
+    except Exception as error:  # pylint: disable=broad-except
+        logger.critical("Spool write failed, keeping readings in memory: %s", error)
+        _buffer[:0] = packets
+        _buffer_state["rows"] += sum(len(x) for x in packets)
+        _buffer_state["flush_deadline"] = time.monotonic() + DB_BATCH_INTERVAL_MS / 1000
+
+
+def flush_buffer():
+    """Write all buffered packets to the database in one commit, or to the spool if
+    timestamping, building the event rows or the database write fails.
+
+    Returns the number of rows written to the database.
+    """
+    logger.debug("flush_buffer called")
+    with _buffer_lock:
+        packets = _buffer[:]
+        _buffer.clear()
+        _buffer_state["rows"] = 0
+        _buffer_state["flush_deadline"] = None
+        if not packets:
+            return 0
+        event_rows = []
+        start = time.perf_counter()
+        try:
+            clock.fill_timestamps(packets)
+            event_rows = database.get_event_rows(packets)
+            rows_written = database.write_sensor_readings_to_db(packets, event_rows)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Database write failed, spooling readings: %s", error)
+            _writer_stats["failed_commits"] += 1
+            _spool_or_keep(packets, event_rows)
+            return 0
+        commit_seconds.observe(time.perf_counter() - start)
+        _writer_stats["commits"] += 1
+        _writer_stats["rows"] += rows_written
+        _writer_stats["events"] += len(event_rows)
+    logger.debug("%d rows committed to the database", rows_written)
+    for listener in commit_listeners:
+        listener(packets)
+    return rows_written
+
+
+def process_write_queue():
+    """Move a packet from the queue to the buffer, then flush the buffer if it is due."""
+    logger.debug("process_write_queue called")
+    deadline = _buffer_state["flush_deadline"]
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+    try:
+        packet = write_q.get(timeout=timeout)
+    except queue.Empty:
+        pass
+    else:
+        with _buffer_lock:
+            _buffer.append(packet)
+            _buffer_state["rows"] += len(packet)
+            if _buffer_state["flush_deadline"] is None:
+                _buffer_state["flush_deadline"] = (
+                    time.monotonic() + DB_BATCH_INTERVAL_MS / 1000
+                )
+        write_q.task_done()
+    if _flush_is_due():
+        flush_buffer()
+
+
+def get_writer_metrics():
+    """Return a dict with commits per second and rows per commit since start up."""
+    elapsed = time.monotonic() - _writer_stats["started"]
+    commits = _writer_stats["commits"]
+    return {
+        "commits": commits,
+        "rows": _writer_stats["rows"],
+        "failed_commits": _writer_stats["failed_commits"],
+        "commits_per_second": commits / elapsed if elapsed else 0.0,
+        "rows_per_commit": _writer_stats["rows"] / commits if commits else 0.0,
+        "buffered_rows": _buffer_state["rows"],
+    }
+
+
+def init_db_writer_thread():
+    """Initializes the database writer thread."""
+    logger.debug("init_db_writer_thread called")
+    writer_thread = threading.Thread(target=loop_process_write_queue, name="dbwriter")
+    writer_thread.daemon = True
+    writer_thread.start()
+    return writer_thread
+
+
+def loop_process_write_queue():
+    """Main loop monitors the database write queue."""
+    logger.debug("loop_process_write_queue called")
+    while True:
+        try:
+            process_write_queue()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Database writer error, carrying on")
+
+
+def shut_down():
+    """Wait for queued packets to be buffered, then write out the buffer."""
+    logger.info("Database writer shutting down")
+    write_q.join()
+    flush_buffer()
+    logger.info(
+        "Database writer: %(commits_per_second).2f commits/s, "
+        "%(rows_per_commit).1f rows/commit",
+        get_writer_metrics(),
+    )
@@ -9,7 +9,16 @@ import logging
 import threading
 import time
 import queue
-import urllib.request
+from collections import namedtuple
+from helpers import metrics
+from helpers.scheduler import Scheduler
+from helpers.webhooks import WebhookDispatcher
+from __config__ import (
+    EVENT_REPEAT_SECONDS,
+    WEBHOOK_BACKOFF,
+    WEBHOOK_RETRIES,
+    WEBHOOK_TIMEOUT,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -24,9 +33,155 @@ GATE_CLOSE = (
     "token=A0Wngnir5CqVDnS8M1fDIgWTZviD2FjrJ2caEJZImqjXHqOGuZQz14OOOcn2wFXH"
 )
 event_queue = queue.Queue()
+metrics.REGISTRY.gauge(
+    "datarecorder_event_queue_depth",
+    "Packets with events waiting to be handled",
+    function=lambda: event_queue.qsize(),
+)
+REGISTER_BITS = 16
+TRIGGERS = ("rising", "falling", "both", "level")
+# Actions by node and event bit. "trigger" is when the action fires: when the bit
+# is set ("rising", the default), cleared ("falling") or either ("both"), or on
+# every packet with the bit set ("level") but at most once every "repeat" seconds.
+# A delayed action runs from the scheduler thread, "cancels" lists the events of
+# the node whose pending actions the event cancels.
+# Change them with set_event_actions so the action table is rebuilt.
 event_actions = {
-    0x05: {0x00: {"url": GATE_OPEN, "delay": 0}, 0x01: {"url": GATE_CLOSE, "delay": 0}}
+    0x05: {
+        0x00: {"url": GATE_OPEN, "delay": 0},
+        0x01: {"url": GATE_CLOSE, "delay": 0, "cancels": [0x00]},
+    }
 }
+scheduler = Scheduler(
+    "event_scheduler",
+    metrics.REGISTRY.summary(
+        "datarecorder_action_lateness_seconds",
+        "Seconds delayed event actions ran after they were due",
+    ).histogram(),
+)
+metrics.REGISTRY.gauge(
+    "datarecorder_scheduled_actions",
+    "Delayed event actions waiting to run",
+    function=lambda: scheduler.pending,
+)
+dispatcher = WebhookDispatcher(
+    timeout=WEBHOOK_TIMEOUT,
+    retries=WEBHOOK_RETRIES,
+    backoff=WEBHOOK_BACKOFF,
+)
+suppressed_events = metrics.REGISTRY.counter(
+    "datarecorder_suppressed_events_total",
+    "Set event bits that fired no action, being unchanged or repeated too soon",
+)
+cancelled_actions = metrics.REGISTRY.counter(
+    "datarecorder_cancelled_actions_total",
+    "Delayed event actions cancelled by a later event",
+)
+
+
+# An action compiled from event_actions, url is None for an event with no action.
+EventAction = namedtuple("EventAction", ["event", "url", "delay", "cancels"])
+
+
+class NodeActions(
+    namedtuple("NodeActions", ["low", "high", "rising", "falling", "level", "repeats"])
+):
+    """The compiled actions of a node. low and high are indexed by the low and high
+    byte of a register of the bits to fire, rising, falling and level are masks of
+    the bits with each trigger ("both" bits are in rising and falling) and repeats
+    the level repeat window of each bit."""
+
+    __slots__ = ()
+
+    def actions(self, register):
+        """Return the tuple of EventActions for the bits set, lowest bit first."""
+        return self.low[register & 0xFF] + self.high[register >> 8]
+
+
+register_state = {}  # The last status register from each node with actions.
+_level_fired = {}  # When each level action of each node last fired.
+
+
+def _trigger_masks(node_id, node_actions):
+    """Return the rising, falling and level masks and the repeat of each bit, bits
+    without an action are rising so they are logged once each time they are set."""
+    masks = dict.fromkeys(TRIGGERS, 0)
+    repeats = [EVENT_REPEAT_SECONDS] * REGISTER_BITS
+    for bit in range(REGISTER_BITS):
+        action = node_actions.get(bit, {})
+        trigger = action.get("trigger", "rising")
+        if trigger not in TRIGGERS:
+            raise ValueError(
+                f"Event 0x{bit:02x} of node 0x{node_id:02x} has trigger {trigger!r}"
+            )
+        masks[trigger] |= 1 << bit
+        repeats[bit] = action.get("repeat", EVENT_REPEAT_SECONDS)
+    return (
+        masks["rising"] | masks["both"],
+        masks["falling"] | masks["both"],
+        masks["level"],
+        tuple(repeats),
+    )
+
+
+def _byte_table(by_bit):
+    """Return a tuple indexed by byte value of the tuple of the actions in by_bit
+    for the bits set, lowest bit first."""
+    # Each byte's actions are those of the byte without its lowest set bit, which
+    # comes earlier in the table, after that bit's action.
+    table = [()] * 0x100
+    for byte in range(1, 0x100):
+        lowest = byte & -byte
+        table[byte] = (by_bit[lowest.bit_length() - 1],) + table[byte ^ lowest]
+    return tuple(table)
+
+
+def compile_event_actions(actions):
+    """Return a dict of NodeActions by node, one 256 entry table per register
+    byte, so the actions of a register are two lookups and a concatenation."""
+    logger.debug("compile_event_actions called")
+    tables = {}
+    for node_id, node_actions in actions.items():
+        unknown = set(node_actions) - set(range(REGISTER_BITS))
+        if unknown:
+            raise ValueError(f"Node 0x{node_id:02x} has events {unknown} beyond bit 15")
+        masks = _trigger_masks(node_id, node_actions)
+        by_bit = [
+            EventAction(bit, None, 0, ())
+            if bit not in node_actions
+            else EventAction(
+                bit,
+                node_actions[bit]["url"],
+                node_actions[bit]["delay"],
+                tuple(node_actions[bit].get("cancels", ())),
+            )
+            for bit in range(REGISTER_BITS)
+        ]
+        tables[node_id] = NodeActions(
+            _byte_table(by_bit[:8]), _byte_table(by_bit[8:]), *masks
+        )
+    return tables
+
+
+action_tables = None  # Compiled from event_actions on first use.
+
+
+def get_action_tables():
+    """Return the NodeActions by node, compiling event_actions the first time."""
+    global action_tables
+    tables = action_tables
+    if tables is None:
+        tables = action_tables = compile_event_actions(event_actions)
+    return tables
+
+
+def set_event_actions(actions):
+    """Replace the event actions. The table is compiled first and swapped in with
+    one assignment, so the event thread sees either the old or the new actions."""
+    logger.debug("set_event_actions called")
+    global event_actions, action_tables
+    tables = compile_event_actions(actions)
+    event_actions, action_tables = actions, tables
 
 
 def _decode_register(register):
@@ -39,46 +194,93 @@ def _decode_register(register):
     return status_codes
 
 
+def _bits_to_fire(node_id, node, register):
+    """Return a register of the bits of node_id whose actions fire for register and
+    remember it as the node's state."""
+    previous = register_state.get(node_id, 0)
+    register_state[node_id] = register
+    changed = previous ^ register
+    fire = changed & register & node.rising | changed & previous & node.falling
+    level = register & node.level
+    if level:
+        now = time.monotonic()
+        for event in _decode_register(level):
+            fired = _level_fired.get((node_id, event))
+            if fired is not None and now - fired < node.repeats[event]:
+                level ^= 1 << event
+            else:
+                _level_fired[node_id, event] = now
+    suppressed_events.inc(
+        amount=bin(register & ~(fire | level) & (node.rising | node.level)).count("1")
+    )
+    return fire | level
+
+
+def _run_action(url):
+    """Send the webhook of an event action, the dispatcher logs any failure."""
+    logger.debug("_run_action called")
+    dispatcher.submit(url)
+
+
 def read_event_queue_handle_event():
     """Take events from the queue and act on them."""
     logger.debug("read_event_queue_handle_event called")
     global event_queue
     try:
-        events = event_queue.get()
+        packet = event_queue.get()
         logger.debug("Processing...")
 
     except queue.Empty:
         logger.error("Event thread called with empty queue")
         event_queue.task_done()
         return
-    node_id = events["node_id"]
-    decoded_events = _decode_register(events["status_register"])
-    for event in decoded_events:
-        try:
-            event_action = event_actions[node_id][event]
-            if event_action["delay"]:
-                logger.debug("delaying...")
-                time.sleep(event_action["delay"])
-                logger.debug("continuing...")
-            with urllib.request.urlopen(event_action["url"]) as response:
-                if response.status != 200:
-                    raise IOError("Bad response from server")
-        except KeyError:
+    node_id = packet.node_id
+    node = get_action_tables().get(node_id)
+    if node is None:
+        node_actions = [
+            EventAction(x, None, 0, ())
+            for x in _decode_register(packet.status_register)
+        ]
+    else:
+        node_actions = node.actions(
+            _bits_to_fire(node_id, node, packet.status_register)
+        )
+    for event, url, delay, cancels in node_actions:
+        if url is None:
             logger.error(
-                "Event 0x%02x from node 0x%02X} does not exist",
+                "Event 0x%02x from node 0x%02x does not exist",
                 event,
                 node_id,
             )
-        except IOError:
-            logger.error("Bad response from server")
+            continue
+        for cancelled_event in cancels:
+            cancelled = scheduler.cancel((node_id, cancelled_event))
+            if cancelled:
+                cancelled_actions.inc(amount=cancelled)
+                logger.info(
+                    "Event 0x%02x from node 0x%02x cancelled %d pending actions",
+                    event,
+                    node_id,
+                    cancelled,
+                )
+        if delay:
+            scheduler.schedule(delay, _run_action, url, key=(node_id, event))
+        else:
+            _run_action(url)
     event_queue.task_done()
 
 
-def write_event_to_queue(events):
-    """Add an event to the event queue."""
+def wants_packet(packet):
+    """True if the packet has events, or comes from a node with actions whose
+    register must be followed to see bits cleared."""
+    return bool(packet.status_register) or packet.node_id in get_action_tables()
+
+
+def write_event_to_queue(packet):
+    """Add a decoded packet to the event queue, see wants_packet."""
     logger.debug("write_event_to_queue called")
     try:
-        event_queue.put_nowait(events)
+        event_queue.put_nowait(packet)
         logger.debug(
             "Added events to queue. 0x%02x events in queue", event_queue.qsize()
         )
@@ -92,9 +294,23 @@ def init_event_thread():
     event_thread = threading.Thread(target=loop_read_event_queue)
     event_thread.daemon = True
     event_thread.start()
+    scheduler.start()
+    dispatcher.start()
     return event_thread
 
 
+def shut_down():
+    """Stop the scheduler and the webhook dispatcher after the webhooks already
+    queued, delayed actions and retries that have not run are dropped."""
+    logger.debug("shut_down called")
+    dropped = scheduler.shutdown()
+    if dropped:
+        logger.warning("%d delayed event actions dropped", dropped)
+    dropped = dispatcher.shutdown(timeout=WEBHOOK_TIMEOUT * 2)
+    if dropped:
+        logger.warning("%d failed webhooks not retried", dropped)
+
+
 def loop_read_event_queue():
     """Main loop to monitor the event queue"""
     logger.debug("loop_read_event_queue called")
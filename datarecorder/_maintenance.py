@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Runs periodic database housekeeping in a background thread.
+
+Every DB_MAINTENANCE_INTERVAL seconds the maintenance tasks are run in order, a
+task that fails is logged and does not stop the others.
+"""
+import logging
+import threading
+from database import database
+from __config__ import FILE_DEBUG_LEVEL, DB_MAINTENANCE_INTERVAL
+
+logger = logging.getLogger(__name__)
+logger.setLevel(FILE_DEBUG_LEVEL)
+
+maintenance_tasks = [database.ensure_partitions, database.apply_retention]
+_stop_event = threading.Event()
+
+
+def run_maintenance():
+    """Run each maintenance task once."""
+    logger.debug("run_maintenance called")
+    for task in maintenance_tasks:
+        try:
+            task()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Maintenance task %s failed: %s", task.__name__, error)
+
+
+def init_maintenance_thread():
+    """Initialize the database maintenance thread."""
+    logger.debug("init_maintenance_thread called")
+    _stop_event.clear()
+    maintenance_thread = threading.Thread(
+        target=loop_run_maintenance, name="maintenance"
+    )
+    maintenance_thread.daemon = True
+    maintenance_thread.start()
+    return maintenance_thread
+
+
+def loop_run_maintenance():
+    """Run the maintenance tasks every DB_MAINTENANCE_INTERVAL seconds until shut down."""
+    while not _stop_event.wait(DB_MAINTENANCE_INTERVAL):
+        run_maintenance()
+
+
+def shut_down():
+    """Stop the maintenance thread after any task in progress."""
+    logger.debug("shut_down called")
+    _stop_event.set()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Appends every raw radio packet with its receive time to a rotated binary log.
+
+The log lets packets be decoded again after the decoding changes or a bug is
+fixed, see _dataprocessing.replay_packet_log. A log file starts with MAGIC and
+holds one record per packet: the receive time in microseconds since the Unix
+epoch (UTC) as a signed 64 bit integer, the payload length as a byte, then the
+payload. Writes are buffered and flushed every PACKET_LOG_FLUSH_SECONDS, so a
+crash loses at most that many seconds of packets. When a file reaches
+PACKET_LOG_MAX_BYTES it is renamed with a .1 suffix, older files move up one
+and PACKET_LOG_BACKUPS files are kept.
+"""
+import logging
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+from __config__ import (
+    FILE_DEBUG_LEVEL,
+    PACKET_LOG_PATH,
+    PACKET_LOG_MAX_BYTES,
+    PACKET_LOG_BACKUPS,
+    PACKET_LOG_FLUSH_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(FILE_DEBUG_LEVEL)
+
+MAGIC = b"RFMPKT01"
+RECORD_HEADER = struct.Struct("<qB")
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+_log = {"file": None, "path": None, "size": 0, "flushed": 0.0}
+_log_lock = threading.Lock()
+
+
+def open_packet_log(path=PACKET_LOG_PATH):
+    """Open the packet log for appending, creating it if needed."""
+    logger.debug("open_packet_log called")
+    log_file = open(path, "ab")
+    if not log_file.tell():
+        log_file.write(MAGIC)
+    with _log_lock:
+        _log.update(
+            file=log_file, path=path, size=log_file.tell(), flushed=time.monotonic()
+        )
+
+
+def close_packet_log():
+    """Flush and close the packet log."""
+    with _log_lock:
+        if _log["file"] is not None:
+            _log["file"].close()
+            _log["file"] = None
+
+
+def _rotate():
+    path = _log["path"]
+    _log["file"].close()
+    for index in range(PACKET_LOG_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{index}"):
+            os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+    if PACKET_LOG_BACKUPS:
+        os.replace(path, f"{path}.1")
+    log_file = open(path, "wb")
+    log_file.write(MAGIC)
+    _log.update(file=log_file, size=len(MAGIC))
+    logger.info("Packet log rotated")
+
+
+def packet_log_is_open():
+    """Return True if received packets are being logged."""
+    return _log["file"] is not None
+
+
+def log_packet(rx_packet, timestamp):
+    """Append a raw packet and its UTC receive time to the packet log. Does
+    nothing when the log is not open."""
+    with _log_lock:
+        log_file = _log["file"]
+        if log_file is None:
+            return
+        log_file.write(
+            RECORD_HEADER.pack((timestamp - EPOCH) // ONE_MICROSECOND, len(rx_packet))
+        )
+        log_file.write(rx_packet)
+        _log["size"] += RECORD_HEADER.size + len(rx_packet)
+        now = time.monotonic()
+        if now - _log["flushed"] >= PACKET_LOG_FLUSH_SECONDS:
+            log_file.flush()
+            _log["flushed"] = now
+        if _log["size"] >= PACKET_LOG_MAX_BYTES:
+            _rotate()
+
+
+def packet_log_files(path=PACKET_LOG_PATH):
+    """Return the paths of the packet log and its rotated files, oldest first."""
+    rotated = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        rotated.append(f"{path}.{index}")
+        index += 1
+    rotated.reverse()
+    if os.path.exists(path):
+        rotated.append(path)
+    return rotated
+
+
+def read_packet_log(path):
+    """Yield (timestamp, rx_packet) for each packet in a packet log file. A record
+    cut short by a crash ends the file."""
+    with open(path, "rb") as log_file:
+        if log_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a packet log")
+        while True:
+            header = log_file.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) == RECORD_HEADER.size:
+                timestamp_us, length = RECORD_HEADER.unpack(header)
+                rx_packet = log_file.read(length)
+                if len(rx_packet) == length:
+                    yield EPOCH + timestamp_us * ONE_MICROSECOND, rx_packet
+                    continue
+            logger.warning("Packet log %s ends with a partial record", path)
+            return
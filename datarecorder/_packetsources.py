@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Sources of raw radio packets for the recorder.
+
+A PacketSource hands each raw packet to a deliver callable, normally
+_dataprocessing.enqueue_packet, from its own thread or interrupt callback. A
+source may pass the time.monotonic_ns() stamp of when it received the packet,
+otherwise the packet is stamped when delivered. ReplaySource passes the UTC
+timestamp each packet was logged with instead, so replayed readings keep their
+original time.
+
+Rfm69Source -- the RFM69 radio, read when its IRQ pin rises (Raspberry Pi only)
+SocketSource -- datagrams on a UDP port or a Unix socket, one packet per datagram
+ReplaySource -- the packets in packet log files, see _packetlog
+SyntheticSource -- generated packets from a number of nodes at a fixed rate
+
+The Raspberry Pi and radio libraries are only imported by Rfm69Source.start, so
+the other sources run on any Linux box. create_packet_source builds the source
+named by PACKET_SOURCE with its PACKET_SOURCE_OPTIONS.
+"""
+import abc
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from helpers import radiohelper
+from helpers.display import oled_message
+from __config__ import (
+    FILE_DEBUG_LEVEL,
+    PACKET_LOG_PATH,
+    PACKET_SOURCE,
+    PACKET_SOURCE_OPTIONS,
+)
+from . import _packetlog
+
+logger = logging.getLogger(__name__)
+logger.setLevel(FILE_DEBUG_LEVEL)
+
+MAX_DATAGRAM_BYTES = 256
+
+
+class PacketSource(abc.ABC):
+    """Delivers raw packets to a callable until stopped."""
+
+    @abc.abstractmethod
+    def start(self, deliver):
+        """Start delivering packets, deliver is called with each raw packet and
+        optionally its receive stamp."""
+
+    def stop(self):
+        """Stop delivering packets."""
+
+
+class _ThreadedSource(PacketSource):
+    """A source that delivers packets from a daemon thread running self._run."""
+
+    def __init__(self):
+        self._deliver = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=type(self).__name__, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def join(self, timeout=None):
+        """Wait for a source with a finite number of packets to deliver them all."""
+        self._thread.join(timeout)
+
+    @abc.abstractmethod
+    def _run(self):
+        """Deliver packets until the source is stopped or runs out of them."""
+
+
+class Rfm69Source(PacketSource):
+    """Packets received by the RFM69 radio on a Raspberry Pi."""
+
+    def __init__(self, irq_pin):
+        self.irq_pin = irq_pin
+        self.radio = None
+        self._deliver = None
+
+    @staticmethod
+    def initialize_rfm69():
+        """Initialize RFM69 packet radio."""
+        logger.debug("initialize_rfm69 called")
+        # pylint: disable=import-outside-toplevel
+        import board
+        import busio
+        import digitalio
+        import adafruit_rfm69
+
+        cs_pin = digitalio.DigitalInOut(board.CE1)
+        reset = digitalio.DigitalInOut(board.D25)
+        spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+        try:
+            rfm69 = adafruit_rfm69.RFM69(spi, cs_pin, reset, 433)
+            rfm69.encryption_key = radiohelper.RFM69_ENCRYPTION_KEY
+            logger.info("RFM69 radio initialized successfully")
+            oled_message("Radio initialized OK")
+            return rfm69
+        except RuntimeError as error:
+            logger.critical("RFM69 radio failed to initialize with RuntimeError")
+            raise error
+
+    def initialize_gpio_interrupt(self):
+        """Initializes GPIO interrupt pin to flag radio has received data."""
+        logger.debug("initialize_gpio_interrupt called")
+        import RPi.GPIO as rpigpio  # pylint: disable=import-outside-toplevel
+
+        rpigpio.setmode(rpigpio.BCM)
+        rpigpio.setup(self.irq_pin, rpigpio.IN, pull_up_down=rpigpio.PUD_DOWN)
+        rpigpio.remove_event_detect(self.irq_pin)
+        rpigpio.add_event_detect(self.irq_pin, rpigpio.RISING)
+        rpigpio.add_event_callback(self.irq_pin, self.rfm69_callback)
+
+    # rfm69_irq required to enable irq callback on Raspberry Pi.
+    def rfm69_callback(self, rfm69_irq):  # pylint: disable=unused-argument
+        """Interrupt callback routine to deliver radio data stamped with the
+        interrupt time."""
+        received_ns = time.monotonic_ns()
+        logger.debug("rfm69_callback called")
+        if self.radio.payload_ready:
+            packet = self.radio.receive(timeout=None)
+            if packet is not None:
+                self._deliver(packet, received_ns)
+
+    def start(self, deliver):
+        self._deliver = deliver
+        self.radio = self.initialize_rfm69()
+        self.initialize_gpio_interrupt()
+        self.radio.listen()
+
+    def stop(self):
+        import RPi.GPIO as rpigpio  # pylint: disable=import-outside-toplevel
+
+        rpigpio.remove_event_detect(self.irq_pin)
+
+
+class SocketSource(_ThreadedSource):
+    """Datagrams received on a UDP (host, port) address or a Unix socket path."""
+
+    def __init__(self, address):
+        super().__init__()
+        self.address = address
+        self._socket = None
+
+    def start(self, deliver):
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(self.address)
+        self._socket.settimeout(0.5)
+        logger.info("Listening for packets on %s", self.address)
+        super().start(deliver)
+
+    @property
+    def bound_address(self):
+        """The address bound, for a UDP port of 0 the port is chosen by the OS."""
+        return self._socket.getsockname()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                packet = self._socket.recv(MAX_DATAGRAM_BYTES)
+            except socket.timeout:
+                continue
+            self._deliver(packet)
+
+    def stop(self):
+        super().stop()
+        self._socket.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+class ReplaySource(_ThreadedSource):
+    """The packets in packet log files, at their original spacing divided by speed,
+    or as fast as they are taken when speed is None, each delivered with the
+    timestamp it was logged with."""
+
+    def __init__(self, paths=None, speed=None):
+        super().__init__()
+        self.paths = paths or _packetlog.packet_log_files(PACKET_LOG_PATH)
+        self.speed = speed
+
+    def _run(self):
+        first = None
+        start = time.monotonic()
+        for path in self.paths:
+            for timestamp, packet in _packetlog.read_packet_log(path):
+                if self._stop_event.is_set():
+                    return
+                if self.speed:
+                    first = first or timestamp
+                    due = start + (timestamp - first).total_seconds() / self.speed
+                    self._stop_event.wait(max(due - time.monotonic(), 0))
+                self._deliver(packet, timestamp=timestamp)
+        logger.info("Replay source finished")
+
+
+class SyntheticSource(_ThreadedSource):
+    """Packets from node IDs 1 to nodes, each with a full set of random readings,
+    sent in turn at rate packets per second in total, or as fast as they are
+    taken when rate is None. count limits the packets sent."""
+
+    def __init__(self, nodes=4, rate=100.0, count=None, seed=None):
+        super().__init__()
+        self.nodes = nodes
+        self.rate = rate
+        self.count = count
+        self._random = random.Random(seed)
+        self._codec = radiohelper.PacketCodec()
+
+    def make_packet(self, node_id, pkt_serial):
+        """Return a packet for the node, its sensors are numbered from
+        node_id * SENSOR_COUNT."""
+        first_sensor = node_id * radiohelper.SENSOR_COUNT
+        return self._codec.encode(
+            node_id,
+            pkt_serial,
+            sensor_readings=[
+                (
+                    (first_sensor + slot) % radiohelper.PADDING_SENSOR_ID,
+                    self._random.uniform(-50.0, 50.0),
+                )
+                for slot in range(radiohelper.SENSOR_COUNT)
+            ],
+        )
+
+    def _run(self):
+        sent = 0
+        start = time.monotonic()
+        while not self._stop_event.is_set() and sent != self.count:
+            node_id = sent % self.nodes + 1
+            pkt_serial = (sent // self.nodes) % 0x10000
+            if self.rate:
+                self._stop_event.wait(
+                    max(start + sent / self.rate - time.monotonic(), 0)
+                )
+            self._deliver(self.make_packet(node_id, pkt_serial))
+            sent += 1
+
+
+PACKET_SOURCES = {
+    "rfm69": Rfm69Source,
+    "udp": SocketSource,
+    "unix": SocketSource,
+    "replay": ReplaySource,
+    "synthetic": SyntheticSource,
+}
+
+
+def create_packet_source(name=PACKET_SOURCE, **options):
+    """Return the packet source called name, options override its
+    PACKET_SOURCE_OPTIONS."""
+    logger.debug("create_packet_source called")
+    try:
+        source_class = PACKET_SOURCES[name]
+    except KeyError:
+        raise ValueError(f"Unknown packet source {name!r}") from None
+    return source_class(**{**PACKET_SOURCE_OPTIONS.get(name, {}), **options})
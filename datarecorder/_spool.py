@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Keeps sensor readings and node events in a local SQLite spool while the database
+is unavailable.
+
+The database writer spools a batch it fails to write, and the drainer thread
+replays the spool into the database, oldest first, once the database is back.
+Readings and events are replayed in separate transactions, and events the
+database refuses while it is available are written one at a time, dropping any
+it still refuses, so one bad event cannot hold up the spool.
+The spool uses SQLite's write-ahead log with synchronous=NORMAL, so a commit is
+an append to the log and the log is synced to disk at checkpoints. Readings are
+deleted from the spool after the database commit, so a crash between the two
+replays that batch again.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from database import database
+from helpers import metrics
+from __config__ import (
+    FILE_DEBUG_LEVEL,
+    SPOOL_PATH,
+    SPOOL_DRAIN_ROWS,
+    SPOOL_RETRY_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(FILE_DEBUG_LEVEL)
+
+CREATE_SPOOL_SQL = """
+    CREATE TABLE IF NOT EXISTS readings (
+        id INTEGER PRIMARY KEY,
+        timestamp_us INTEGER NOT NULL,
+        sensor_id INTEGER NOT NULL,
+        reading REAL NOT NULL
+    )
+"""
+CREATE_EVENTS_SPOOL_SQL = """
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY,
+        timestamp_us INTEGER NOT NULL,
+        node_id INTEGER NOT NULL,
+        event_code INTEGER NOT NULL
+    )
+"""
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+_spool = {"connection": None}
+_spool_lock = threading.Lock()
+_spool_stats = {
+    "depth": 0,
+    "spooled_rows": 0,
+    "replayed_rows": 0,
+    "dropped_events": 0,
+    "replay_seconds": 0.0,
+}
+metrics.REGISTRY.gauge(
+    "datarecorder_spool_depth",
+    "Sensor readings and events waiting in the spool",
+    function=lambda: _spool_stats["depth"],
+)
+metrics.REGISTRY.counter(
+    "datarecorder_spooled_rows_total",
+    "Sensor readings and events written to the spool",
+    function=lambda: _spool_stats["spooled_rows"],
+)
+_rows_waiting = threading.Event()
+_stop_event = threading.Event()
+
+
+def open_spool(path=SPOOL_PATH):
+    """Open, creating if needed, the spool database. Returns the rows waiting in it."""
+    logger.debug("open_spool called")
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    with connection:
+        connection.execute(CREATE_SPOOL_SQL)
+        connection.execute(CREATE_EVENTS_SPOOL_SQL)
+    depth = connection.execute(
+        "SELECT (SELECT count(*) FROM readings) + (SELECT count(*) FROM events)"
+    ).fetchone()[0]
+    with _spool_lock:
+        _spool["connection"] = connection
+        _spool_stats["depth"] = depth
+    if depth:
+        logger.warning("%d spooled rows waiting to be replayed", depth)
+        _rows_waiting.set()
+    return depth
+
+
+def close_spool():
+    """Close the spool database."""
+    with _spool_lock:
+        if _spool["connection"] is not None:
+            _spool["connection"].close()
+            _spool["connection"] = None
+
+
+def _to_us(timestamp):
+    return (timestamp - EPOCH) // ONE_MICROSECOND
+
+
+def spool_packets(packets, event_rows=()):
+    """Append the readings of decoded packets and the (timestamp, node ID, event
+    code) event rows to the spool in one commit. Returns the number of readings
+    spooled."""
+    logger.debug("spool_packets called")
+    rows = [
+        (_to_us(packet.timestamp), sensor_id, reading)
+        for packet in packets
+        for sensor_id, reading in packet.sensor_readings()
+    ]
+    with _spool_lock:
+        connection = _spool["connection"]
+        if connection is None:
+            raise RuntimeError("Spool is not open")
+        with connection:
+            connection.executemany(
+                "INSERT INTO readings (timestamp_us, sensor_id, reading) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            connection.executemany(
+                "INSERT INTO events (timestamp_us, node_id, event_code) "
+                "VALUES (?, ?, ?)",
+                [(_to_us(x[0]), x[1], x[2]) for x in event_rows],
+            )
+        _spool_stats["depth"] += len(rows) + len(event_rows)
+        _spool_stats["spooled_rows"] += len(rows) + len(event_rows)
+    _rows_waiting.set()
+    return len(rows)
+
+
+def _oldest(table, columns, batch_rows):
+    with _spool_lock:
+        return (
+            _spool["connection"]
+            .execute(
+                f"SELECT id, timestamp_us, {columns} FROM {table} ORDER BY id LIMIT ?",
+                (batch_rows,),
+            )
+            .fetchall()
+        )
+
+
+def _remove(table, last_id, count, start):
+    """Remove the rows up to last_id from the spool after they were replayed."""
+    with _spool_lock:
+        connection = _spool["connection"]
+        with connection:
+            connection.execute(f"DELETE FROM {table} WHERE id <= ?", (last_id,))
+        _spool_stats["depth"] -= count
+        _spool_stats["replayed_rows"] += count
+        _spool_stats["replay_seconds"] += time.perf_counter() - start
+
+
+def _replay_events(events):
+    """Write spooled events to the database in one transaction. If the database
+    refuses them while it is available, write them one at a time and drop those it
+    still refuses. Returns the last event ID dealt with, database errors are raised
+    if the database is unavailable."""
+    rows = [
+        (EPOCH + timestamp_us * ONE_MICROSECOND, node_id, event_code)
+        for _, timestamp_us, node_id, event_code in events
+    ]
+    try:
+        database.write_reading_rows_to_db([], rows)
+        return events[-1][0]
+    except Exception:  # pylint: disable=broad-except
+        if not database.database_is_available():
+            raise
+    for (event_id, *_), row in zip(events, rows):
+        try:
+            database.write_reading_rows_to_db([], [row])
+        except Exception as error:  # pylint: disable=broad-except
+            if not database.database_is_available():
+                return event_id - 1
+            logger.error("Dropped spooled event %s: %s", row, error)
+            with _spool_lock:
+                _spool_stats["dropped_events"] += 1
+    return events[-1][0]
+
+
+def drain_spool(batch_rows=SPOOL_DRAIN_ROWS):
+    """Write up to batch_rows of the oldest spooled readings, then up to batch_rows
+    of the oldest spooled events, to the database and remove them from the spool.
+    Returns the number of rows replayed, database errors are raised."""
+    logger.debug("drain_spool called")
+    replayed = 0
+    rows = _oldest("readings", "sensor_id, reading", batch_rows)
+    if rows:
+        start = time.perf_counter()
+        database.write_reading_rows_to_db(
+            [
+                (EPOCH + timestamp_us * ONE_MICROSECOND, sensor_id, reading)
+                for _, timestamp_us, sensor_id, reading in rows
+            ]
+        )
+        _remove("readings", rows[-1][0], len(rows), start)
+        replayed += len(rows)
+    events = _oldest("events", "node_id, event_code", batch_rows)
+    if events:
+        start = time.perf_counter()
+        last_id = _replay_events(events)
+        done = [x for x in events if x[0] <= last_id]
+        if done:
+            _remove("events", last_id, len(done), start)
+            replayed += len(done)
+        if len(done) < len(events):
+            raise ConnectionError("Database became unavailable replaying events")
+    if replayed:
+        logger.info("Replayed %d spooled rows", replayed)
+    return replayed
+
+
+def get_spool_metrics():
+    """Return the rows waiting in the spool, the rows spooled and replayed and
+    the events dropped since start up and the replay rate in rows per second."""
+    with _spool_lock:
+        stats = dict(_spool_stats)
+    replay_seconds = stats.pop("replay_seconds")
+    stats["replay_rows_per_second"] = (
+        stats["replayed_rows"] / replay_seconds if replay_seconds else 0.0
+    )
+    return stats
+
+
+def init_drainer_thread():
+    """Initialize the spool drainer thread."""
+    logger.debug("init_drainer_thread called")
+    _stop_event.clear()
+    drainer_thread = threading.Thread(target=loop_drain_spool, name="spooldrainer")
+    drainer_thread.daemon = True
+    drainer_thread.start()
+    return drainer_thread
+
+
+def loop_drain_spool():
+    """Replay the spool whenever it holds readings, backing off for
+    SPOOL_RETRY_SECONDS while the database is unavailable."""
+    while not _stop_event.is_set():
+        if not _spool_stats["depth"]:
+            _rows_waiting.wait(SPOOL_RETRY_SECONDS)
+            _rows_waiting.clear()
+            continue
+        try:
+            drain_spool()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning(
+                "Spool replay failed, retrying in %d s: %s", SPOOL_RETRY_SECONDS, error
+            )
+            _stop_event.wait(SPOOL_RETRY_SECONDS)
+
+
+def shut_down():
+    """Stop the drainer thread, any readings left stay in the spool for the next
+    start up."""
+    logger.debug("shut_down called")
+    _stop_event.set()
+    _rows_waiting.set()
+    depth = get_spool_metrics()["depth"]
+    if depth:
+        logger.warning("%d readings left in the spool", depth)
@@ -7,43 +7,32 @@ Created on Fri Dec  6 12:30:25 2019
 """
 import logging
 import logging.handlers
-import board
-import busio
-import digitalio
-import RPi.GPIO as rpigpio
-import adafruit_rfm69
 from database import database
-from helpers import display
+from helpers import display, metrics
 from helpers.display import oled_message
-from helpers.radiohelper import RFM69_ENCRYPTION_KEY
-from . import _dataprocessing, _handleevents
-from __config__ import RFM69_INTERRUPT_PIN, FILE_DEBUG_LEVEL, CONSOLE_DEBUG_LEVEL
+from . import (
+    _dataprocessing,
+    _dbwriter,
+    _handleevents,
+    _maintenance,
+    _packetlog,
+    _packetsources,
+    _spool,
+)
+from __config__ import (
+    FILE_DEBUG_LEVEL,
+    CONSOLE_DEBUG_LEVEL,
+    METRICS_ADDRESS,
+    METRICS_PORT,
+    PACKET_SOURCE,
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(FILE_DEBUG_LEVEL)
 
-# Required for rfm69_callback function, not a constant.
-radio = None  # pylint: disable=invalid-name
-
-
-# rfm69_irq required to enable irq callback on Raspberry Pi.
-def rfm69_callback(rfm69_irq):  # pylint: disable=unused-argument
-    """Interrupt callback routine to put radio data into queue."""
-    logger.debug("rfm69_callback called")
-    if radio.payload_ready:
-        packet = radio.receive(timeout=None)
-        if packet is not None:
-            _dataprocessing.radio_q.put(packet)
-
-
-def initialize_gpio_interrupt(rfm69_g0):
-    """Initializes GPIO interrupt pin to flag radio has received data."""
-    logger.debug("initialize_gpio_interrupt called")
-    rpigpio.setmode(rpigpio.BCM)
-    rpigpio.setup(rfm69_g0, rpigpio.IN, pull_up_down=rpigpio.PUD_DOWN)
-    rpigpio.remove_event_detect(rfm69_g0)
-    rpigpio.add_event_detect(rfm69_g0, rpigpio.RISING)
-    rpigpio.add_event_callback(rfm69_g0, rfm69_callback)
+# The running PacketSource and metrics HTTP server, stopped by shut_down.
+packet_source = None  # pylint: disable=invalid-name
+metrics_server = None  # pylint: disable=invalid-name
 
 
 def initialize_logging(file_logging_level, console_logging_level):
@@ -64,21 +53,35 @@ def initialize_logging(file_logging_level, console_logging_level):
     logging.getLogger("").addHandler(file_handler)
 
 
-def initialize_rfm69():
-    """Initialize RFM69 packet radio."""
-    logger.debug("initialize_rfm69 called")
-    cs_pin = digitalio.DigitalInOut(board.CE1)
-    reset = digitalio.DigitalInOut(board.D25)
-    spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+def initialize_packet_source(source=None, pi_irq_pin=None):
+    """Start a packet source delivering to the radio queue, by default the source
+    named by PACKET_SOURCE. pi_irq_pin overrides the RFM69 interrupt pin."""
+    logger.debug("initialize_packet_source called")
+    global packet_source  # pylint: disable=global-statement,invalid-name
+    if source is None:
+        options = {}
+        if PACKET_SOURCE == "rfm69" and pi_irq_pin is not None:
+            options["irq_pin"] = pi_irq_pin
+        source = _packetsources.create_packet_source(PACKET_SOURCE, **options)
+    source.start(_dataprocessing.enqueue_packet)
+    packet_source = source
+    logger.info("Packet source %s started", type(source).__name__)
+    return source
+
+
+def initialize_metrics_server(address=METRICS_ADDRESS, port=METRICS_PORT):
+    """Serve the metrics registry over HTTP unless port is None."""
+    logger.debug("initialize_metrics_server called")
+    global metrics_server  # pylint: disable=global-statement,invalid-name
+    if port is None:
+        return None
     try:
-        rfm69 = adafruit_rfm69.RFM69(spi, cs_pin, reset, 433)
-        rfm69.encryption_key = RFM69_ENCRYPTION_KEY
-        logger.info("RFM69 radio initialized successfully")
-        oled_message("Radio initialized OK")
-        return rfm69
-    except RuntimeError as error:
-        logger.critical("RFM69 radio failed to initialize with RuntimeError")
-        raise error
+        metrics_server = metrics.start_http_server(address, port)
+    except OSError as error:
+        logger.error("Metrics endpoint not started on %s:%s: %s", address, port, error)
+        return None
+    logger.info("Metrics served at http://%s:%s/metrics", address, port)
+    return metrics_server
 
 
 def initialize_database(url_db):
@@ -88,35 +91,51 @@ def initialize_database(url_db):
 
 
 def initialize_processing_thread():
-    """Initialize main processing thread"""
+    """Initialize main processing, database writer, spool and maintenance threads"""
     logger.debug("initialize_processing_thread called")
+    _packetlog.open_packet_log()
+    _spool.open_spool()
+    _spool.init_drainer_thread()
+    _dbwriter.init_db_writer_thread()
+    _maintenance.init_maintenance_thread()
     _dataprocessing.init_data_processing_thread()
 
 
 def start_up(
-    db_url=None, pi_irq_pin=None, logging_levels=(FILE_DEBUG_LEVEL, CONSOLE_DEBUG_LEVEL)
+    db_url=None,
+    pi_irq_pin=None,
+    logging_levels=(FILE_DEBUG_LEVEL, CONSOLE_DEBUG_LEVEL),
+    source=None,
 ):
-    """Setup logging, database connection and threads then start main loop."""
+    """Setup logging, database connection and threads then start the packet source."""
     logger.debug("start_up called")
     initialize_logging(*logging_levels)
     initialize_database(db_url)
     initialize_processing_thread()
-    rfm69 = initialize_rfm69()
-    initialize_gpio_interrupt(pi_irq_pin)
+    initialize_metrics_server()
     display.init()
     _handleevents.init_event_thread()
 
-    rfm69.listen()
+    source = initialize_packet_source(source, pi_irq_pin)
     logger.info("Listening for radio data…")
     oled_message("Waiting for data...")
-    return rfm69
+    return source
 
 
-def shut_down(pi_irq_pin=RFM69_INTERRUPT_PIN):
-    """Shutdown interrupt and wait for threads to complete."""
+def shut_down():
+    """Stop the packet source and wait for threads to complete."""
     logger.info("shut_down_called")
     # TODO: Move shutdown code out to modules.
-    rpigpio.remove_event_detect(pi_irq_pin)
+    if packet_source is not None:
+        packet_source.stop()
+    _maintenance.shut_down()
     _dataprocessing.radio_q.join()
+    _packetlog.close_packet_log()
+    _dbwriter.shut_down()
+    _dataprocessing.log_latency_metrics()
+    _spool.shut_down()
     _handleevents.event_queue.join()
+    _handleevents.shut_down()
     display.shutdown()
+    if metrics_server is not None:
+        metrics_server.shutdown()
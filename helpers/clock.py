@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Converts monotonic receive stamps to UTC time.
+
+Packets are stamped with time.monotonic_ns() when they are received, which is
+cheap and never steps. The stamps are converted to UTC with an anchor, a reading
+of the wall clock paired with the monotonic clock: utc = anchor_utc + (stamp -
+anchor_monotonic). The anchor is read again when it is older than
+CLOCK_ANCHOR_SECONDS, so conversions follow NTP, including the step when the
+clock is first set after boot on a Pi without a real time clock.
+
+to_utc(stamp_ns) -- convert one stamp
+fill_timestamps(packets) -- convert the receive stamps of a batch of packets
+"""
+import time
+from datetime import datetime, timedelta
+from __config__ import CLOCK_ANCHOR_SECONDS
+
+EPOCH = datetime(1970, 1, 1)
+
+_anchor = {"offset_ns": 0, "monotonic_ns": None}
+
+
+def read_anchor():
+    """Pair the wall clock with the monotonic clock. Returns the offset in ns to add
+    to a monotonic stamp to get nanoseconds since the Unix epoch."""
+    before = time.monotonic_ns()
+    wall_ns = time.time_ns()
+    after = time.monotonic_ns()
+    monotonic_ns = (before + after) // 2
+    _anchor["offset_ns"] = wall_ns - monotonic_ns
+    _anchor["monotonic_ns"] = monotonic_ns
+    return _anchor["offset_ns"]
+
+
+def _offset_ns():
+    anchored_ns = _anchor["monotonic_ns"]
+    if (
+        anchored_ns is None
+        or time.monotonic_ns() - anchored_ns > CLOCK_ANCHOR_SECONDS * 1_000_000_000
+    ):
+        return read_anchor()
+    return _anchor["offset_ns"]
+
+
+def to_utc(stamp_ns):
+    """Return the naive UTC datetime of a time.monotonic_ns() stamp."""
+    return EPOCH + timedelta(microseconds=(stamp_ns + _offset_ns()) // 1000)
+
+
+def fill_timestamps(packets):
+    """Set the timestamp of every packet without one from its receive stamp, all
+    with the same anchor."""
+    offset_ns = _offset_ns()
+    for packet in packets:
+        if packet.timestamp is None and packet.stamps is not None:
+            packet.timestamp = EPOCH + timedelta(
+                microseconds=(packet.stamps[0] + offset_ns) // 1000
+            )
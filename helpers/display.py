@@ -2,13 +2,23 @@
 import threading
 import queue
 from collections import deque
-import board
-import digitalio
-import adafruit_ssd1306
-from PIL import Image, ImageDraw, ImageFont
+from helpers import metrics
+
+try:
+    import board
+    import digitalio
+    import adafruit_ssd1306
+    from PIL import Image, ImageDraw, ImageFont
+except (ImportError, NotImplementedError):  # Not on a Pi, messages are ignored.
+    board = None
 
 # Use a queue with an arbitrarily large maxsize to stop memory issues if queue not read.
 message_queue = queue.Queue(maxsize=100)
+metrics.REGISTRY.gauge(
+    "datarecorder_display_queue_depth",
+    "Messages waiting to be shown on the OLED display",
+    function=lambda: message_queue.qsize(),
+)
 
 
 class Display:
@@ -21,6 +31,9 @@ class Display:
         self._oled_width = 128
         self._oled_height = 64
         self._colour_depth = "1"
+        if board is None:
+            self._ssd = None
+            return
         self._image = Image.new(
             self._colour_depth, (self._oled_width, self._oled_height)
         )
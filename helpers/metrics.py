@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Low overhead measurements that can be read while the recorder runs.
+
+Histogram -- counts values in logarithmic buckets and estimates percentiles
+Counter, Gauge, Summary -- labelled metrics kept in a Registry
+REGISTRY -- the registry of the recorder process
+start_http_server(address, port) -- serve REGISTRY in the Prometheus text format
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bucket upper bounds from 1 microsecond to about 2.5 days, four per doubling, so a
+# percentile is reported at most 19 % above the true value.
+BUCKETS_PER_DOUBLING = 4
+LATENCY_BOUNDS = tuple(
+    1e-6 * 2 ** (index / BUCKETS_PER_DOUBLING)
+    for index in range(38 * BUCKETS_PER_DOUBLING)
+)
+
+
+class Histogram:
+    """Counts values, e.g. latencies in seconds, in buckets with fixed upper bounds.
+
+    Recording a value is a binary search and an increment under a lock, so it is
+    cheap enough to call for every packet. Percentiles are the upper bound of the
+    bucket holding that rank, values above the last bound count in an overflow
+    bucket reported as the largest value seen.
+    """
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        """Add a value to the histogram."""
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        """Return the value below which percent of the values fall, None if empty."""
+        with self._lock:
+            counts = self._counts[:]
+            count = self.count
+            largest = self.max
+        if not count:
+            return None
+        rank = max(percent / 100 * count, 1)
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                break
+        if index == len(self._bounds):
+            return largest
+        return min(self._bounds[index], largest)
+
+    def summary(self, percents=(50, 95, 99)):
+        """Return a dict of the count, mean, max and the percentiles."""
+        result = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "max": self.max if self.count else None,
+        }
+        for percent in percents:
+            result[f"p{percent}"] = self.percentile(percent)
+        return result
+
+    def reset(self):
+        """Forget all recorded values."""
+        with self._lock:
+            self._counts = [0] * (len(self._bounds) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names, label_values, extra=""):
+    pairs = [
+        f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if value is not None else "NaN"
+
+
+class _Metric:
+    """A named metric with a value for each combination of label values."""
+
+    metric_type = None
+
+    def __init__(self, name, help_text, label_names=(), function=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """Return a list of (label values, value), from the function if there is one."""
+        if self._function is not None:
+            return [((), self._function())]
+        with self._lock:
+            return list(self._values.items())
+
+    def get(self, *label_values):
+        """Return the value for the label values, 0 if it was never set."""
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def expose(self):
+        """Return the metric in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for label_values, value in sorted(self.samples(), key=lambda x: x[0]):
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """A count that only goes up, function reads a count kept elsewhere."""
+
+    metric_type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        """Add amount to the count for the label values."""
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, function reads it when exposed."""
+
+    metric_type = "gauge"
+
+    def set(self, value, *label_values):
+        """Set the value for the label values."""
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Summary(_Metric):
+    """Percentiles, sum and count of observations from a Histogram per label values."""
+
+    metric_type = "summary"
+
+    def __init__(self, name, help_text, label_names=(), percents=(50, 95, 99)):
+        super().__init__(name, help_text, label_names)
+        self.percents = percents
+
+    def histogram(self, *label_values):
+        """Return the Histogram for the label values, creating it if needed."""
+        with self._lock:
+            histogram = self._values.get(label_values)
+            if histogram is None:
+                histogram = self._values[label_values] = Histogram()
+        return histogram
+
+    def observe(self, value, *label_values):
+        """Record a value for the label values."""
+        self.histogram(*label_values).record(value)
+
+    def expose(self):
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for label_values, histogram in sorted(self.samples(), key=lambda x: x[0]):
+            for percent in self.percents:
+                labels = _format_labels(
+                    self.label_names, label_values, f'quantile="{percent / 100}"'
+                )
+                value = _format_value(histogram.percentile(percent))
+                lines.append(f"{self.name}{labels} {value}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(histogram.total)}")
+            lines.append(f"{self.name}_count{labels} {histogram.count}")
+        return lines
+
+
+class Registry:
+    """Metrics by name. Registering a name twice returns the first metric."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(
+                    f"{name} is already registered as a {metric.metric_type}"
+                )
+        return metric
+
+    def counter(self, name, help_text, label_names=(), function=None):
+        """Return the Counter called name, registering it if needed."""
+        return self._register(Counter, name, help_text, label_names, function)
+
+    def gauge(self, name, help_text, label_names=(), function=None):
+        """Return the Gauge called name, registering it if needed."""
+        return self._register(Gauge, name, help_text, label_names, function)
+
+    def summary(self, name, help_text, label_names=(), percents=(50, 95, 99)):
+        """Return the Summary called name, registering it if needed."""
+        return self._register(Summary, name, help_text, label_names, percents)
+
+    def get(self, name):
+        """Return the metric called name, None if it is not registered."""
+        return self._metrics.get(name)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda x: x.name)
+        return "".join(line + "\n" for metric in metrics for line in metric.expose())
+
+
+REGISTRY = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registry at /metrics."""
+
+    registry = REGISTRY
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Send the metrics, or 404 for any other path."""
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Do not log every scrape."""
+
+
+def start_http_server(address, port, registry=REGISTRY):
+    """Serve the registry at http://address:port/metrics from a daemon thread.
+    Returns the server, call its shutdown method to stop it."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((address, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
@@ -4,6 +4,9 @@
 
 Increment_with_wrap(serial_number, wrap_at=0x10000) -- increment and modulo a number
 crc16(data) -- return a 16 bit CRC for a byte object
+set_crc_backend(name) -- select the implementation used by crc16
+check_crc_batch(packets) -- check the CRCs of many packets in a single call (needs NumPy)
+PacketCodec -- checks, unpacks and encodes radio packets with a precompiled struct
 """
 
 
@@ -20,10 +23,19 @@ crc16(data) -- return a 16 bit CRC for a byte object
 
 # sensor 0xff is sent as padding when no sensor exists and should not be recorded in the database.
 
+import binascii
 import struct
+from array import array
+from itertools import compress
 import logging
+from typing import NamedTuple
 from __config__ import FILE_DEBUG_LEVEL
 
+try:
+    import numpy
+except ImportError:  # NumPy is optional, only check_crc_batch needs it.
+    numpy = None
+
 logger = logging.getLogger(__name__)
 logger.setLevel(FILE_DEBUG_LEVEL)
 
@@ -46,19 +58,79 @@ def _try_to_log(log_message):
         pass
 
 
+def _make_crc16_table(polynomial=0x1021):
+    """Precompute the CRC-16/CCITT-FALSE remainder of every possible high byte."""
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ polynomial) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table.append(crc)
+    return tuple(table)
+
+
+CRC16_TABLE = _make_crc16_table()
+
+
+def _crc16_python(bytes_data):
+    """Table driven CRC-16/CCITT-FALSE in pure Python."""
+    crc = 0xFFFF
+    table = CRC16_TABLE
+    for byte in bytes_data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def _crc16_binascii(bytes_data):
+    """CRC-16/CCITT-FALSE calculated in C by binascii (CRC-CCITT seeded with 0xffff)."""
+    return binascii.crc_hqx(bytes_data, 0xFFFF)
+
+
+CRC_BACKENDS = {"python": _crc16_python, "binascii": _crc16_binascii}
+_crc16_backend = _crc16_binascii
+
+
+def set_crc_backend(name):
+    """Select the CRC backend used by crc16, one of the keys of CRC_BACKENDS."""
+    global _crc16_backend
+    try:
+        _crc16_backend = CRC_BACKENDS[name]
+    except KeyError as error:
+        raise ValueError(
+            f"Unknown CRC backend {name!r}, choose from {', '.join(CRC_BACKENDS)}"
+        ) from error
+
+
 def crc16(bytes_data):
     """Takes a bytes object and returns the CRC-16/CCITT-FALSE."""
-    # Modified from a stackoverflow answer at https://stackoverflow.com/a/55850496/7969814
     _try_to_log("crc16 called")
-    crc = 0xFFFF
-    for byte in bytes_data:
-        crc ^= byte << 8
-        for _ in range(8):
-            if (crc & 0x8000) > 0:
-                crc = (crc << 1) ^ 0x1021
-            else:
-                crc = crc << 1
-    return crc & 0xFFFF
+    return _crc16_backend(bytes_data)
+
+
+def crc16_batch(packets):
+    """Return a NumPy array with the CRC-16/CCITT-FALSE of each row of packets.
+
+    Arguments:
+    packets -- a 2D uint8 array (or anything NumPy can convert to one), one packet per row
+    """
+    if numpy is None:
+        raise ImportError("crc16_batch requires NumPy to be installed")
+    packets = numpy.asarray(packets, dtype=numpy.uint8)
+    if packets.ndim != 2:
+        raise ValueError("packets must be two dimensional, one packet per row")
+    table = numpy.array(CRC16_TABLE, dtype=numpy.uint16)
+    crc = numpy.full(packets.shape[0], 0xFFFF, dtype=numpy.uint16)
+    for column in packets.T:
+        crc = (crc << 8) ^ table[(crc >> 8) ^ column]
+    return crc
+
+
+def check_crc_batch(packets):
+    """Check the CRC of every row of packets, returns a NumPy array of bools."""
+    return crc16_batch(packets) == 0
 
 
 def append_crc(data_packet):
@@ -86,6 +158,158 @@ def confirm_and_strip_crc(rx_packet):
     raise ValueError("Bad data packet")
 
 
+PADDING_SENSOR_ID = 0xFF
+
+
+class SensorReading(NamedTuple):
+    """A single sensor reading from a decoded packet."""
+
+    sensor_id: int
+    reading: float
+
+
+class DecodedPacket:
+    # pylint: disable=too-few-public-methods
+    """A radio data packet after decoding, padding sensors (0xff) are removed.
+
+    Sensor IDs and readings are held in a pair of arrays rather than a list of
+    tuples, the readings are 4 byte floats as sent by the nodes. The two
+    reserved bytes of the packet are not kept.
+    """
+
+    __slots__ = (
+        "node_id",
+        "pkt_serial",
+        "status_register",
+        "sensor_ids",
+        "readings",
+        "timestamp",
+        "stamps",
+    )
+
+    def __init__(
+        self,
+        node_id,
+        pkt_serial,
+        status_register=0x0000,
+        sensor_ids=None,
+        readings=None,
+        timestamp=None,
+    ):
+        self.node_id = node_id
+        self.pkt_serial = pkt_serial
+        self.status_register = status_register
+        self.sensor_ids = array("B") if sensor_ids is None else sensor_ids
+        self.readings = array("f") if readings is None else readings
+        self.timestamp = timestamp
+        self.stamps = None  # time.monotonic_ns() as it passes each pipeline stage
+
+    def sensor_readings(self):
+        """Generate a SensorReading for each sensor in the packet."""
+        return map(SensorReading, self.sensor_ids, self.readings)
+
+    def __len__(self):
+        return len(self.sensor_ids)
+
+    def __repr__(self):
+        return (
+            f"DecodedPacket(node_id=0x{self.node_id:02x}, "
+            f"pkt_serial=0x{self.pkt_serial:04x}, "
+            f"status_register=0x{self.status_register:04x}, "
+            f"sensor_readings={list(self.sensor_readings())}, "
+            f"timestamp={self.timestamp!r})"
+        )
+
+
+class PacketCodec:
+    """Checks the CRC of radio packets and unpacks them with one precompiled struct.
+
+    The packet is read in place through a memoryview, so neither the CRC check
+    nor the unpacking copies the received bytes.
+    """
+
+    def __init__(self, data_format=RADIO_DATA_FORMAT):
+        self._struct = struct.Struct(data_format)
+        self._sensor_offset = data_format.find("Bf") - 1
+        self._sensor_count = data_format.count("Bf")
+        self.packet_size = self._struct.size + 2  # Payload plus 16 bit CRC
+
+    def _check_packet(self, packet_view):
+        """Raise ValueError unless the view is one whole packet with a good CRC."""
+        if len(packet_view) != self.packet_size or _crc16_backend(packet_view):
+            _try_to_log("Bad data packet")
+            raise ValueError("Bad data packet")
+
+    def unpack(self, rx_packet):
+        """Return the tuple of values in a received packet after checking its CRC."""
+        packet_view = memoryview(rx_packet)
+        self._check_packet(packet_view)
+        return self._struct.unpack_from(packet_view)
+
+    def decode(self, rx_packet, timestamp=None):
+        """Return a DecodedPacket for a received packet after checking its CRC."""
+        values = self.unpack(rx_packet)
+        sensor_ids = values[self._sensor_offset :: 2]
+        readings = values[self._sensor_offset + 1 :: 2]
+        if PADDING_SENSOR_ID in sensor_ids:
+            not_padding = [x != PADDING_SENSOR_ID for x in sensor_ids]
+            sensor_ids = compress(sensor_ids, not_padding)
+            readings = compress(readings, not_padding)
+        return DecodedPacket(
+            values[0],
+            values[2],
+            values[3],
+            array("B", sensor_ids),
+            array("f", readings),
+            timestamp,
+        )
+
+    def encode(self, node_id, pkt_serial, status_register=0x0000, sensor_readings=()):
+        """Return a packet with CRC as a node sends it, the inverse of decode.
+
+        Arguments:
+        sensor_readings -- up to SENSOR_COUNT (sensor_id, reading) pairs, unused
+        sensor slots are padded with sensor 0xff
+        """
+        sensor_readings = list(sensor_readings)
+        padding = self._sensor_count - len(sensor_readings)
+        if padding < 0:
+            raise ValueError(
+                f"A packet holds at most {self._sensor_count} sensor readings"
+            )
+        sensor_readings += [(PADDING_SENSOR_ID, 0.0)] * padding
+        payload = self._struct.pack(
+            node_id,
+            node_id,
+            pkt_serial,
+            status_register,
+            0,
+            0,
+            *[value for pair in sensor_readings for value in pair],
+        )
+        return append_crc(payload)
+
+    def iter_unpack(self, buffer):
+        """Generate the unpacked values of every packet in a buffer of concatenated
+        packets, e.g. for replays or backfills. Packets with a bad CRC are skipped.
+
+        Arguments:
+        buffer -- a bytes-like object, its length must be a multiple of packet_size
+        """
+        buffer_view = memoryview(buffer)
+        if len(buffer_view) % self.packet_size:
+            raise ValueError(
+                f"Buffer length must be a multiple of {self.packet_size} bytes"
+            )
+        for offset in range(0, len(buffer_view), self.packet_size):
+            try:
+                self._check_packet(buffer_view[offset : offset + self.packet_size])
+            except ValueError:
+                logger.warning("Bad data packet at offset %d skipped", offset)
+                continue
+            yield self._struct.unpack_from(buffer_view, offset)
+
+
 def increment_with_wrap(number: int, wrap_at=0x10000):
     """Increments an number and returns the modulo of the result.
 
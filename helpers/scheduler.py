@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Runs delayed actions from one thread without blocking the caller.
+
+Pending actions are kept in a heap ordered by the monotonic time they are due,
+the scheduler thread sleeps on a condition until the earliest is due or an
+earlier one is added. Cancelled actions are marked and dropped when they reach
+the top of the heap, so cancelling is constant time.
+
+Scheduler -- schedule(delay, function, *args, key=None), cancel(key), pending
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from helpers import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Action:
+    """A scheduled call, the handle returned by Scheduler.schedule."""
+
+    __slots__ = ("due", "function", "args", "key", "cancelled")
+
+    def __init__(self, due, function, args, key):
+        self.due = due
+        self.function = function
+        self.args = args
+        self.key = key
+        self.cancelled = False
+
+
+class Scheduler:
+    """Calls functions after a delay from a daemon thread, in the order they are due.
+
+    An action scheduled with a key can be cancelled by that key until it runs.
+    The lateness of each action, the seconds between when it was due and when it
+    ran, is recorded in the lateness Histogram.
+    """
+
+    def __init__(self, name="scheduler", lateness=None):
+        self.name = name
+        self.lateness = lateness if lateness is not None else metrics.Histogram()
+        self._heap = []
+        self._keys = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._stopping = False
+        self._thread = None
+
+    @property
+    def pending(self):
+        """Number of actions waiting to run."""
+        return self._pending
+
+    def start(self):
+        """Start the scheduler thread."""
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def schedule(self, delay, function, *args, key=None):
+        """Call function(*args) in delay seconds. Returns a handle for cancel_action."""
+        action = _Action(time.monotonic() + delay, function, args, key)
+        with self._condition:
+            heapq.heappush(self._heap, (action.due, next(self._sequence), action))
+            if key is not None:
+                self._keys.setdefault(key, set()).add(action)
+            self._pending += 1
+            self._condition.notify()
+        return action
+
+    def cancel_action(self, action):
+        """Cancel one action. Returns True if it had not run yet."""
+        with self._condition:
+            return self._cancel(action)
+
+    def cancel(self, key):
+        """Cancel every pending action scheduled with key. Returns the number cancelled."""
+        with self._condition:
+            return sum(self._cancel(x) for x in list(self._keys.get(key, ())))
+
+    def _cancel(self, action):
+        if action.cancelled or action.due is None:
+            return False
+        action.cancelled = True
+        self._forget(action)
+        return True
+
+    def _forget(self, action):
+        self._pending -= 1
+        actions = self._keys.get(action.key)
+        if actions is not None:
+            actions.discard(action)
+            if not actions:
+                del self._keys[action.key]
+
+    def _next_due(self):
+        """Wait for the next action that is due and return it, None when stopping."""
+        with self._condition:
+            while not self._stopping:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                action = heapq.heappop(self._heap)[2]
+                self._forget(action)
+                self.lateness.record(-wait)
+                action.due = None  # Ran, too late to cancel
+                return action
+        return None
+
+    def _run(self):
+        while True:
+            action = self._next_due()
+            if action is None:
+                return
+            try:
+                action.function(*action.args)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Scheduled action %r failed", action.function)
+
+    def shutdown(self, timeout=None):
+        """Stop the scheduler thread, dropping the actions still pending.
+        Returns the number dropped."""
+        with self._condition:
+            self._stopping = True
+            dropped = self._pending
+            for _, _, action in self._heap:
+                action.cancelled = True
+            self._heap.clear()
+            self._keys.clear()
+            self._pending = 0
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return dropped
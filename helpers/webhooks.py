@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Calls webhooks without blocking the caller.
+
+Each endpoint, a scheme, host and port, gets one worker thread started the
+first time it is used. The worker keeps a keep-alive connection, so a slow
+endpoint only holds up its own requests and TLS is set up once rather than once
+per request. Requests to an endpoint are sent in the order they were submitted,
+e.g. a gate close never reaches the NAS before the gate open it follows. A
+request that times out, fails to connect or gets a 5xx response stays at the
+head of its endpoint's queue and is tried again after an exponential backoff.
+
+WebhookDispatcher -- submit(url, callback=None), start(), shutdown()
+"""
+import http.client
+import logging
+import queue
+import ssl
+import threading
+import time
+import urllib.parse
+from helpers import metrics
+
+logger = logging.getLogger(__name__)
+
+webhook_seconds = metrics.REGISTRY.summary(
+    "datarecorder_webhook_seconds",
+    "Seconds from submitting a webhook to its final response, by host",
+    ("host",),
+)
+webhook_retries = metrics.REGISTRY.counter(
+    "datarecorder_webhook_retries_total",
+    "Webhook requests tried again, by host",
+    ("host",),
+)
+webhook_failures = metrics.REGISTRY.counter(
+    "datarecorder_webhook_failures_total",
+    "Webhooks that failed after every retry, by host",
+    ("host",),
+)
+
+# Errors a keep-alive connection gives when the server has closed it while idle.
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class _Job:
+    """A webhook request and its attempts so far."""
+
+    __slots__ = ("url", "target", "callback", "submitted", "attempt")
+
+    def __init__(self, url, target, callback):
+        self.url = url
+        self.target = target
+        self.callback = callback
+        self.submitted = time.monotonic()
+        self.attempt = 0
+
+
+class _Endpoint:
+    """The request queue and worker of one scheme, host and port."""
+
+    def __init__(self, dispatcher, scheme, netloc):
+        self.dispatcher = dispatcher
+        self.scheme = scheme
+        self.netloc = netloc
+        self.host = netloc.rpartition("@")[2]
+        self.jobs = queue.Queue()
+        self.worker = threading.Thread(
+            target=self._work, name=f"webhook {netloc}", daemon=True
+        )
+        self.worker.start()
+
+    def _connect(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(
+                self.host,
+                timeout=self.dispatcher.timeout,
+                context=self.dispatcher.ssl_context,
+            )
+        return http.client.HTTPConnection(self.host, timeout=self.dispatcher.timeout)
+
+    def _request(self, connection, target):
+        connection.request("GET", target)
+        response = connection.getresponse()
+        response.read()
+        if response.will_close:
+            connection.close()
+        return response.status
+
+    def _send(self, connection, target):
+        """Send the request, once more on a new connection if the kept-alive one
+        was closed by the server. Returns the status."""
+        if connection.sock is not None:
+            try:
+                return self._request(connection, target)
+            except _STALE_CONNECTION_ERRORS:
+                connection.close()
+        return self._request(connection, target)
+
+    def _attempt(self, connection, job):
+        """Send the job once. Returns (result, whether to retry)."""
+        try:
+            status = self._send(connection, job.target)
+        except (OSError, http.client.HTTPException) as error:
+            connection.close()
+            return error, True
+        return status, status >= 500
+
+    def _work(self):
+        connection = self._connect()
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                connection.close()
+                return
+            try:
+                result, retry = self._attempt(connection, job)
+                while result != 200 and self.dispatcher._retry_after(
+                    self, job, result, retry
+                ):
+                    result, retry = self._attempt(connection, job)
+                self.dispatcher._done(self, job, result)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Webhook to %s could not be handled", self.host)
+                connection.close()
+
+
+class WebhookDispatcher:
+    """Sends GET requests to webhook URLs, in order, from a worker thread per
+    endpoint.
+
+    submit returns at once. callback, if given, is called from a worker thread
+    with the status of the final attempt, or the exception if there was no
+    response. An exception raised by the callback is logged.
+    """
+
+    def __init__(
+        self, timeout=5.0, retries=3, backoff=0.5, max_backoff=30.0, ssl_context=None
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._abandoned = 0
+
+    def start(self):
+        """Allow retries again after a shutdown, workers start on first use."""
+        self._stopping.clear()
+        self._abandoned = 0
+
+    def submit(self, url, callback=None):
+        """Queue a GET request to url."""
+        parts = urllib.parse.urlsplit(url)
+        target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        with self._lock:
+            endpoint = self._endpoints.get((parts.scheme, parts.netloc))
+            if endpoint is None:
+                endpoint = self._endpoints[(parts.scheme, parts.netloc)] = _Endpoint(
+                    self, parts.scheme, parts.netloc
+                )
+        endpoint.jobs.put(_Job(url, target, callback))
+
+    def pending(self):
+        """Return the number of requests waiting for a worker."""
+        with self._lock:
+            return sum(x.jobs.qsize() for x in self._endpoints.values())
+
+    def _done(self, endpoint, job, result):
+        webhook_seconds.observe(time.monotonic() - job.submitted, endpoint.host)
+        if result != 200:
+            webhook_failures.inc(endpoint.host)
+            logger.error("Webhook to %s failed (%s)", endpoint.host, result)
+        if job.callback is not None:
+            try:
+                job.callback(result)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Webhook callback for %s failed", endpoint.host)
+
+    def _retry_after(self, endpoint, job, result, retry):
+        """Wait out the backoff of a failed job, the requests behind it wait too.
+        Returns False if it is not to be retried or the dispatcher is stopping."""
+        if not retry or job.attempt >= self.retries:
+            return False
+        delay = min(self.backoff * 2 ** job.attempt, self.max_backoff)
+        job.attempt += 1
+        webhook_retries.inc(endpoint.host)
+        logger.warning(
+            "Webhook to %s failed (%s), retry %d in %.1f s",
+            endpoint.host,
+            result,
+            job.attempt,
+            delay,
+        )
+        if self._stopping.wait(delay):
+            with self._lock:
+                self._abandoned += 1
+            return False
+        return True
+
+    def shutdown(self, timeout=None):
+        """Stop the workers after the requests already queued, failed requests are
+        not retried. Returns the number whose retries were abandoned."""
+        self._stopping.set()
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+            self._endpoints.clear()
+        for endpoint in endpoints:
+            endpoint.jobs.put(None)
+        for endpoint in endpoints:
+            endpoint.worker.join(timeout)
+        return self._abandoned
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Maintains the database
+
+usage: manage_database.py [-h]
+                          {indexes,create-indexes,partitions,partition-migrate,
+                          rollup-backfill,retention,replay} ...
+
+    positional arguments:
+      {indexes,create-indexes,partitions,partition-migrate,rollup-backfill,retention,
+      replay}
+                        commands to maintain the database
+        indexes         show the size and usage of the Sensor Readings indexes
+        create-indexes  create any missing Sensor Readings indexes
+        partitions      show the size of the Sensor Readings partitions
+        partition-migrate
+                        move an unpartitioned Sensor Readings table into
+                        monthly partitions
+        rollup-backfill
+                        rebuild the hourly and daily rollups from the sensor
+                        readings
+        retention       remove readings and rollups older than their retention
+                        period
+        replay          decode the packets in packet log files and write those
+                        not already stored to the database, stops at the first
+                        failed write and can be run again
+
+    optional arguments:
+      -h, --help        show this help message and exit
+
+Returns:
+    Writes the result of the operation to stdout
+"""
+
+# Apparently unused imports are called by args.func(args)
+from database.database import initialize_database
+from commandline import (
+    setup_database_argparse,
+    show_index_report,
+    create_missing_indexes,
+    show_partition_report,
+    migrate_to_partitions,
+    backfill_rollups,
+    apply_retention,
+    replay_packet_log,
+)
+from __config__ import DB_URL
+
+initialize_database(DB_URL)
+parser = setup_database_argparse()
+args = parser.parse_args()
+args.func(args)
@@ -2,14 +2,16 @@
 # -*- coding: utf-8 -*-
 """Adds, lists and shows details of sensors
 
-usage: sensors.py [-h] {list,show,add} ...
+usage: sensors.py [-h] {list,show,add,latest} ...
 
     positional arguments:
-      {list,show,add}  commands to add sensors and display information about
+      {list,show,add,latest}
+                       commands to add sensors and display information about
                        sensors
         list           list all existing sensors
         show           display information for the sensor
         add            add a sensor to the database
+        latest         display the latest reading of every sensor
 
     optional arguments:
       -h, --help       show this help message and exit
@@ -38,6 +40,11 @@ usage: sensors.py add [-h] id node name quantity
     optional arguments:
      -h, --help  show this help message and exit
 
+usage: sensors.py latest [-h]
+
+    optional arguments:
+      -h, --help  show this help message and exit
+
 Returns:
     Writes the result of the operation to stdout
 """
@@ -49,6 +56,7 @@ from commandline import (
     list_sensors,
     add_sensor_to_database,
     show_sensor_details,
+    show_latest_readings,
 )
 from __config__ import DB_URL
 
@@ -7,7 +7,7 @@ from datarecorder import main
 from __config__ import RFM69_INTERRUPT_PIN, DB_URL
 
 if __name__ == "__main__":
-    main.radio = main.start_up(db_url=DB_URL, pi_irq_pin=RFM69_INTERRUPT_PIN)
+    main.start_up(db_url=DB_URL, pi_irq_pin=RFM69_INTERRUPT_PIN)
     try:
         while True:
             time.sleep(0.1)
@@ -23,9 +23,13 @@ crc16(data) -- return a 16 bit CRC for a byte object
 import struct
 import time
 import random
-import board
-import digitalio
-import adafruit_rfm69 as rfm_69
+
+try:
+    import board
+    import digitalio
+    import adafruit_rfm69 as rfm_69
+except ImportError:  # Packing only, as used by benchmarks/fleet_simulator.py
+    board = digitalio = rfm_69 = None
 
 ENCRYPTION_KEY = b"\x16UT\xb6\x92FHaE\xb5B\xde\xbclYs"
 DATA_FORMAT = ">BBHHBBBfBfBfBfBfBfBfBfBfBf"
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""A local HTTP server standing in for the webhook endpoints on the NAS.
+
+It answers every GET with 200 after delay seconds, keeps connections alive and
+counts requests and connections. Set fail to a number of requests to answer
+with 503 first, to exercise retries.
+
+usage: python -m tests.standin_server [--port 8080] [--delay 0.0]
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body are separate writes
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer after the configured delay."""
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            failing = server.fail > 0
+            if failing:
+                server.fail -= 1
+        if server.delay:
+            time.sleep(server.delay)
+        body = b"Unavailable" if failing else b"OK"
+        self.send_response(503 if failing else 200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Do not log every request."""
+
+
+class StandinServer(ThreadingHTTPServer):
+    """Serves from a daemon thread on address:port, port 0 picks a free port.
+    url is the base URL, requests the paths requested so far."""
+
+    daemon_threads = True
+
+    def __init__(self, address="127.0.0.1", port=0, delay=0.0, fail=0):
+        super().__init__((address, port), _StandinHandler)
+        self.delay = delay
+        self.fail = fail
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.url = f"http://{address}:{self.server_address[1]}"
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="standin_server", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds per request")
+    parsed_args = parser.parse_args()
+    server = StandinServer(parsed_args.address, parsed_args.port, parsed_args.delay)
+    print(f"Serving on {server.url}, Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.stop()
+        print(f"{len(server.requests)} requests on {server.connections} connections")
@@ -1,3 +1,4 @@
+from datetime import datetime
 from unittest import TestCase, skip
 from unittest.mock import Mock, patch, call
 from sqlalchemy.orm.exc import NoResultFound
@@ -406,3 +407,188 @@ class TestSetupArgparseForNodes(TestCase):
             .add_argument("quantity", help="quantity for the sensor to add"),
         ]
         mock_parser.add_subparsers.assert_has_calls(calls)
+
+
+class TestDatabaseMaintenanceFunctions(TestCase):
+    def test_format_bytes(self):
+        self.assertEqual("n/a", commandlinetools._format_bytes(None))
+        self.assertEqual("512 B", commandlinetools._format_bytes(512))
+        self.assertEqual("16 kB", commandlinetools._format_bytes(16384))
+        self.assertEqual("3 GB", commandlinetools._format_bytes(3 * 1024 ** 3))
+
+    def test_layout_index_report(self):
+        index_report = [
+            {"name": "index_a", "size_bytes": 2048, "scans": 3, "tuples_read": 40},
+            {"name": "index_b", "size_bytes": None, "scans": None, "tuples_read": None},
+        ]
+        returned_result = commandlinetools._layout_index_report(index_report)
+        lines = returned_result.splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split(), ["index_a", "2", "kB", "3", "40"])
+        self.assertEqual(lines[2].split(), ["index_b", "n/a", "n/a", "n/a"])
+        self.assertEqual(
+            "No indexes in database\n", commandlinetools._layout_index_report([])
+        )
+
+    @patch("builtins.print")
+    @patch("database.database.get_index_report", autospec=True)
+    def test_parser_calls_show_index_report(self, mock_get_index_report, mock_print):
+        mock_get_index_report.return_value = []
+        parser = commandlinetools.setup_database_argparse()
+        parsed_args = parser.parse_args(["indexes"])
+        parsed_args.func(parsed_args)
+        mock_get_index_report.assert_called_once()
+        mock_print.assert_called_once_with("No indexes in database\n")
+
+    @patch("builtins.print")
+    @patch("database.database.ensure_indexes", autospec=True)
+    def test_parser_calls_create_missing_indexes(self, mock_ensure_indexes, _):
+        parser = commandlinetools.setup_database_argparse()
+        parsed_args = parser.parse_args(["create-indexes"])
+        parsed_args.func(parsed_args)
+        mock_ensure_indexes.assert_called_once()
+
+    def test_layout_partition_report(self):
+        partition_report = [
+            {
+                "name": "Sensor Readings 2021_03",
+                "size_bytes": 4096,
+                "estimated_rows": 7,
+            },
+            {
+                "name": "Sensor Readings default",
+                "size_bytes": 0,
+                "estimated_rows": None,
+            },
+        ]
+        lines = commandlinetools._layout_partition_report(partition_report).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(
+            lines[1].split(), ["Sensor", "Readings", "2021_03", "4", "kB", "7"]
+        )
+        self.assertEqual(
+            lines[2].split(), ["Sensor", "Readings", "default", "0", "B", "n/a"]
+        )
+        self.assertEqual(
+            "Sensor Readings is not partitioned\n",
+            commandlinetools._layout_partition_report([]),
+        )
+
+    @patch("builtins.print")
+    @patch("database.database.migrate_readings_to_partitions", autospec=True)
+    def test_parser_calls_migrate_to_partitions(self, mock_migrate, mock_print):
+        mock_migrate.return_value = 12
+        parser = commandlinetools.setup_database_argparse()
+        parsed_args = parser.parse_args(["partition-migrate", "--chunk-size", "100"])
+        parsed_args.func(parsed_args)
+        mock_migrate.assert_called_once_with(chunk_size=100)
+        mock_print.assert_called_once_with(
+            "12 rows moved to the partitioned Sensor Readings table\n"
+        )
+
+    @patch("builtins.print")
+    @patch("database.database.backfill_rollups", autospec=True)
+    def test_parser_calls_backfill_rollups(self, mock_backfill, mock_print):
+        mock_backfill.return_value = 31
+        parser = commandlinetools.setup_database_argparse()
+        parsed_args = parser.parse_args(
+            ["rollup-backfill", "2021-03-01", "2021-04-01", "--workers", "2"]
+        )
+        parsed_args.func(parsed_args)
+        mock_backfill.assert_called_once_with(
+            datetime(2021, 3, 1), datetime(2021, 4, 1), workers=2
+        )
+        mock_print.assert_called_once_with("Rebuilt rollups for 31 days\n")
+
+    @patch("builtins.print")
+    @patch("datarecorder._dataprocessing.replay_packet_log", autospec=True)
+    def test_parser_calls_replay_packet_log(self, mock_replay, mock_print):
+        mock_replay.return_value = {
+            "packets": 1000,
+            "queued": 890,
+            "skipped": 100,
+            "rows": 8010,
+            "seconds": 2.0,
+        }
+        parser = commandlinetools.setup_database_argparse()
+        parsed_args = parser.parse_args(["replay", "packets.bin.1", "packets.bin"])
+        parsed_args.func(parsed_args)
+        mock_replay.assert_called_once_with(["packets.bin.1", "packets.bin"])
+        mock_print.assert_called_once_with(
+            "Replayed 1000 packets from 2 files, 100 already stored, "
+            "8010 rows written in 2.0 s "
+            "(500 packets/s)\n"
+        )
+
+    def test_layout_retention_report(self):
+        retention_report = [
+            {
+                "policy": "raw",
+                "table": "Sensor Readings",
+                "cutoff": datetime(2021, 2, 18),
+                "rows": 1200,
+                "bytes": 3 * 1024 ** 2,
+                "partitions_dropped": 1,
+            }
+        ]
+        lines = commandlinetools._layout_retention_report(retention_report).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(
+            lines[1].split(), ["raw", "2021-02-18", "1200", "3", "MB", "1"]
+        )
+        self.assertEqual(
+            "No retention policies configured\n",
+            commandlinetools._layout_retention_report([]),
+        )
+
+
+class TestLatestReadings(TestCase):
+    def test_layout_latest_readings(self):
+        latest_readings = [
+            {
+                "Sensor_ID": 1,
+                "Timestamp_UTC": datetime(2021, 3, 4, 5, 6, 7),
+                "Reading": 21.5,
+                "Name": "Hall",
+                "Symbol": "K",
+            },
+            {
+                "Sensor_ID": 0x1F,
+                "Timestamp_UTC": datetime(2021, 3, 4, 5, 6, 8),
+                "Reading": 3.0,
+            },
+        ]
+        lines = commandlinetools._layout_latest_readings(latest_readings).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(
+            lines[1].split(), ["0x01", "Hall", "21.5", "K", "2021-03-04", "05:06:07"]
+        )
+        self.assertEqual(
+            lines[2].split(), ["0x1f", "unknown", "3", "2021-03-04", "05:06:08"]
+        )
+        self.assertEqual(
+            "No sensor readings in database\n",
+            commandlinetools._layout_latest_readings([]),
+        )
+
+    @patch("builtins.print")
+    @patch("database.database.get_sensor_data", autospec=True)
+    @patch("database.database.get_latest_readings", autospec=True)
+    def test_parser_calls_show_latest_readings(
+        self, mock_get_latest_readings, mock_get_sensor_data, mock_print
+    ):
+        mock_get_latest_readings.return_value = [
+            {"Sensor_ID": 1, "Timestamp_UTC": datetime(2021, 3, 4), "Reading": 2.0}
+        ]
+        mock_get_sensor_data.return_value = {
+            "Sensor_ID": 1,
+            "Node_ID": 1,
+            "Name": "Scales",
+            "Quantity": "Mass",
+        }
+        parser = commandlinetools.setup_sensor_argparse()
+        parsed_args = parser.parse_args(["latest"])
+        parsed_args.func(parsed_args)
+        mock_get_sensor_data.assert_called_once_with(1)
+        self.assertIn("Scales", mock_print.call_args[0][0])
+        self.assertIn("2 kg", mock_print.call_args[0][0])
@@ -6,12 +6,15 @@ Created on Sat Nov 30 07:17:26 2019
 @author: martinstephens
 """
 
-from unittest import TestCase
+from unittest import TestCase, skipIf
+from array import array
+from datetime import datetime
 from unittest.mock import patch
 from sqlalchemy import inspect
 import sqlalchemy
 from sqlalchemy.orm.exc import NoResultFound
 from database import database
+from helpers import radiohelper
 from tests import conftest
 
 
@@ -36,6 +39,23 @@ class ConfirmDatabaseSetup(TestCase):
                 "Location",
             ],
             "Events": {"ID", "Timestamp_UTC", "Node_ID", "Event_Code"},
+            "Sensor Readings Hourly": [
+                "Sensor_ID",
+                "Period_Start",
+                "Count",
+                "Sum",
+                "Min",
+                "Max",
+            ],
+            "Latest Readings": ["Sensor_ID", "Timestamp_UTC", "Reading"],
+            "Sensor Readings Daily": [
+                "Sensor_ID",
+                "Period_Start",
+                "Count",
+                "Sum",
+                "Min",
+                "Max",
+            ],
         }
         conftest.initialize_database()
         self.inspector = inspect(database.engine)
@@ -77,20 +97,88 @@ class TestWriteSensorDataToDataBase(TestCase):
 
     def test_write_sensor_data_to_database(self):
         test_time = conftest.global_test_time
-        test_data = {
-            "timestamp": test_time,
-            "sensor_readings": [(0x01, 1.2345), (0x02, 2.3456)],
-        }
+        test_data = radiohelper.DecodedPacket(
+            node_id=0x01,
+            pkt_serial=0x0001,
+            sensor_ids=array("B", [0x01, 0x02]),
+            readings=array("f", [1.2345, 2.3456]),
+            timestamp=test_time,
+        )
         database.write_sensor_reading_to_db(test_data)
         s = database.session()
         t = database.SensorData
         q = s.query(t).all()
         database_records = [[x.Timestamp_UTC, x.Sensor_ID, x.Reading] for x in q]
-        expected_result = [
-            [test_time, x[0], x[1]] for x in test_data["sensor_readings"]
-        ]
+        expected_result = [[test_time, x[0], x[1]] for x in test_data.sensor_readings()]
         self.assertEqual(database_records, expected_result)
 
+    def test_write_sensor_data_with_no_readings_writes_nothing(self):
+        test_data = radiohelper.DecodedPacket(
+            node_id=0x05, pkt_serial=0x0001, timestamp=conftest.global_test_time
+        )
+        database.write_sensor_reading_to_db(test_data)
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 0)
+
+
+class TestEvents(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+        database.add_node(0x05, "Gate")
+
+    def tearDown(self):
+        conftest.kill_database()
+
+    def test_write_events_to_db_writes_a_row_per_event_code(self):
+        database.write_events_to_db(
+            {
+                "timestamp": conftest.global_test_time,
+                "node_id": 0x05,
+                "event_codes": [0, 3],
+            }
+        )
+        self.assertEqual(
+            database.get_events(0x05, datetime(2019, 1, 1), datetime(2020, 1, 1)),
+            [(conftest.global_test_time, 0), (conftest.global_test_time, 3)],
+        )
+
+    def test_get_events_returns_the_events_of_a_node_in_a_time_range(self):
+        database.write_reading_rows_to_db(
+            [],
+            [
+                (datetime(2021, 1, 3), 0x05, 1),
+                (datetime(2021, 1, 1), 0x05, 0),
+                (datetime(2021, 1, 2), 0x05, 0),
+                (datetime(2021, 1, 4), 0x05, 1),
+            ],
+        )
+        self.assertEqual(
+            database.get_events(0x05, datetime(2021, 1, 1), datetime(2021, 1, 4)),
+            [
+                (datetime(2021, 1, 1), 0),
+                (datetime(2021, 1, 2), 0),
+                (datetime(2021, 1, 3), 1),
+            ],
+        )
+        self.assertEqual(
+            database.get_events(0x06, datetime(2021, 1, 1), datetime(2021, 1, 4)), []
+        )
+
+    def test_events_of_unknown_nodes_are_dropped_and_the_rest_written(self):
+        with self.assertLogs(database.logger, "WARNING"):
+            database.write_reading_rows_to_db(
+                [], [(datetime(2021, 1, 1), 0x05, 0), (datetime(2021, 1, 1), 0x09, 0)]
+            )
+        self.assertEqual(
+            len(database.get_events(0x05, datetime(2021, 1, 1), datetime(2021, 1, 2))),
+            1,
+        )
+
+    def test_events_are_indexed_by_node_and_time(self):
+        indexes = inspect(database.engine).get_indexes("Events")
+        self.assertIn(
+            ["Node_ID", "Timestamp_UTC"], [x["column_names"] for x in indexes]
+        )
+
 
 def get_all_nodes():
     s = database.session()
@@ -561,3 +649,433 @@ class TestReadFromDatabaseFunctions(TestCase):
         }
         returned_result = database.get_sensor_data(sensor=1)
         self.assertDictEqual(expected_result, returned_result)
+
+
+class TestCopyIngest(TestCase):
+    def setUp(self):
+        self.rows = [
+            (datetime(2021, 3, 4, 5, 6, 7, 123456), 0x01, 1.2345000505447388),
+            (datetime(2000, 1, 1), 0x02, -2.5),
+        ]
+
+    def tearDown(self):
+        database.engine.dispose()
+
+    def test_encode_copy_text_writes_tab_separated_lines(self):
+        self.assertEqual(
+            database._encode_copy_text(self.rows),
+            "2021-03-04 05:06:07.123456\t1\t1.2345000505447388\n"
+            "2000-01-01 00:00:00\t2\t-2.5\n",
+        )
+
+    def test_encode_copy_binary_has_header_rows_and_trailer(self):
+        encoded = database._encode_copy_binary(self.rows)
+        self.assertTrue(encoded.startswith(b"PGCOPY\n\xff\r\n\x00"))
+        self.assertTrue(encoded.endswith(b"\xff\xff"))
+        self.assertEqual(
+            len(encoded),
+            len(database.COPY_BINARY_HEADER)
+            + 2 * database.COPY_BINARY_ROW.size
+            + len(database.COPY_BINARY_TRAILER),
+        )
+        second_row = database.COPY_BINARY_ROW.unpack_from(
+            encoded, len(database.COPY_BINARY_HEADER) + database.COPY_BINARY_ROW.size
+        )
+        self.assertEqual(second_row, (3, 8, 0, 4, 0x02, 8, -2.5))
+
+    def test_copy_mode_falls_back_to_executemany_when_not_postgresql(self):
+        database.initialize_database("sqlite://", ingest_mode="copy")
+        test_data = radiohelper.DecodedPacket(
+            node_id=0x01,
+            pkt_serial=0x0001,
+            sensor_ids=array("B", [0x01, 0x02]),
+            readings=array("f", [1.2345, 2.3456]),
+            timestamp=conftest.global_test_time,
+        )
+        with patch("database.database._copy_readings") as mock_copy_readings:
+            self.assertEqual(database.write_sensor_readings_to_db([test_data]), 2)
+        mock_copy_readings.assert_not_called()
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 2)
+
+    def test_initialize_database_rejects_unknown_ingest_modes(self):
+        with self.assertRaises(ValueError):
+            database.initialize_database("sqlite://", ingest_mode="carrier pigeon")
+        with self.assertRaises(ValueError):
+            database.initialize_database("sqlite://", copy_format="csv")
+
+
+class TestSessionAndPoolManagement(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+
+    def tearDown(self):
+        database.engine.dispose()
+
+    def test_session_scope_commits_and_closes_the_session(self):
+        with database.session_scope() as db_session:
+            db_session.add(database.Nodes(ID=1, Name="Node 1", Location="Here"))
+        self.assertEqual(conftest.count_all_node_records(), 1)
+        metrics = database.get_pool_metrics()
+        self.assertEqual(metrics["in_use"], 0)
+
+    def test_session_scope_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with database.session_scope() as db_session:
+                db_session.add(database.Nodes(ID=1, Name="Node 1", Location="Here"))
+                db_session.flush()
+                raise RuntimeError
+        self.assertEqual(conftest.count_all_node_records(), 0)
+        self.assertEqual(database.get_pool_metrics()["in_use"], 0)
+
+    def test_pool_metrics_count_checkouts(self):
+        start = database.get_pool_metrics()
+        [database._load_metadata() for _ in range(3)]
+        metrics = database.get_pool_metrics()
+        self.assertEqual(metrics["checkouts"], start["checkouts"] + 3)
+        self.assertEqual(metrics["checkins"], start["checkins"] + 3)
+        self.assertGreaterEqual(metrics["max_wait_seconds"], 0)
+
+    def test_pool_options_are_only_used_for_server_databases(self):
+        with patch("database.database.create_engine") as mock_create_engine:
+            with patch("database.database.Base"):
+                with patch("database.database.event"):
+                    database.initialize_database("postgresql://pi@localhost/test")
+        pool_options = mock_create_engine.call_args[1]
+        self.assertEqual(pool_options["pool_size"], database.DB_POOL_SIZE)
+        self.assertEqual(pool_options["max_overflow"], database.DB_MAX_OVERFLOW)
+        self.assertEqual(pool_options["pool_recycle"], database.DB_POOL_RECYCLE)
+        self.assertEqual(pool_options["pool_pre_ping"], database.DB_POOL_PRE_PING)
+        self.assertEqual(
+            database._pool_options(database.make_url("sqlite://")),
+            {"pool_pre_ping": database.DB_POOL_PRE_PING},
+        )
+
+
+class TestSensorReadingIndexes(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+
+    def tearDown(self):
+        database.engine.dispose()
+
+    def test_sensor_id_and_timestamp_index_exists(self):
+        indexes = inspect(database.engine).get_indexes("Sensor Readings")
+        self.assertIn(
+            {
+                "name": "ix_sensor_readings_sensor_id_timestamp_utc",
+                "column_names": ["Sensor_ID", "Timestamp_UTC"],
+                "unique": 0,
+            },
+            indexes,
+        )
+
+    def test_ensure_indexes_creates_missing_indexes(self):
+        database.engine.execute(
+            'DROP INDEX "ix_sensor_readings_sensor_id_timestamp_utc"'
+        )
+        self.assertEqual(inspect(database.engine).get_indexes("Sensor Readings"), [])
+        database.ensure_indexes()
+        self.assertEqual(
+            len(inspect(database.engine).get_indexes("Sensor Readings")), 1
+        )
+
+    def test_index_report_has_no_sizes_when_not_postgresql(self):
+        self.assertEqual(
+            database.get_index_report(),
+            [
+                {
+                    "name": "ix_sensor_readings_sensor_id_timestamp_utc",
+                    "size_bytes": None,
+                    "scans": None,
+                    "tuples_read": None,
+                }
+            ],
+        )
+
+
+class TestRollups(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+
+    def tearDown(self):
+        conftest.kill_database()
+
+    @staticmethod
+    def _packet(timestamp, *readings):
+        return radiohelper.DecodedPacket(
+            1,
+            1,
+            sensor_ids=array("B", [1] * len(readings)),
+            readings=array("f", readings),
+            timestamp=timestamp,
+        )
+
+    def test_aggregate_rows(self):
+        rows = [
+            (datetime(2021, 3, 4, 5, 10), 1, 2.0),
+            (datetime(2021, 3, 4, 5, 50), 1, -1.0),
+            (datetime(2021, 3, 4, 6, 0), 1, 4.0),
+        ]
+        self.assertEqual(
+            dict(database.rollups.aggregate_rows(rows, "hourly")),
+            {
+                (1, datetime(2021, 3, 4, 5)): [2, 1.0, -1.0, 2.0],
+                (1, datetime(2021, 3, 4, 6)): [1, 4.0, 4.0, 4.0],
+            },
+        )
+        self.assertEqual(
+            dict(database.rollups.aggregate_rows(rows, "daily")),
+            {(1, datetime(2021, 3, 4)): [3, 5.0, -1.0, 4.0]},
+        )
+
+    def test_writes_update_rollups_incrementally(self):
+        database.write_sensor_readings_to_db(
+            [self._packet(datetime(2021, 3, 4, 5, 10), 2.0, 4.0)]
+        )
+        database.write_sensor_readings_to_db(
+            [self._packet(datetime(2021, 3, 4, 5, 20), -6.0)]
+        )
+        database.write_sensor_readings_to_db(
+            [self._packet(datetime(2021, 3, 4, 9, 0), 12.0)]
+        )
+        hourly = database.get_rollups(
+            1, datetime(2021, 3, 4), datetime(2021, 3, 5), period="hourly"
+        )
+        self.assertEqual(
+            hourly,
+            [
+                {
+                    "period_start": datetime(2021, 3, 4, 5),
+                    "count": 3,
+                    "mean": 0.0,
+                    "min": -6.0,
+                    "max": 4.0,
+                },
+                {
+                    "period_start": datetime(2021, 3, 4, 9),
+                    "count": 1,
+                    "mean": 12.0,
+                    "min": 12.0,
+                    "max": 12.0,
+                },
+            ],
+        )
+        daily = database.get_rollups(1, datetime(2021, 3, 1), datetime(2021, 4, 1))
+        self.assertEqual(len(daily), 1)
+        self.assertEqual(daily[0]["count"], 4)
+        self.assertEqual(daily[0]["mean"], 3.0)
+
+    def test_backfill_rebuilds_rollups_from_readings(self):
+        database.write_sensor_readings_to_db(
+            [
+                self._packet(datetime(2021, 3, 4, 5, 10), 2.0),
+                self._packet(datetime(2021, 3, 5, 23, 59), 6.0),
+            ]
+        )
+        database.engine.execute('DELETE FROM "Sensor Readings Hourly"')
+        database.engine.execute('UPDATE "Sensor Readings Daily" SET "Count" = 99')
+        chunks = database.backfill_rollups(
+            datetime(2021, 3, 4, 12), datetime(2021, 3, 5, 12)
+        )
+        self.assertEqual(chunks, 2)
+        self.assertEqual(
+            [
+                (x["period_start"], x["count"], x["mean"])
+                for x in database.get_rollups(
+                    1, datetime(2021, 3, 1), datetime(2021, 4, 1), period="hourly"
+                )
+            ],
+            [(datetime(2021, 3, 4, 5), 1, 2.0), (datetime(2021, 3, 5, 23), 1, 6.0)],
+        )
+        self.assertEqual(
+            [
+                x["count"]
+                for x in database.get_rollups(
+                    1, datetime(2021, 3, 1), datetime(2021, 4, 1)
+                )
+            ],
+            [1, 1],
+        )
+
+    def test_get_rollups_rejects_unknown_periods(self):
+        with self.assertRaises(ValueError):
+            database.get_rollups(
+                1, datetime(2021, 3, 1), datetime(2021, 4, 1), "weekly"
+            )
+
+
+class TestRetention(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+        database.write_sensor_readings_to_db(
+            [
+                TestRollups._packet(datetime(2021, 1, 10, 5), 2.0, 4.0),
+                TestRollups._packet(datetime(2021, 3, 4, 5), 6.0),
+            ]
+        )
+
+    def tearDown(self):
+        conftest.kill_database()
+
+    @patch.dict(database.DB_RETENTION_DAYS, {"raw": 30, "hourly": 60, "daily": None})
+    def test_expired_rows_are_deleted_in_batches(self):
+        report = database.apply_retention(now=datetime(2021, 3, 20, 12), batch_size=1)
+        self.assertEqual(
+            [(x["policy"], x["cutoff"], x["rows"]) for x in report],
+            [
+                ("raw", datetime(2021, 2, 18), 2),
+                ("hourly", datetime(2021, 1, 19), 1),
+            ],
+        )
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 1)
+        self.assertEqual(report[0]["bytes"], None)
+
+    @patch.dict(database.DB_RETENTION_DAYS, {"raw": 30, "hourly": None, "daily": None})
+    def test_expired_readings_are_downsampled_before_deletion(self):
+        database.engine.execute('DELETE FROM "Sensor Readings Daily"')
+        database.apply_retention(now=datetime(2021, 3, 20, 12))
+        daily = database.get_rollups(1, datetime(2021, 1, 1), datetime(2021, 4, 1))
+        self.assertEqual(
+            [(x["period_start"], x["count"], x["mean"]) for x in daily],
+            [(datetime(2021, 1, 10), 2, 3.0)],
+        )
+
+    @patch.dict(database.DB_RETENTION_DAYS, {"raw": 30, "hourly": None, "daily": None})
+    def test_a_stray_old_reading_does_not_rebuild_existing_rollups(self):
+        database.apply_retention(now=datetime(2021, 3, 20, 12))
+        database.engine.execute(
+            'INSERT INTO "Sensor Readings" ("Timestamp_UTC", "Sensor_ID", "Reading") '
+            "VALUES ('2021-01-05 12:00:00.000000', 1, 8.0)"
+        )
+        database.apply_retention(now=datetime(2021, 3, 20, 12))
+        daily = database.get_rollups(1, datetime(2021, 1, 1), datetime(2021, 4, 1))
+        self.assertEqual(
+            [(x["period_start"], x["count"], x["mean"]) for x in daily],
+            [
+                (datetime(2021, 1, 5), 1, 8.0),
+                (datetime(2021, 1, 10), 2, 3.0),
+                (datetime(2021, 3, 4), 1, 6.0),
+            ],
+        )
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 1)
+
+    @patch.dict(
+        database.DB_RETENTION_DAYS, {"raw": None, "hourly": None, "daily": None}
+    )
+    def test_nothing_is_removed_without_a_policy(self):
+        self.assertEqual(database.apply_retention(), [])
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 3)
+
+
+@skipIf(database.numpy is None, "NumPy not installed")
+class TestReadReadings(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+        database.write_sensor_readings_to_db(
+            [
+                radiohelper.DecodedPacket(
+                    1,
+                    serial,
+                    sensor_ids=array("B", [1, 2, 3]),
+                    readings=array("f", [serial, -serial, 0.5]),
+                    timestamp=datetime(2021, 3, 4, 5, serial),
+                )
+                for serial in range(5)
+            ]
+        )
+
+    def tearDown(self):
+        conftest.kill_database()
+
+    def test_readings_are_yielded_in_chunks_in_sensor_and_time_order(self):
+        chunks = list(
+            database.read_readings(
+                [2, 1],
+                datetime(2021, 3, 4, 5, 1),
+                datetime(2021, 3, 4, 5, 4),
+                chunk_size=4,
+            )
+        )
+        self.assertEqual([len(x) for x in chunks], [4, 2])
+        readings = database.numpy.concatenate(chunks)
+        self.assertEqual(readings.dtype, database.numpy.dtype(database.READING_DTYPE))
+        self.assertEqual(readings["sensor_id"].tolist(), [1, 1, 1, 2, 2, 2])
+        self.assertEqual(readings["value"].tolist(), [1, 2, 3, -1, -2, -3])
+        self.assertEqual(
+            readings["timestamp"][0], database.numpy.datetime64("2021-03-04T05:01:00")
+        )
+
+    def test_a_single_sensor_id_can_be_given(self):
+        readings = next(
+            database.read_readings(3, datetime(2021, 3, 4), datetime(2021, 3, 5))
+        )
+        self.assertEqual(len(readings), 5)
+
+    def test_no_readings_yields_nothing(self):
+        self.assertEqual(
+            list(
+                database.read_readings([9], datetime(2021, 3, 4), datetime(2021, 3, 5))
+            ),
+            [],
+        )
+
+
+class TestLatestReadings(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+
+    def tearDown(self):
+        conftest.kill_database()
+
+    @staticmethod
+    def _write(timestamp, sensor_ids, readings):
+        database.write_sensor_readings_to_db(
+            [
+                radiohelper.DecodedPacket(
+                    1,
+                    1,
+                    sensor_ids=array("B", sensor_ids),
+                    readings=array("f", readings),
+                    timestamp=timestamp,
+                )
+            ]
+        )
+
+    def test_latest_reading_of_each_sensor_is_kept(self):
+        self._write(datetime(2021, 3, 4, 5), [1, 2], [1.0, 2.0])
+        self._write(datetime(2021, 3, 4, 6), [1], [3.0])
+        self.assertEqual(
+            database.get_latest_readings(),
+            [
+                {
+                    "Sensor_ID": 1,
+                    "Timestamp_UTC": datetime(2021, 3, 4, 6),
+                    "Reading": 3.0,
+                },
+                {
+                    "Sensor_ID": 2,
+                    "Timestamp_UTC": datetime(2021, 3, 4, 5),
+                    "Reading": 2.0,
+                },
+            ],
+        )
+        self.assertEqual(database.latest_reading(1), (datetime(2021, 3, 4, 6), 3.0))
+        self.assertIsNone(database.latest_reading(3))
+
+    def test_a_late_batch_does_not_replace_a_newer_reading(self):
+        self._write(datetime(2021, 3, 4, 6), [1], [3.0])
+        self._write(datetime(2021, 3, 4, 5), [1], [1.0])
+        self.assertEqual(database.get_latest_readings()[0]["Reading"], 3.0)
+        self.assertEqual(database.latest_reading(1), (datetime(2021, 3, 4, 6), 3.0))
+
+    def test_latest_readings_are_seeded_from_existing_readings(self):
+        self._write(datetime(2021, 3, 4, 5), [1, 2], [1.0, 2.0])
+        self._write(datetime(2021, 3, 4, 6), [1], [3.0])
+        database.engine.execute('DELETE FROM "Latest Readings"')
+        database.latest_readings.clear()
+        database._load_latest_readings()
+        self.assertEqual(
+            [(x["Sensor_ID"], x["Reading"]) for x in database.get_latest_readings()],
+            [(1, 3.0), (2, 2.0)],
+        )
+        self.assertEqual(database.latest_reading(2), (datetime(2021, 3, 4, 5), 2.0))
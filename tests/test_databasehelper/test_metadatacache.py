@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from database import database
+from database.metadatacache import MetadataCache, NodeRecord, SensorRecord
+from tests import conftest
+
+
+class TestMetadataCache(TestCase):
+    def setUp(self):
+        self.nodes = [NodeRecord(1, "Node 1", "Hall"), NodeRecord(2, "Node 2", "Loft")]
+        self.sensors = [
+            SensorRecord(3, 1, "Sensor 3", "Mass"),
+            SensorRecord(1, 1, "Sensor 1", "Mass"),
+        ]
+        self.loader = Mock(side_effect=lambda: (self.nodes, self.sensors))
+        self.cache = MetadataCache(self.loader, ttl=60)
+
+    def test_lookups(self):
+        self.assertEqual(self.cache.node(2), self.nodes[1])
+        self.assertIsNone(self.cache.node(3))
+        self.assertEqual(self.cache.sensor(1).Node_ID, 1)
+        self.assertIsNone(self.cache.sensor(2))
+        self.assertEqual(self.cache.node_ids(), [1, 2])
+        self.assertEqual(self.cache.sensor_ids(), [1, 3])
+        self.assertEqual(self.cache.sensor_ids_for_node(1), (1, 3))
+        self.assertEqual(self.cache.sensor_ids_for_node(2), ())
+        self.assertIsNone(self.cache.sensor_ids_for_node(5))
+
+    def test_records_are_loaded_once_and_then_hit(self):
+        for _ in range(4):
+            self.cache.sensor(1)
+        self.loader.assert_called_once_with()
+        metrics = self.cache.get_metrics()
+        self.assertEqual(
+            (metrics["hits"], metrics["misses"], metrics["loads"]), (3, 1, 1)
+        )
+        self.assertEqual(metrics["hit_ratio"], 0.75)
+        self.assertEqual((metrics["nodes"], metrics["sensors"]), (2, 2))
+
+    def test_invalidate_reloads_on_next_use(self):
+        self.cache.node(1)
+        self.nodes.append(NodeRecord(9, "Node 9", "Shed"))
+        self.assertIsNone(self.cache.node(9))
+        self.cache.invalidate()
+        self.assertEqual(self.cache.node(9).Name, "Node 9")
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_records_expire_after_the_ttl(self):
+        with patch("database.metadatacache.time.monotonic", return_value=100.0):
+            self.cache.node(1)
+        with patch("database.metadatacache.time.monotonic", return_value=159.0):
+            self.cache.node(1)
+        self.assertEqual(self.loader.call_count, 1)
+        with patch("database.metadatacache.time.monotonic", return_value=160.0):
+            self.cache.node(1)
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_invalidation_during_a_load_leaves_the_load_stale(self):
+        def invalidating_loader():
+            self.cache.invalidate()
+            return self.nodes, self.sensors
+
+        self.loader.side_effect = invalidating_loader
+        self.cache.node(1)
+        self.loader.side_effect = lambda: (self.nodes, self.sensors)
+        self.cache.node(1)
+        self.assertEqual(self.loader.call_count, 2)
+
+
+class TestDatabaseMetadataCache(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+
+    def tearDown(self):
+        conftest.kill_database()
+
+    def test_cached_lookups_do_not_query_the_database(self):
+        database.add_node(node_id=1, name="Node 1", location="Hall")
+        database.add_sensor(sensor_id=2, node_id=1, name="Sensor 2", quantity="Mass")
+        database.get_sensor_data(2)
+        checkouts = database.get_pool_metrics()["checkouts"]
+        self.assertTrue(database._sensor_id_exists(2))
+        self.assertFalse(database._sensor_id_exists(3))
+        self.assertEqual(list(database.get_all_sensor_ids_for_a_node(1)), [2])
+        self.assertEqual(database.get_node_data(1)["Location"], "Hall")
+        self.assertEqual(database.get_pool_metrics()["checkouts"], checkouts)
+
+    def test_readings_from_unknown_sensors_are_written_with_one_warning(self):
+        database.add_node(node_id=1, name="Node 1", location="Hall")
+        database.add_sensor(sensor_id=2, node_id=1, name="Sensor 2", quantity="Mass")
+        database.get_sensor_data(2)
+        rows = [(conftest.global_test_time, x, 1.0) for x in (2, 3)]
+        with patch.object(database, "_unknown_sensors", set()):
+            checkouts = database.get_pool_metrics()["checkouts"]
+            with self.assertLogs(database.logger, "WARNING") as logs:
+                database.write_reading_rows_to_db(rows)
+            self.assertEqual(
+                logs.output,
+                ["WARNING:database.database:Readings from unknown sensors [3]"],
+            )
+            self.assertEqual(database.get_pool_metrics()["checkouts"], checkouts + 1)
+            with patch.object(database.logger, "warning") as warning:
+                database.write_reading_rows_to_db(rows)
+            warning.assert_not_called()
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 4)
+
+    def test_writes_invalidate_the_cache(self):
+        self.assertEqual(list(database.get_all_node_ids()), [])
+        database.add_node(node_id=4, name="Node 4", location="Hall")
+        self.assertEqual(list(database.get_all_node_ids()), [4])
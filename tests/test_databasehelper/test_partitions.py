@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+from datetime import datetime
+from database import database, partitions
+from tests import conftest
+
+
+class TestPartitionNames(TestCase):
+    def test_month_start(self):
+        self.assertEqual(
+            partitions.month_start(datetime(2021, 3, 17, 12, 30)), datetime(2021, 3, 1)
+        )
+
+    def test_next_month_wraps_at_year_end(self):
+        self.assertEqual(
+            partitions.next_month(datetime(2021, 3, 17)), datetime(2021, 4, 1)
+        )
+        self.assertEqual(
+            partitions.next_month(datetime(2021, 12, 31)), datetime(2022, 1, 1)
+        )
+
+    def test_partition_name_round_trips(self):
+        name = partitions.partition_name(datetime(2021, 3, 1))
+        self.assertEqual(name, "Sensor Readings 2021_03")
+        self.assertEqual(partitions.partition_month(name), datetime(2021, 3, 1))
+
+    def test_partition_month_is_none_for_other_tables(self):
+        self.assertIsNone(partitions.partition_month("Sensor Readings default"))
+        self.assertIsNone(partitions.partition_month("Sensors"))
+
+
+class TestPartitionsNotPostgresql(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+
+    def tearDown(self):
+        database.engine.dispose()
+
+    def test_ensure_partitions_does_nothing(self):
+        self.assertEqual(database.ensure_partitions(), [])
+
+    def test_partition_report_is_empty(self):
+        self.assertEqual(database.get_partition_report(), [])
+
+    def test_migration_does_nothing(self):
+        self.assertEqual(database.migrate_readings_to_partitions(), 0)
+
+    def test_readings_table_is_not_partitioned(self):
+        with database.connection_scope() as connection:
+            self.assertFalse(partitions.is_partitioned(connection))
@@ -123,7 +123,7 @@ class TestDataProcessing:
         mock_radio_q = mocker.patch.object(
             _dataprocessing, "radio_q", autospec=True
         )
-        mock_radio_q.get.return_value = None
+        mock_radio_q.get.return_value = (0, None, None)
         mock_unpack_data_packet.side_effect = [ValueError]
         mock_expand_radio_data_into_dict.return_value = {"node": None, "sensors": None}
         mock_packet_missing_or_duplicate.return_value = True
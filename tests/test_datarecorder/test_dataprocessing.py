@@ -6,58 +6,51 @@ Created on Tue Dec  3 10:36:28 2019
 @author: martinstephens
 """
 from unittest import TestCase
+from unittest.mock import patch
 import threading
 import datetime
+import time
 
-from Datarecorder.datarecorder import _dataprocessing
+from Datarecorder.datarecorder import _dataprocessing, _dbwriter, _handleevents
 from Datarecorder.helpers import radiohelper
 from tests import conftest
 
 
 class TestDataPrep(TestCase):
-    def test_struct_is_unpacked_correctly(self):
-        decoded_data = _dataprocessing.unpack_data_packet(
-            radiohelper.RADIO_DATA_FORMAT,
-            {
-                "timestamp": conftest.global_test_time,
-                "radio_data": conftest.rx_data_CRC_good,
-            },
+    def test_packet_is_decoded_into_a_decoded_packet(self):
+        decoded_data = _dataprocessing.codec.decode(
+            conftest.rx_data_CRC_good, timestamp=conftest.global_test_time
         )
-        self.assertEqual(len(decoded_data["radio_data"]), len(conftest.dummy_data))
-        self.assertEqual(decoded_data["timestamp"], conftest.global_test_time)
+        self.assertIsInstance(decoded_data, _dataprocessing.radiohelper.DecodedPacket)
+        self.assertEqual(decoded_data.timestamp, conftest.global_test_time)
+        self.assertEqual(decoded_data.node_id, conftest.dummy_data[0])
+        self.assertEqual(decoded_data.pkt_serial, conftest.dummy_data[2])
+        self.assertEqual(decoded_data.status_register, conftest.dummy_data[3])
+        self.assertEqual(
+            len(decoded_data), radiohelper.SENSOR_COUNT - 1
+        )  # One sensor is 0xff, thus ignored
         [
             self.assertAlmostEqual(x[0], x[1], places=2)
-            for x in zip(decoded_data["radio_data"], conftest.dummy_data)
+            for x in zip(
+                decoded_data.readings,
+                conftest.dummy_data[radiohelper.SENSOR_OFFSET + 1 : -2 : 2],
+            )
         ]
 
-    def test_data_munged_correctly(self):
-        test_data = {
-            "timestamp": conftest.global_test_time,
-            "radio_data": conftest.dummy_data,
-        }
-        data_returned = _dataprocessing.expand_radio_data_into_dict(test_data)
-        self.assertIsInstance(data_returned, dict)
-        self.assertIsInstance(data_returned["node"], dict)
-        node_data = data_returned["node"]
-        self.assertEqual(list(node_data.keys()), conftest.node_keys)
-        self.assertEqual(node_data["node_id"], conftest.dummy_data[0])
-        self.assertEqual(node_data["pkt_serial"], conftest.dummy_data[2])
-        self.assertEqual(node_data["status_register"], conftest.dummy_data[3])
-        self.assertEqual(node_data["unused_1"], conftest.dummy_data[4])
-        self.assertEqual(node_data["unused_2"], conftest.dummy_data[5])
-        self.assertEqual(
-            data_returned["sensors"]["timestamp"], conftest.global_test_time
+    def test_sensor_readings_are_held_in_arrays(self):
+        decoded_data = _dataprocessing.codec.decode(conftest.rx_data_CRC_good)
+        self.assertEqual(decoded_data.sensor_ids.typecode, "B")
+        self.assertEqual(decoded_data.readings.typecode, "f")
+        sensor_readings = list(decoded_data.sensor_readings())
+        self.assertIsInstance(
+            sensor_readings[0], _dataprocessing.radiohelper.SensorReading
         )
-        sensor_data = data_returned["sensors"]["sensor_readings"]
-        self.assertIsInstance(data_returned, dict)
-        self.assertEqual(
-            len(sensor_data), radiohelper.SENSOR_COUNT - 1
-        )  # One sensor is 0xff, thus ignored
+        self.assertEqual([x.sensor_id for x in sensor_readings], list(range(9)))
 
 
 class CheckForRepeatPacket(TestCase):
     def test_check_for_duplicate_packet_returns_true_and_dict_if_duplicate(self):
-        test_data = {"node_id": 0x01, "pkt_serial": 0x1010}
+        test_data = radiohelper.DecodedPacket(node_id=0x01, pkt_serial=0x1010)
         _dataprocessing.last_packet_info = {
             0x01: {"pkt_serial": 0x1010, "timestamp": None}
         }
@@ -67,7 +60,7 @@ class CheckForRepeatPacket(TestCase):
         self.assertEqual(_dataprocessing.last_packet_info[0x01]["pkt_serial"], 0x1010)
 
     def test_check_for_duplicate_returns_false_and_updates_dict_if_not_duplicate(self):
-        test_data = {"node_id": 0x01, "pkt_serial": 0x1010}
+        test_data = radiohelper.DecodedPacket(node_id=0x01, pkt_serial=0x1010)
         _dataprocessing.last_packet_info = {
             0x01: {"pkt_serial": 0x1011, "timestamp": None}
         }
@@ -77,20 +70,20 @@ class CheckForRepeatPacket(TestCase):
         self.assertEqual(_dataprocessing.last_packet_info[0x01]["pkt_serial"], 0x1010)
 
     def test_check_for_duplicate_handles_wrap_around_of_serial_numbers(self):
-        test_data = {"node_id": 0x02, "pkt_serial": 0x0001}
+        test_data = radiohelper.DecodedPacket(node_id=0x02, pkt_serial=0x0001)
         _dataprocessing.last_packet_info = {
             0x02: {"pkt_serial": 0xFFFE, "timestamp": None}
         }
         _dataprocessing.packet_missing_or_duplicate(test_data)
         self.assertEqual(_dataprocessing.last_packet_info[0x02]["pkt_serial"], 0x0001)
-        test_data = {"node_id": 0x01, "pkt_serial": 0x0000}
+        test_data = radiohelper.DecodedPacket(node_id=0x01, pkt_serial=0x0000)
         _dataprocessing.last_packet_info = {
             0x01: 0xFFFE,
         }
         _dataprocessing.packet_missing_or_duplicate(test_data)
 
     def test_new_node_added_to_dict(self):
-        test_data = {"node_id": 0x01, "pkt_serial": 0x1010}
+        test_data = radiohelper.DecodedPacket(node_id=0x01, pkt_serial=0x1010)
         _dataprocessing.last_packet_info = {
             0x02: {"pkt_serial": 0xFFFF, "timestamp": None}
         }
@@ -108,12 +101,16 @@ class TestReadRadioAndWriteDataToDataBase(TestCase):
         conftest.initialize_database(db_in_memory=True)
         initial = conftest.count_all_sensor_reading_records()
         test_data = [conftest.rx_data_CRC_good, conftest.rx_data_CRC_good]
-        [_dataprocessing.radio_q.put(x) for x in test_data]
+        [_dataprocessing.enqueue_packet(x) for x in test_data]
         _dataprocessing.process_radio_data()
+        _dbwriter.process_write_queue()
+        _dbwriter.flush_buffer()
         final = conftest.count_all_sensor_reading_records()
         self.assertEqual(final, initial + 9)
         # shouldn't write twice with duplicate data packets
         _dataprocessing.process_radio_data()
+        self.assertTrue(_dbwriter.write_q.empty())
+        _dbwriter.flush_buffer()
         final = conftest.count_all_sensor_reading_records()
         self.assertEqual(final, initial + 9)
         conftest.kill_database()
@@ -124,12 +121,111 @@ class TestReadRadioAndWriteDataToDataBase(TestCase):
         test_data = [
             b"bad_data",
         ]
-        [_dataprocessing.radio_q.put(x) for x in test_data]
+        [_dataprocessing.enqueue_packet(x) for x in test_data]
         _dataprocessing.process_radio_data()
         final = conftest.count_all_sensor_reading_records()
         self.assertEqual(final, initial)
 
 
+def discard_queued_packets():
+    """Empty the database writer and event queues of the packets a test queued."""
+    for work_queue in (_dbwriter.write_q, _handleevents.event_queue):
+        while not work_queue.empty():
+            work_queue.get_nowait()
+            work_queue.task_done()
+
+
+class RadioQueueTestCase(TestCase):
+    """Tests of packets from the radio queue, on an in-memory database with no
+    duplicate check state."""
+
+    def setUp(self):
+        conftest.initialize_database(db_in_memory=True)
+        _dataprocessing.last_packet_info = {}
+
+    def tearDown(self):
+        discard_queued_packets()
+        conftest.kill_database()
+
+    @staticmethod
+    def commit_next_packet():
+        """Process the next packet on the radio queue, write it to the database
+        and return the committed packets."""
+        committed = []
+        listeners = _dbwriter.commit_listeners + [committed.extend]
+        with patch.object(_dbwriter, "commit_listeners", listeners):
+            _dataprocessing.process_radio_data()
+            _dbwriter.process_write_queue()
+            _dbwriter.flush_buffer()
+        return committed
+
+
+class TestPacketCounters(TestCase):
+    def tearDown(self):
+        discard_queued_packets()
+
+    def test_crc_failures_duplicates_and_gaps_are_counted(self):
+        crc_failures = _dataprocessing.crc_failures.get()
+        duplicates = _dataprocessing.duplicate_packets.get("0x0a")
+        missing = _dataprocessing.missing_packets.get("0x0a")
+        _dataprocessing.last_packet_info = {
+            0x0A: {"pkt_serial": 0x0A06, "timestamp": None}
+        }
+        _dataprocessing.process_packet(b"bad_data", None)
+        _dataprocessing.process_packet(conftest.rx_data_CRC_good, None)
+        _dataprocessing.process_packet(conftest.rx_data_CRC_good, None)
+        self.assertEqual(_dataprocessing.crc_failures.get(), crc_failures + 1)
+        self.assertEqual(_dataprocessing.missing_packets.get("0x0a"), missing + 3)
+        self.assertEqual(_dataprocessing.duplicate_packets.get("0x0a"), duplicates + 1)
+
+    def test_a_node_restart_is_counted_as_a_reset_not_a_gap(self):
+        missing = _dataprocessing.missing_packets.get("0x0a")
+        resets = _dataprocessing.serial_resets.get("0x0a")
+        # The packet's serial, 0x0a0a, is below the last, as after a restart.
+        _dataprocessing.last_packet_info = {
+            0x0A: {"pkt_serial": 0x0B0B, "timestamp": None}
+        }
+        _dataprocessing.process_packet(conftest.rx_data_CRC_good, None)
+        self.assertEqual(_dataprocessing.missing_packets.get("0x0a"), missing)
+        self.assertEqual(_dataprocessing.serial_resets.get("0x0a"), resets + 1)
+
+
+class TestStageLatency(RadioQueueTestCase):
+    def test_each_stage_is_recorded_for_a_packet_from_the_radio_queue(self):
+        for histogram in _dataprocessing.stage_latency.values():
+            histogram.reset()
+        _dataprocessing.enqueue_packet(conftest.rx_data_CRC_good)
+        self.commit_next_packet()
+        latency = _dataprocessing.get_latency_metrics()
+        for stage in ("queue_wait", "decode", "duplicate_check", "db_commit"):
+            self.assertEqual(latency[stage]["count"], 1)
+        self.assertEqual(latency["event_enqueue"]["count"], 1)
+        self.assertGreaterEqual(
+            latency["end_to_end"]["max"], latency["db_commit"]["max"]
+        )
+
+
+class TestReceiveTimestamp(RadioQueueTestCase):
+    def test_timestamp_is_the_receive_time_not_the_processing_time(self):
+        received_ns = time.monotonic_ns() - 30 * 1_000_000_000
+        _dataprocessing.enqueue_packet(conftest.rx_data_CRC_good, received_ns)
+        committed = self.commit_next_packet()
+        age = datetime.datetime.utcnow() - committed[0].timestamp
+        self.assertAlmostEqual(age.total_seconds(), 30, delta=1)
+
+    @patch.object(_dataprocessing._packetlog, "packet_log_is_open", return_value=True)
+    @patch.object(_dataprocessing._packetlog, "log_packet")
+    def test_a_replayed_packet_keeps_its_timestamp_and_is_not_logged_again(
+        self, mock_log_packet, _
+    ):
+        _dataprocessing.enqueue_packet(
+            conftest.rx_data_CRC_good, timestamp=conftest.global_test_time
+        )
+        committed = self.commit_next_packet()
+        self.assertEqual(committed[0].timestamp, conftest.global_test_time)
+        mock_log_packet.assert_not_called()
+
+
 class TestThreadingWithQueue(TestCase):
     def test_thread_spawned(self):
         thread = _dataprocessing.init_data_processing_thread()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+from unittest.mock import patch
+from array import array
+from datetime import datetime
+import time
+
+from datarecorder import _dbwriter
+from database import database
+from helpers import radiohelper
+from tests import conftest
+
+
+def make_packet(pkt_serial, sensor_count=3):
+    return radiohelper.DecodedPacket(
+        node_id=0x01,
+        pkt_serial=pkt_serial,
+        sensor_ids=array("B", range(sensor_count)),
+        readings=array("f", [1.5] * sensor_count),
+        timestamp=conftest.global_test_time,
+    )
+
+
+class TestBatchedDatabaseWriter(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+
+    def tearDown(self):
+        _dbwriter.flush_buffer()
+        conftest.kill_database()
+
+    def test_packets_without_readings_are_not_queued(self):
+        _dbwriter.write_packet_to_queue(make_packet(0x0001, sensor_count=0))
+        self.assertTrue(_dbwriter.write_q.empty())
+
+    def test_buffer_is_not_written_until_a_limit_is_reached(self):
+        _dbwriter.write_packet_to_queue(make_packet(0x0001))
+        _dbwriter.process_write_queue()
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 0)
+        self.assertEqual(_dbwriter.get_writer_metrics()["buffered_rows"], 3)
+
+    @patch.object(_dbwriter, "DB_BATCH_ROWS", 6)
+    def test_buffer_is_written_in_one_commit_when_row_limit_reached(self):
+        start = _dbwriter.get_writer_metrics()
+        for pkt_serial in range(2):
+            _dbwriter.write_packet_to_queue(make_packet(pkt_serial))
+            _dbwriter.process_write_queue()
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 6)
+        metrics = _dbwriter.get_writer_metrics()
+        self.assertEqual(metrics["commits"], start["commits"] + 1)
+        self.assertEqual(metrics["rows"], start["rows"] + 6)
+        self.assertEqual(metrics["buffered_rows"], 0)
+
+    @patch.object(_dbwriter, "DB_BATCH_INTERVAL_MS", 10)
+    def test_buffer_is_written_when_interval_has_passed(self):
+        _dbwriter.write_packet_to_queue(make_packet(0x0001))
+        _dbwriter.process_write_queue()
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 0)
+        time.sleep(0.02)
+        _dbwriter.process_write_queue()  # Times out waiting on the empty queue
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 3)
+
+    def test_shut_down_writes_everything_queued(self):
+        for pkt_serial in range(3):
+            _dbwriter.write_packet_to_queue(make_packet(pkt_serial))
+            _dbwriter.process_write_queue()
+        _dbwriter.write_packet_to_queue(make_packet(0x0004))
+        with patch.object(_dbwriter.write_q, "join"):
+            _dbwriter.process_write_queue()
+            _dbwriter.shut_down()
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 12)
+
+    def test_metrics_report_rows_per_commit(self):
+        _dbwriter.write_packet_to_queue(make_packet(0x0001))
+        _dbwriter.process_write_queue()
+        _dbwriter.flush_buffer()
+        metrics = _dbwriter.get_writer_metrics()
+        self.assertGreater(metrics["commits_per_second"], 0)
+        self.assertGreater(metrics["rows_per_commit"], 0)
+
+    def test_commit_listeners_get_the_committed_packets(self):
+        committed = []
+        packets = [make_packet(0x0001), make_packet(0x0002)]
+        with patch.object(_dbwriter, "commit_listeners", [committed.append]):
+            self.assertEqual(_dbwriter.flush_buffer(), 0)
+            for packet in packets:
+                _dbwriter.write_packet_to_queue(packet)
+                _dbwriter.process_write_queue()
+            _dbwriter.flush_buffer()
+        self.assertEqual(committed, [packets])
+
+    def test_a_batch_that_cannot_be_prepared_is_kept(self):
+        failed_commits = _dbwriter.get_writer_metrics()["failed_commits"]
+        _dbwriter.write_packet_to_queue(make_packet(0x0001))
+        _dbwriter.process_write_queue()
+        with patch("helpers.clock.fill_timestamps", side_effect=OverflowError):
+            self.assertEqual(_dbwriter.flush_buffer(), 0)
+        metrics = _dbwriter.get_writer_metrics()
+        self.assertEqual(metrics["failed_commits"], failed_commits + 1)
+        self.assertEqual(metrics["buffered_rows"], 3)
+
+    def test_the_writer_loop_carries_on_after_an_error(self):
+        with patch.object(
+            _dbwriter,
+            "process_write_queue",
+            side_effect=[RuntimeError("bad batch"), None, KeyboardInterrupt],
+        ) as process_write_queue:
+            with self.assertRaises(KeyboardInterrupt):
+                _dbwriter.loop_process_write_queue()
+        self.assertEqual(process_write_queue.call_count, 3)
+
+
+class TestEventsAreWrittenWithReadings(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+        database.add_node(0x05, "Gate")
+
+    def tearDown(self):
+        _dbwriter.flush_buffer()
+        conftest.kill_database()
+
+    def events(self):
+        return database.get_events(0x05, datetime(2019, 1, 1), datetime(2020, 1, 1))
+
+    def test_packets_with_only_events_are_written(self):
+        packet = radiohelper.DecodedPacket(
+            0x05, 0x0001, 0x0003, timestamp=conftest.global_test_time
+        )
+        _dbwriter.write_packet_to_queue(packet)
+        _dbwriter.process_write_queue()
+        _dbwriter.flush_buffer()
+        self.assertEqual(
+            self.events(),
+            [(conftest.global_test_time, 0), (conftest.global_test_time, 1)],
+        )
+
+
+class TestMultiRowInsert(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+
+    def tearDown(self):
+        conftest.kill_database()
+
+    @patch.object(database, "MAX_ROWS_PER_INSERT", 4)
+    def test_batches_larger_than_one_insert_are_written(self):
+        packets = [make_packet(x) for x in range(5)]
+        self.assertEqual(database.write_sensor_readings_to_db(packets), 15)
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 15)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+from unittest import TestCase, mock
+
+from datarecorder import _handleevents
+from helpers import radiohelper
+from helpers.scheduler import Scheduler
+
+GATE = 0x05
+
+
+class TestDelayedActions(TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+        patches = [
+            mock.patch.object(_handleevents, "scheduler", self.scheduler),
+            mock.patch.object(_handleevents, "_run_action"),
+            mock.patch.dict(_handleevents.register_state, clear=True),
+            mock.patch.dict(_handleevents._level_fired, clear=True),
+        ]
+        self.run_action = [x.start() for x in patches][1]
+        for patch in patches:
+            self.addCleanup(patch.stop)
+        self.addCleanup(_handleevents.set_event_actions, _handleevents.event_actions)
+        _handleevents.set_event_actions(
+            {
+                GATE: {
+                    0x00: {"url": "open", "delay": 60},
+                    0x01: {"url": "close", "delay": 0, "cancels": [0x00]},
+                    0x03: {"url": "alarm", "delay": 0},
+                    0x04: {"url": "battery ok", "delay": 0, "trigger": "falling"},
+                    0x05: {"url": "motion", "delay": 0, "trigger": "both"},
+                    0x06: {"url": "low", "delay": 0, "trigger": "level", "repeat": 60},
+                }
+            }
+        )
+
+    def tearDown(self):
+        self.scheduler.shutdown(timeout=5)
+
+    def handle(self, status_register):
+        _handleevents.write_event_to_queue(
+            radiohelper.DecodedPacket(GATE, 0, status_register)
+        )
+        _handleevents.read_event_queue_handle_event()
+
+    def test_a_delayed_action_does_not_block_the_event_thread(self):
+        start = time.monotonic()
+        self.handle(0x0001)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.scheduler.pending, 1)
+        self.run_action.assert_not_called()
+
+    def test_events_without_actions_are_logged_and_skipped(self):
+        with self.assertLogs(_handleevents.logger, "ERROR"):
+            self.handle(0x0004 | 0x0008)
+        self.run_action.assert_called_once_with("alarm")
+
+    def test_close_cancels_a_pending_open(self):
+        self.handle(0x0001)
+        self.handle(0x0002)
+        self.assertEqual(self.scheduler.pending, 0)
+        self.run_action.assert_called_once_with("close")
+
+    def test_a_repeated_register_fires_its_actions_once(self):
+        for _ in range(3):
+            self.handle(0x0008)
+        self.run_action.assert_called_once_with("alarm")
+        self.handle(0x0000)
+        self.handle(0x0008)
+        self.assertEqual(self.run_action.call_count, 2)
+
+    def test_falling_and_both_triggers(self):
+        self.handle(0x0010 | 0x0020)
+        self.run_action.assert_called_once_with("motion")
+        self.handle(0x0000)
+        self.assertEqual(
+            self.run_action.call_args_list[1:],
+            [mock.call("battery ok"), mock.call("motion")],
+        )
+
+    def test_level_actions_repeat_only_after_their_window(self):
+        self.handle(0x0040)
+        self.handle(0x0040)
+        self.run_action.assert_called_once_with("low")
+        _handleevents._level_fired[GATE, 0x06] -= 61
+        self.handle(0x0040)
+        self.assertEqual(self.run_action.call_count, 2)
+
+    def test_cleared_registers_are_wanted_from_nodes_with_actions(self):
+        self.assertTrue(
+            _handleevents.wants_packet(radiohelper.DecodedPacket(GATE, 0, 0x0000))
+        )
+        self.assertFalse(
+            _handleevents.wants_packet(radiohelper.DecodedPacket(0x06, 0, 0x0000))
+        )
+        self.assertTrue(
+            _handleevents.wants_packet(radiohelper.DecodedPacket(0x06, 0, 0x0001))
+        )
+
+
+class TestActionTable(TestCase):
+    def setUp(self):
+        self.tables = _handleevents.compile_event_actions(
+            {GATE: {0x00: {"url": "open", "delay": 0}, 0x0F: {"url": "x", "delay": 5}}}
+        )
+
+    def test_each_register_value_maps_to_the_actions_of_its_bits(self):
+        node = self.tables[GATE]
+        self.assertEqual(node.actions(0), ())
+        self.assertEqual(
+            [(x.event, x.url) for x in node.actions(0x8003)],
+            [(0x00, "open"), (0x01, None), (0x0F, "x")],
+        )
+        for register in range(0x10000):
+            self.assertEqual(
+                [x.event for x in node.actions(register)],
+                _handleevents._decode_register(register),
+            )
+
+    def test_actions_are_compiled_on_first_use(self):
+        self.addCleanup(setattr, _handleevents, "action_tables", None)
+        _handleevents.action_tables = None
+        self.assertIn(0x05, _handleevents.get_action_tables())
+
+    def test_events_beyond_the_register_are_rejected(self):
+        with self.assertRaises(ValueError):
+            _handleevents.compile_event_actions({GATE: {16: {"url": "x", "delay": 0}}})
+
+    def test_unknown_triggers_are_rejected(self):
+        with self.assertRaises(ValueError):
+            _handleevents.compile_event_actions(
+                {GATE: {0: {"url": "x", "delay": 0, "trigger": "sideways"}}}
+            )
+
+    def test_set_event_actions_swaps_the_table(self):
+        old = _handleevents.event_actions
+        self.addCleanup(_handleevents.set_event_actions, old)
+        _handleevents.set_event_actions({0x07: {0x02: {"url": "y", "delay": 0}}})
+        tables = _handleevents.get_action_tables()
+        self.assertEqual(list(tables), [0x07])
+        self.assertEqual(tables[0x07].actions(0x0004)[0].url, "y")
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from datarecorder import _maintenance
+
+
+class TestMaintenance(TestCase):
+    def test_run_maintenance_runs_every_task(self):
+        tasks = [Mock(__name__="task_a"), Mock(__name__="task_b")]
+        with patch.object(_maintenance, "maintenance_tasks", tasks):
+            _maintenance.run_maintenance()
+        for task in tasks:
+            task.assert_called_once_with()
+
+    def test_a_failing_task_does_not_stop_the_others(self):
+        tasks = [
+            Mock(__name__="task_a", side_effect=RuntimeError("no database")),
+            Mock(__name__="task_b"),
+        ]
+        with patch.object(_maintenance, "maintenance_tasks", tasks):
+            with self.assertLogs(_maintenance.logger, level="ERROR"):
+                _maintenance.run_maintenance()
+        tasks[1].assert_called_once_with()
+
+    def test_shut_down_stops_the_thread(self):
+        thread = _maintenance.init_maintenance_thread()
+        _maintenance.shut_down()
+        thread.join(timeout=1)
+        self.assertFalse(thread.is_alive())
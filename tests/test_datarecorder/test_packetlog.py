@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from datetime import datetime
+
+from datarecorder import _dataprocessing, _dbwriter, _packetlog
+from helpers import clock
+from tests import conftest
+
+
+class TestPacketLog(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "packets.bin")
+        _packetlog.open_packet_log(self.path)
+
+    def tearDown(self):
+        _packetlog.close_packet_log()
+        self.directory.cleanup()
+
+    def test_logged_packets_are_read_back_with_their_timestamps(self):
+        timestamp = datetime(2021, 3, 4, 5, 6, 7, 891011)
+        _packetlog.log_packet(conftest.rx_data_CRC_good, timestamp)
+        _packetlog.log_packet(b"bad_data", datetime(1969, 12, 31, 23, 59, 59))
+        _packetlog.close_packet_log()
+        self.assertEqual(
+            list(_packetlog.read_packet_log(self.path)),
+            [
+                (timestamp, conftest.rx_data_CRC_good),
+                (datetime(1969, 12, 31, 23, 59, 59), b"bad_data"),
+            ],
+        )
+
+    def test_partial_record_ends_the_log(self):
+        _packetlog.log_packet(b"complete", conftest.global_test_time)
+        _packetlog.log_packet(b"cut short", conftest.global_test_time)
+        _packetlog.close_packet_log()
+        with open(self.path, "r+b") as log_file:
+            log_file.truncate(os.path.getsize(self.path) - 3)
+        self.assertEqual(
+            list(_packetlog.read_packet_log(self.path)),
+            [(conftest.global_test_time, b"complete")],
+        )
+
+    def test_file_without_magic_is_rejected(self):
+        with open(self.path + ".other", "wb") as other_file:
+            other_file.write(b"not a log")
+        with self.assertRaises(ValueError):
+            list(_packetlog.read_packet_log(self.path + ".other"))
+
+    def test_log_is_rotated_and_files_listed_oldest_first(self):
+        record_size = _packetlog.RECORD_HEADER.size + 4
+        max_bytes = len(_packetlog.MAGIC) + 2 * record_size
+        with patch.object(_packetlog, "PACKET_LOG_MAX_BYTES", max_bytes), patch.object(
+            _packetlog, "PACKET_LOG_BACKUPS", 2
+        ):
+            for serial in range(7):
+                _packetlog.log_packet(b"pkt%d" % serial, conftest.global_test_time)
+        _packetlog.close_packet_log()
+        paths = _packetlog.packet_log_files(self.path)
+        self.assertEqual(paths, [self.path + ".2", self.path + ".1", self.path])
+        packets = [
+            rx_packet
+            for path in paths
+            for _, rx_packet in _packetlog.read_packet_log(path)
+        ]
+        self.assertEqual(packets, [b"pkt2", b"pkt3", b"pkt4", b"pkt5", b"pkt6"])
+
+    def test_nothing_is_logged_when_the_log_is_closed(self):
+        _packetlog.close_packet_log()
+        _packetlog.log_packet(b"ignored", conftest.global_test_time)
+        self.assertEqual(list(_packetlog.read_packet_log(self.path)), [])
+
+
+class TestReplayPacketLog(TestCase):
+    def setUp(self):
+        conftest.initialize_database()
+        _dataprocessing.last_packet_info.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "packets.bin")
+
+    def tearDown(self):
+        _packetlog.close_packet_log()
+        self.directory.cleanup()
+        conftest.kill_database()
+
+    def record_packets(self, clock_step_ns=0):
+        _packetlog.open_packet_log(self.path)
+        for rx_packet in [
+            conftest.rx_data_CRC_good,
+            conftest.rx_data_CRC_good,
+            b"bad_data",
+        ]:
+            _dataprocessing.enqueue_packet(rx_packet)
+            _dataprocessing.process_radio_data()
+        _packetlog.close_packet_log()
+        while not _dbwriter.write_q.empty():
+            _dbwriter.process_write_queue()
+        with patch.dict(
+            clock._anchor,
+            offset_ns=clock.read_anchor() + clock_step_ns,
+            monotonic_ns=time.monotonic_ns(),
+        ):
+            _dbwriter.flush_buffer()
+
+    def test_received_packets_are_logged_and_replayed_into_the_database(self):
+        self.record_packets()
+        conftest.kill_database()
+        conftest.initialize_database()
+        report = _dataprocessing.replay_packet_log(
+            _packetlog.packet_log_files(self.path)
+        )
+        self.assertEqual(report["packets"], 3)
+        self.assertEqual(report["queued"], 1)
+        self.assertEqual(report["rows"], 9)
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 9)
+
+    def test_packets_already_stored_are_skipped(self):
+        self.record_packets()
+        report = _dataprocessing.replay_packet_log(
+            _packetlog.packet_log_files(self.path)
+        )
+        self.assertEqual(report["packets"], 3)
+        self.assertEqual(report["queued"], 0)
+        self.assertEqual(report["skipped"], 1)
+        self.assertEqual(report["rows"], 0)
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 9)
+
+    def test_packets_stored_after_a_clock_step_are_skipped(self):
+        self.record_packets(clock_step_ns=5_000_000)
+        report = _dataprocessing.replay_packet_log(
+            _packetlog.packet_log_files(self.path)
+        )
+        self.assertEqual(report["skipped"], 1)
+        self.assertEqual(report["rows"], 0)
+
+    def test_a_failed_database_write_stops_the_replay(self):
+        self.record_packets()
+        conftest.kill_database()
+        conftest.initialize_database()
+        with patch(
+            "database.database.write_sensor_readings_to_db",
+            side_effect=ConnectionError("database went away"),
+        ):
+            with self.assertRaises(ConnectionError):
+                _dataprocessing.replay_packet_log(
+                    _packetlog.packet_log_files(self.path)
+                )
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 0)
+        _dbwriter.flush_buffer()  # The batch the spool could not take is kept
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 9)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import queue
+import socket
+import tempfile
+from unittest import TestCase
+
+from datarecorder import _packetlog, _packetsources
+from helpers import radiohelper
+from tests import conftest
+
+
+class TestSocketSource(TestCase):
+    def setUp(self):
+        self.received = queue.Queue()
+
+    def test_udp_datagrams_are_delivered(self):
+        source = _packetsources.SocketSource(("127.0.0.1", 0))
+        source.start(self.received.put)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            sender.sendto(conftest.rx_data_CRC_good, source.bound_address)
+        self.assertEqual(self.received.get(timeout=5), conftest.rx_data_CRC_good)
+        source.stop()
+
+    def test_unix_datagrams_are_delivered_and_socket_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "packets.sock")
+            source = _packetsources.SocketSource(path)
+            source.start(self.received.put)
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+                sender.sendto(b"packet", path)
+            self.assertEqual(self.received.get(timeout=5), b"packet")
+            source.stop()
+            self.assertFalse(os.path.exists(path))
+
+
+class TestReplaySource(TestCase):
+    def test_logged_packets_are_delivered_in_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "packets.bin")
+            _packetlog.open_packet_log(path)
+            for rx_packet in [b"first", b"second"]:
+                _packetlog.log_packet(rx_packet, conftest.global_test_time)
+            _packetlog.close_packet_log()
+            received = []
+            source = _packetsources.ReplaySource(paths=[path], speed=None)
+            source.start(lambda *args, **kwargs: received.append((args, kwargs)))
+            source.join(timeout=5)
+        self.assertEqual(
+            received,
+            [
+                ((x,), {"timestamp": conftest.global_test_time})
+                for x in [b"first", b"second"]
+            ],
+        )
+
+
+class TestSyntheticSource(TestCase):
+    def test_packets_decode_with_serials_counting_up_per_node(self):
+        received = []
+        source = _packetsources.SyntheticSource(nodes=2, rate=None, count=6, seed=1)
+        source.start(received.append)
+        source.join(timeout=5)
+        codec = radiohelper.PacketCodec()
+        packets = [codec.decode(rx_packet) for rx_packet in received]
+        self.assertEqual(
+            [(x.node_id, x.pkt_serial) for x in packets],
+            [(1, 0), (2, 0), (1, 1), (2, 1), (1, 2), (2, 2)],
+        )
+        self.assertEqual(
+            list(packets[1].sensor_ids), list(range(2 * radiohelper.SENSOR_COUNT, 30))
+        )
+
+
+class TestCreatePacketSource(TestCase):
+    def test_options_override_the_configured_options(self):
+        source = _packetsources.create_packet_source("synthetic", rate=5.0)
+        self.assertIsInstance(source, _packetsources.SyntheticSource)
+        self.assertEqual(source.rate, 5.0)
+        self.assertEqual(source.nodes, 4)
+
+    def test_rfm69_source_does_not_import_the_radio_libraries(self):
+        source = _packetsources.create_packet_source("rfm69", irq_pin=6)
+        self.assertIsInstance(source, _packetsources.Rfm69Source)
+        self.assertEqual(source.irq_pin, 6)
+
+    def test_unknown_source_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            _packetsources.create_packet_source("carrier pigeon")
+
+    def test_a_source_without_a_run_method_cannot_be_created(self):
+        class Silent(_packetsources._ThreadedSource):
+            pass
+
+        with self.assertRaises(TypeError):
+            Silent()
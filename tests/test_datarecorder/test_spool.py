@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from array import array
+from datetime import datetime
+from sqlalchemy.exc import OperationalError
+
+from datarecorder import _dbwriter, _spool
+from database import database
+from helpers import radiohelper
+from tests import conftest
+
+
+def make_packet(pkt_serial, timestamp=datetime(2021, 3, 4, 5, 6, 7, 891011)):
+    return radiohelper.DecodedPacket(
+        node_id=0x01,
+        pkt_serial=pkt_serial,
+        sensor_ids=array("B", [1, 2]),
+        readings=array("f", [1.5, -2.5]),
+        timestamp=timestamp,
+    )
+
+
+def database_unavailable(function_name):
+    """Patch a database write function to fail as if the server were down."""
+    error = OperationalError("INSERT", {}, Exception("could not connect to server"))
+    return patch.object(database, function_name, side_effect=error)
+
+
+class SpoolTestCase(TestCase):
+    """Tests against a fresh database and an in-memory spool."""
+
+    def setUp(self):
+        conftest.initialize_database()
+        _spool.open_spool(":memory:")
+
+    def tearDown(self):
+        _dbwriter.flush_buffer()
+        _spool.close_spool()
+        conftest.kill_database()
+
+
+class TestSpool(SpoolTestCase):
+    def test_spooled_readings_are_replayed_to_the_database(self):
+        start = _spool.get_spool_metrics()
+        self.assertEqual(_spool.spool_packets([make_packet(1), make_packet(2)]), 4)
+        self.assertEqual(_spool.get_spool_metrics()["depth"], 4)
+        self.assertEqual(_spool.drain_spool(batch_rows=3), 3)
+        self.assertEqual(_spool.drain_spool(batch_rows=3), 1)
+        self.assertEqual(_spool.drain_spool(batch_rows=3), 0)
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 4)
+        self.assertEqual(
+            database.latest_reading(2), (datetime(2021, 3, 4, 5, 6, 7, 891011), -2.5)
+        )
+        metrics = _spool.get_spool_metrics()
+        self.assertEqual(metrics["depth"], 0)
+        self.assertEqual(metrics["spooled_rows"], start["spooled_rows"] + 4)
+        self.assertEqual(metrics["replayed_rows"], start["replayed_rows"] + 4)
+        self.assertGreater(metrics["replay_rows_per_second"], 0)
+
+    def test_readings_stay_spooled_while_the_database_is_unavailable(self):
+        _spool.spool_packets([make_packet(1)])
+        with database_unavailable("write_reading_rows_to_db"):
+            with self.assertRaises(OperationalError):
+                _spool.drain_spool()
+        self.assertEqual(_spool.get_spool_metrics()["depth"], 2)
+        self.assertEqual(_spool.drain_spool(), 2)
+
+    def test_spool_survives_a_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "spool.sqlite3")
+            _spool.open_spool(path)
+            _spool.spool_packets([make_packet(1)])
+            _spool.close_spool()
+            self.assertEqual(_spool.open_spool(path), 2)
+            self.assertEqual(_spool.drain_spool(), 2)
+            _spool.close_spool()
+
+
+class TestWriterSpoolsFailedBatches(SpoolTestCase):
+    def test_failed_batch_is_spooled(self):
+        _dbwriter.write_packet_to_queue(make_packet(1))
+        _dbwriter.process_write_queue()
+        with database_unavailable("write_sensor_readings_to_db"):
+            self.assertEqual(_dbwriter.flush_buffer(), 0)
+        self.assertEqual(_spool.get_spool_metrics()["depth"], 2)
+        self.assertEqual(_dbwriter.get_writer_metrics()["buffered_rows"], 0)
+        _spool.drain_spool()
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 2)
+
+    def test_batch_is_kept_in_memory_if_spooling_fails(self):
+        _spool.close_spool()
+        _dbwriter.write_packet_to_queue(make_packet(1))
+        _dbwriter.process_write_queue()
+        with database_unavailable("write_sensor_readings_to_db"):
+            _dbwriter.flush_buffer()
+        self.assertEqual(_dbwriter.get_writer_metrics()["buffered_rows"], 2)
+        self.assertEqual(_dbwriter.flush_buffer(), 2)
+
+
+class TestSpooledEvents(SpoolTestCase):
+    def setUp(self):
+        super().setUp()
+        database.add_node(0x05, "Gate")
+        self.time = datetime(2021, 3, 4, 5, 6, 7, 891011)
+
+    def events(self):
+        return database.get_events(0x05, datetime(2021, 1, 1), datetime(2022, 1, 1))
+
+    def test_events_of_a_failed_batch_are_spooled_and_survive_a_restart(self):
+        packet = make_packet(1, self.time)
+        packet.node_id, packet.status_register = 0x05, 0x0006
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "spool.sqlite3")
+            _spool.open_spool(path)
+            _dbwriter.write_packet_to_queue(packet)
+            _dbwriter.process_write_queue()
+            with database_unavailable("write_sensor_readings_to_db"):
+                _dbwriter.flush_buffer()
+            _spool.close_spool()
+            self.assertEqual(_spool.open_spool(path), 4)
+            self.assertEqual(_spool.drain_spool(), 4)
+            _spool.close_spool()
+        self.assertEqual(self.events(), [(self.time, 1), (self.time, 2)])
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 2)
+
+    def test_events_the_database_refuses_are_dropped_not_retried_forever(self):
+        write = database.write_reading_rows_to_db
+
+        def refuse_event_3(rows, event_rows=()):
+            if any(x[2] == 3 for x in event_rows):
+                raise ValueError("bad event")
+            return write(rows, event_rows)
+
+        _spool.spool_packets(
+            [make_packet(1)], [(self.time, 0x05, 3), (self.time, 0x05, 4)]
+        )
+        with patch.object(
+            database, "write_reading_rows_to_db", side_effect=refuse_event_3
+        ), self.assertLogs(_spool.logger, "ERROR"):
+            self.assertEqual(_spool.drain_spool(), 4)
+        self.assertEqual(self.events(), [(self.time, 4)])
+        self.assertEqual(conftest.count_all_sensor_reading_records(), 2)
+        self.assertEqual(_spool.get_spool_metrics()["depth"], 0)
+
+    def test_events_stay_spooled_while_the_database_is_unavailable(self):
+        _spool.spool_packets([], [(self.time, 0x05, 3)])
+        with database_unavailable("write_reading_rows_to_db"), patch.object(
+            database, "database_is_available", return_value=False
+        ):
+            with self.assertRaises(OperationalError):
+                _spool.drain_spool()
+        self.assertEqual(_spool.get_spool_metrics()["depth"], 1)
+        self.assertEqual(_spool.drain_spool(), 1)
+        self.assertEqual(self.events(), [(self.time, 3)])
@@ -6,24 +6,27 @@ from unittest.mock import call
 import adafruit_rfm69
 import busio
 import digitalio
-from helpers import display
-from datarecorder import _dataprocessing, main
+from helpers import display, radiohelper
+from datarecorder import _dataprocessing, _packetsources, main
 
 
 class TestOledMessagesInMain:
 
     def test_message_from_init_radio(self, mocker):
         mock_write_message_to_queue = mocker.patch.object(main, "oled_message")
+        mock_source_message = mocker.patch.object(_packetsources, "oled_message")
         _1 = mocker.patch.object(adafruit_rfm69, "RFM69")
         _2 = mocker.patch.object(digitalio, "DigitalInOut")
         _3 = mocker.patch.object(busio, "SPI")
-        _4 = mocker.patch.object(main, "initialize_gpio_interrupt", autospec=True)
+        _4 = mocker.patch.object(
+            _packetsources.Rfm69Source, "initialize_gpio_interrupt", autospec=True
+        )
         _5 = mocker.patch.object(main, "initialize_processing_thread", autospec=True)
         _6 = mocker.patch.object(main, "initialize_database", autospec=True)
         _7 = mocker.patch.object(main, "initialize_logging", autospec=True)
     
-        main.start_up()
-        mock_write_message_to_queue.assert_any_call("Radio initialized OK")
+        main.start_up(source=_packetsources.Rfm69Source(24))
+        mock_source_message.assert_any_call("Radio initialized OK")
         mock_write_message_to_queue.assert_any_call("Waiting for data...")
 
 
@@ -31,7 +34,7 @@ class TestOledMessageProcessdata:
     def test_message_sent_when_packet_written(self, mocker):
         mock_write_message_to_queue = mocker.patch.object(_dataprocessing, "oled_message")
         _dataprocessing.last_packet_info = {0x02: {"pkt_serial": 0x0000}}
-        node_data = {"node_id": 0x02, "pkt_serial": 0x0001}
+        node_data = radiohelper.DecodedPacket(node_id=0x02, pkt_serial=0x0001)
         _dataprocessing.packet_missing_or_duplicate(node_data)
         mock_write_message_to_queue.assert_called_with("Rx 0x02 sn 0x0001")
     
@@ -39,7 +42,7 @@ class TestOledMessageProcessdata:
     def test_message_sent_when_first_packet_received(self, mocker):
         mock_write_message_to_queue = mocker.patch.object(_dataprocessing, "oled_message")
         _dataprocessing.last_packet_info = {}
-        node_data = {"node_id": 0x01, "pkt_serial": 0x0001}
+        node_data = radiohelper.DecodedPacket(node_id=0x01, pkt_serial=0x0001)
         _dataprocessing.packet_missing_or_duplicate(node_data)
         calls = [call("First data node 0x01"), call("Rx 0x01 sn 0x0001")]
         mock_write_message_to_queue.assert_has_calls(calls)
@@ -48,7 +51,7 @@ class TestOledMessageProcessdata:
     def test_message_sent_when_packet_missing(self, mocker):
         mock_write_message_to_queue = mocker.patch.object(_dataprocessing, "oled_message")
         _dataprocessing.last_packet_info = {0x01: {"pkt_serial": 0x0000}}
-        node_data = {"node_id": 0x01, "pkt_serial": 0x0002}
+        node_data = radiohelper.DecodedPacket(node_id=0x01, pkt_serial=0x0002)
         _dataprocessing.packet_missing_or_duplicate(node_data)
         calls = [call("*Data missing from node 0x01*"), call("Rx 0x01 sn 0x0002")]
         mock_write_message_to_queue.assert_has_calls(calls)
@@ -56,11 +59,9 @@ class TestOledMessageProcessdata:
     
     def test_message_sent_when_bad_packet_received(self, mocker):
         mock_write_message_to_queue = mocker.patch.object(_dataprocessing, "oled_message")
-        mock_unpack_data_packet = mocker.patch.object(
-            _dataprocessing, "unpack_data_packet"
-        )
+        mock_decode = mocker.patch.object(_dataprocessing.codec, "decode")
         mock_radio_q = mocker.patch.object(_dataprocessing, "radio_q")
-        mock_radio_q.get.return_value = None
-        mock_unpack_data_packet.side_effect = [ValueError]
+        mock_radio_q.get.return_value = (0, None, None)
+        mock_decode.side_effect = [ValueError]
         _dataprocessing.process_radio_data()
         mock_write_message_to_queue.assert_called_once_with("*Bad data packet Rx*")
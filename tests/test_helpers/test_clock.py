@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+from datetime import datetime
+from unittest import TestCase, mock
+
+from helpers import clock
+
+
+class _Packet:
+    def __init__(self, timestamp, stamps):
+        self.timestamp = timestamp
+        self.stamps = stamps
+
+
+class TestToUtc(TestCase):
+    def test_a_stamp_taken_now_converts_to_now(self):
+        difference = clock.to_utc(time.monotonic_ns()) - datetime.utcnow()
+        self.assertLess(abs(difference.total_seconds()), 0.01)
+
+    def test_an_old_anchor_is_read_again(self):
+        clock.read_anchor()
+        clock._anchor["offset_ns"] += 3600 * 1_000_000_000
+        self.assertGreater(clock.to_utc(time.monotonic_ns()), datetime.utcnow())
+        with mock.patch.object(clock, "CLOCK_ANCHOR_SECONDS", 0):
+            difference = clock.to_utc(time.monotonic_ns()) - datetime.utcnow()
+        self.assertLess(abs(difference.total_seconds()), 0.01)
+
+
+class TestFillTimestamps(TestCase):
+    def test_only_packets_without_a_timestamp_are_filled(self):
+        stamp = time.monotonic_ns()
+        logged = datetime(2020, 1, 1)
+        packets = [
+            _Packet(None, (stamp,)),
+            _Packet(logged, (stamp,)),
+            _Packet(None, None),
+        ]
+        clock.fill_timestamps(packets)
+        self.assertEqual(packets[0].timestamp, clock.to_utc(stamp))
+        self.assertEqual(packets[1].timestamp, logged)
+        self.assertIsNone(packets[2].timestamp)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import urllib.error
+import urllib.request
+from unittest import TestCase
+
+from helpers import metrics
+
+
+class TestHistogram(TestCase):
+    def setUp(self):
+        self.histogram = metrics.Histogram()
+
+    def test_empty_histogram_has_no_percentiles(self):
+        self.assertEqual(
+            self.histogram.summary(),
+            {
+                "count": 0,
+                "mean": None,
+                "max": None,
+                "p50": None,
+                "p95": None,
+                "p99": None,
+            },
+        )
+
+    def test_percentiles_are_within_one_bucket_of_the_true_value(self):
+        for millisecond in range(1, 1001):
+            self.histogram.record(millisecond / 1000)
+        for percent in (50, 95, 99):
+            true_value = percent / 100
+            self.assertGreaterEqual(self.histogram.percentile(percent), true_value)
+            self.assertLess(self.histogram.percentile(percent), true_value * 1.19)
+        self.assertEqual(self.histogram.percentile(100), 1.0)
+        self.assertAlmostEqual(self.histogram.summary()["mean"], 0.5005)
+
+    def test_values_beyond_the_last_bound_report_the_maximum(self):
+        self.histogram.record(1e9)
+        self.assertEqual(self.histogram.percentile(99), 1e9)
+
+    def test_reset_forgets_values(self):
+        self.histogram.record(0.1)
+        self.histogram.reset()
+        self.assertEqual(self.histogram.count, 0)
+        self.assertIsNone(self.histogram.percentile(50))
+
+
+class TestRegistry(TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_metrics_are_rendered_in_the_text_exposition_format(self):
+        packets = self.registry.counter("packets_total", "Packets", ("node",))
+        packets.inc("0x01")
+        packets.inc("0x01", amount=2)
+        self.registry.gauge("queue_depth", "Queue depth", function=lambda: 7)
+        latency = self.registry.summary("latency_seconds", "Latency", ("stage",))
+        latency.observe(0.5, "decode")
+        self.assertEqual(
+            self.registry.render().splitlines(),
+            [
+                "# HELP latency_seconds Latency",
+                "# TYPE latency_seconds summary",
+                'latency_seconds{stage="decode",quantile="0.5"} 0.5',
+                'latency_seconds{stage="decode",quantile="0.95"} 0.5',
+                'latency_seconds{stage="decode",quantile="0.99"} 0.5',
+                'latency_seconds_sum{stage="decode"} 0.5',
+                'latency_seconds_count{stage="decode"} 1',
+                "# HELP packets_total Packets",
+                "# TYPE packets_total counter",
+                'packets_total{node="0x01"} 3.0',
+                "# HELP queue_depth Queue depth",
+                "# TYPE queue_depth gauge",
+                "queue_depth 7.0",
+            ],
+        )
+
+    def test_label_values_are_escaped(self):
+        gauge = self.registry.gauge("names", "Names", ("name",))
+        gauge.set(1, 'a "b"\\c')
+        self.assertIn('names{name="a \\"b\\"\\\\c"} 1.0', self.registry.render())
+
+    def test_registering_a_name_again_returns_the_same_metric(self):
+        counter = self.registry.counter("things_total", "Things")
+        self.assertIs(self.registry.counter("things_total", "Things"), counter)
+        with self.assertRaises(ValueError):
+            self.registry.gauge("things_total", "Things")
+
+    def test_metrics_are_served_over_http(self):
+        self.registry.counter("scrapes_total", "Scrapes").inc()
+        server = metrics.start_http_server("127.0.0.1", 0, registry=self.registry)
+        port = server.server_address[1]
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as reply:
+                self.assertIn("text/plain", reply.headers["Content-Type"])
+                self.assertIn("scrapes_total 1.0", reply.read().decode())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/other")
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import queue
+import time
+from unittest import TestCase
+
+from helpers.scheduler import Scheduler
+
+
+class TestScheduler(TestCase):
+    def setUp(self):
+        self.ran = queue.Queue()
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.scheduler.shutdown(timeout=5)
+
+    def test_actions_run_in_due_order_without_blocking_the_caller(self):
+        start = time.monotonic()
+        self.scheduler.schedule(0.2, self.ran.put, "late")
+        self.scheduler.schedule(0.1, self.ran.put, "early")
+        self.assertLess(time.monotonic() - start, 0.05)
+        self.assertEqual(self.scheduler.pending, 2)
+        self.assertEqual(self.ran.get(timeout=5), "early")
+        self.assertEqual(self.ran.get(timeout=5), "late")
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(self.scheduler.pending, 0)
+        self.assertEqual(self.scheduler.lateness.count, 2)
+
+    def test_cancelled_actions_do_not_run(self):
+        self.scheduler.schedule(0.1, self.ran.put, "open", key="gate")
+        self.scheduler.schedule(0.1, self.ran.put, "open again", key="gate")
+        handle = self.scheduler.schedule(0.1, self.ran.put, "light")
+        self.scheduler.schedule(0.2, self.ran.put, "done")
+        self.assertEqual(self.scheduler.cancel("gate"), 2)
+        self.assertTrue(self.scheduler.cancel_action(handle))
+        self.assertEqual(self.scheduler.pending, 1)
+        self.assertEqual(self.ran.get(timeout=5), "done")
+        self.assertTrue(self.ran.empty())
+        self.assertFalse(self.scheduler.cancel_action(handle))
+
+    def test_a_failing_action_does_not_stop_the_scheduler(self):
+        self.scheduler.schedule(0, lambda: 1 / 0)
+        self.scheduler.schedule(0.01, self.ran.put, "after")
+        self.assertEqual(self.ran.get(timeout=5), "after")
+
+    def test_shutdown_drops_pending_actions(self):
+        self.scheduler.schedule(60, self.ran.put, "never")
+        self.assertEqual(self.scheduler.shutdown(timeout=5), 1)
+        self.assertEqual(self.scheduler.pending, 0)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import queue
+import socket
+from unittest import TestCase
+
+from helpers.webhooks import WebhookDispatcher
+from tests.standin_server import StandinServer
+
+
+class TestWebhookDispatcher(TestCase):
+    def setUp(self):
+        self.results = queue.Queue()
+        self.dispatcher = WebhookDispatcher(timeout=0.2, retries=2, backoff=0.01)
+        self.dispatcher.start()
+
+    def tearDown(self):
+        self.dispatcher.shutdown(timeout=5)
+
+    def test_connection_is_kept_alive(self):
+        server = StandinServer()
+        for index in range(20):
+            self.dispatcher.submit(f"{server.url}/hook?n={index}", self.results.put)
+        self.assertEqual([self.results.get(timeout=5) for _ in range(20)], [200] * 20)
+        self.assertEqual(len(server.requests), 20)
+        self.assertEqual(server.connections, 1)
+        server.stop()
+
+    def test_server_errors_are_retried(self):
+        server = StandinServer(fail=2)
+        self.dispatcher.submit(f"{server.url}/hook", self.results.put)
+        self.assertEqual(self.results.get(timeout=5), 200)
+        self.assertEqual(server.requests, ["/hook"] * 3)
+        server.stop()
+
+    def test_a_retried_request_stays_ahead_of_later_requests(self):
+        server = StandinServer(fail=1)
+        self.dispatcher.submit(f"{server.url}/open", self.results.put)
+        self.dispatcher.submit(f"{server.url}/close", self.results.put)
+        self.assertEqual([self.results.get(timeout=5) for _ in range(2)], [200, 200])
+        self.assertEqual(server.requests, ["/open", "/open", "/close"])
+        server.stop()
+
+    def test_a_failing_callback_does_not_stop_the_worker(self):
+        server = StandinServer()
+
+        def failing_callback(result):
+            raise RuntimeError(f"callback got {result}")
+
+        self.dispatcher.submit(f"{server.url}/first", failing_callback)
+        self.dispatcher.submit(f"{server.url}/second", self.results.put)
+        self.assertEqual(self.results.get(timeout=5), 200)
+        self.assertEqual(server.requests, ["/first", "/second"])
+        server.stop()
+
+    def test_the_last_result_is_reported_when_retries_run_out(self):
+        server = StandinServer(fail=5)
+        self.dispatcher.submit(f"{server.url}/hook", self.results.put)
+        self.assertEqual(self.results.get(timeout=5), 503)
+        self.assertEqual(len(server.requests), 3)
+        server.stop()
+
+    def test_a_server_that_never_answers_times_out(self):
+        with socket.socket() as listener:
+            listener.bind(("127.0.0.1", 0))
+            listener.listen()
+            port = listener.getsockname()[1]
+            self.dispatcher.submit(f"http://127.0.0.1:{port}/hook", self.results.put)
+            self.assertIsInstance(self.results.get(timeout=5), socket.timeout)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from unittest import TestCase
+from unittest import TestCase, skipIf
 import struct
 from Datarecorder.helpers import radiohelper
 
@@ -117,3 +117,114 @@ class TestDecodeData(TestCase):
         crc = radiohelper.crc16(test_data)
         test_data_with_crc = radiohelper.append_crc(test_data)
         self.assertEqual(test_data_with_crc[-2:], split_crc_result_into_bytes(crc))
+
+
+def bitwise_crc16(bytes_data):
+    crc = 0xFFFF
+    for byte in bytes_data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if (crc & 0x8000) > 0:
+                crc = (crc << 1) ^ 0x1021
+            else:
+                crc = crc << 1
+    return crc & 0xFFFF
+
+
+class TestCrcBackends(TestCase):
+    def tearDown(self):
+        radiohelper.set_crc_backend("binascii")
+
+    def test_crc_table_has_256_entries(self):
+        self.assertEqual(len(radiohelper.CRC16_TABLE), 256)
+        self.assertEqual(radiohelper.CRC16_TABLE[1], 0x1021)
+
+    def test_all_backends_match_the_bitwise_crc(self):
+        test_data = [
+            b"",
+            b"123456789",
+            RX_DATA_GOOD_CRC,
+            RX_DATA_BAD_CRC,
+            bytes(range(256)),
+        ]
+        for name in radiohelper.CRC_BACKENDS:
+            radiohelper.set_crc_backend(name)
+            for data in test_data:
+                self.assertEqual(radiohelper.crc16(data), bitwise_crc16(data))
+            self.assertTrue(radiohelper.check_crc(bytearray(RX_DATA_GOOD_CRC)))
+            self.assertFalse(radiohelper.check_crc(memoryview(RX_DATA_BAD_CRC)))
+
+    def test_set_crc_backend_raises_valueerror_for_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            radiohelper.set_crc_backend("abacus")
+
+    @skipIf(radiohelper.numpy is None, "NumPy not installed")
+    def test_check_crc_batch_checks_every_packet(self):
+        packets = [RX_DATA_GOOD_CRC, RX_DATA_BAD_CRC, RX_DATA_GOOD_CRC]
+        result = radiohelper.check_crc_batch([list(x) for x in packets])
+        self.assertEqual(list(result), [True, False, True])
+        crcs = radiohelper.crc16_batch([list(x[:-2]) for x in packets])
+        self.assertEqual(
+            [int(x) for x in crcs], [bitwise_crc16(x[:-2]) for x in packets]
+        )
+
+
+class TestPacketCodec(TestCase):
+    def setUp(self):
+        self.codec = radiohelper.PacketCodec()
+
+    def test_packet_size_includes_crc(self):
+        self.assertEqual(self.codec.packet_size, radiohelper.PACKET_LENGTH + 2)
+
+    def test_unpack_returns_the_values_in_the_packet(self):
+        returned_result = self.codec.unpack(RX_DATA_GOOD_CRC)
+        self.assertEqual(len(returned_result), len(DUMMY_DATA))
+        for value, expected in zip(returned_result, DUMMY_DATA):
+            self.assertAlmostEqual(value, expected, places=2)
+
+    def test_unpack_raises_valueerror_for_bad_crc_or_length(self):
+        for bad_packet in (RX_DATA_BAD_CRC, b"bad_data", RX_DATA_GOOD_CRC + b"\x00"):
+            with self.assertRaises(ValueError):
+                self.codec.unpack(bad_packet)
+
+    def test_decode_returns_decoded_packet_without_padding_sensors(self):
+        returned_result = self.codec.decode(bytearray(RX_DATA_GOOD_CRC))
+        self.assertIsInstance(returned_result, radiohelper.DecodedPacket)
+        self.assertEqual(returned_result.node_id, 0x0A)
+        self.assertEqual(returned_result.pkt_serial, 0x0A0A)
+        self.assertEqual(returned_result.status_register, 0xF0F0)
+        self.assertEqual(len(returned_result), SENSOR_COUNT - 1)
+        self.assertEqual(list(returned_result.sensor_ids), list(range(0x09)))
+        self.assertEqual(
+            list(returned_result.readings),
+            list(self.codec.unpack(RX_DATA_GOOD_CRC)[7:-2:2]),
+        )
+
+    def test_decode_keeps_timestamp(self):
+        returned_result = self.codec.decode(RX_DATA_GOOD_CRC, timestamp="Timestamp")
+        self.assertEqual(returned_result.timestamp, "Timestamp")
+
+    def test_iter_unpack_skips_bad_packets(self):
+        buffer = RX_DATA_GOOD_CRC + RX_DATA_BAD_CRC + RX_DATA_GOOD_CRC
+        returned_result = list(self.codec.iter_unpack(buffer))
+        self.assertEqual(len(returned_result), 2)
+        self.assertEqual(returned_result[0], self.codec.unpack(RX_DATA_GOOD_CRC))
+
+    def test_iter_unpack_raises_valueerror_for_partial_packets(self):
+        with self.assertRaises(ValueError):
+            list(self.codec.iter_unpack(RX_DATA_GOOD_CRC + b"\x00"))
+
+    def test_encode_is_the_inverse_of_decode(self):
+        decoded = self.codec.decode(RX_DATA_GOOD_CRC)
+        encoded = self.codec.encode(
+            decoded.node_id,
+            decoded.pkt_serial,
+            decoded.status_register,
+            decoded.sensor_readings(),
+        )
+        self.assertEqual(len(encoded), self.codec.packet_size)
+        self.assertEqual(repr(self.codec.decode(encoded)), repr(decoded))
+
+    def test_encode_raises_valueerror_for_too_many_readings(self):
+        with self.assertRaises(ValueError):
+            self.codec.encode(1, 1, sensor_readings=[(1, 0.0)] * (SENSOR_COUNT + 1))